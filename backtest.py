@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+"""
+Backtest the selection and seeding logic of Bracketeer.get_tourney_teams
+against the fields the committee actually picked.
+
+Each season lives in its own directory under a backtest root:
+
+    backtest/
+        2019/
+            compare.csv   archived Massey compare.csv from Selection Sunday
+            field.csv     actual field: Team, seed and optionally bid
+                          ('auto' or 'at-large'), using Massey team names
+            kenpom.csv    optional archived ratings csvs, named like the
+            bpi.csv       files in csv_files/, used by use_metrics configs
+            ...
+
+Configurations are plain dicts of get_tourney_teams settings:
+
+    {"name": "computer only", "comp_polls": ["POM", "SAG"],
+     "human_polls": false, "use_metrics": false,
+     "comp_weight": 3, "human_weight": 1, "poll_weights": {"POM": 2}}
+
+A configs file holds a JSON list of these, or {"grid": {key: [values]}} to
+run every combination of the listed values.
+
+Seasons are spread across a process pool. Every worker receives the configs
+once when it starts, parses each of its seasons' compare.csv once and runs
+every config against it.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+import contextlib
+import io
+import itertools
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import progress
+from metrics import Bracketeer, weighted_rank_calc
+from ratings import get_sources
+
+# keys of a config that are passed straight to get_tourney_teams
+CONFIG_KEYS = ['comp_polls', 'use_metrics', 'human_polls', 'poll_weights']
+
+# number of teams on each side of the at-large cut line scored as the bubble
+BUBBLE_SIZE = 4
+
+
+def load_configs(path=None):
+    """
+    Reads a configs file. With no path, returns the default configuration
+    """
+    if path is None:
+        return [{'name': 'default'}]
+
+    with open(path) as f:
+        configs = json.load(f)
+
+    if isinstance(configs, dict) and 'grid' in configs:
+        grid = configs['grid']
+        keys = list(grid)
+        configs = []
+        for values in itertools.product(*(grid[k] for k in keys)):
+            config = dict(zip(keys, values))
+            config['name'] = ','.join('{}={}'.format(k, json.dumps(v))
+                for k, v in zip(keys, values))
+            configs.append(config)
+
+    for i, config in enumerate(configs):
+        config.setdefault('name', 'config_{}'.format(i))
+
+    return configs
+
+
+def config_kwargs(config):
+    """
+    get_tourney_teams keyword arguments for a config. comp_weight and
+    human_weight become a weighted_rank_calc rank_calc_func.
+    """
+    kwargs = {k: config[k] for k in CONFIG_KEYS if k in config}
+    if 'comp_weight' in config or 'human_weight' in config:
+        kwargs['rank_calc_func'] = partial(weighted_rank_calc,
+            comp_weight=config.get('comp_weight', 3.),
+            human_weight=config.get('human_weight', 1.))
+    return kwargs
+
+
+def find_seasons(root):
+    """
+    Returns the season directories under root holding both a compare.csv
+    and a field.csv, sorted by name
+    """
+    seasons = []
+    for name in sorted(os.listdir(root)):
+        season_dir = os.path.join(root, name)
+        if os.path.isfile(os.path.join(season_dir, 'compare.csv')) and \
+                os.path.isfile(os.path.join(season_dir, 'field.csv')):
+            seasons.append(season_dir)
+    return seasons
+
+
+def load_field(season_dir):
+    """
+    Returns the actual field of a season as a DataFrame with Team, seed
+    and bid columns. bid is NaN when the file doesn't record it.
+    """
+    field = pd.read_csv(os.path.join(season_dir, 'field.csv'))
+    field['Team'] = field['Team'].str.strip()
+    if 'bid' not in field.columns:
+        field['bid'] = np.nan
+    return field
+
+
+def score_selection(bracket, field):
+    """
+    Compares the field selected by bracket.get_tourney_teams with the actual
+    field.
+
+    Outputs:
+        Dictionary with
+        field_overlap: share of the actual field that was selected
+        seed_error: mean absolute seed line error over correctly selected
+            teams
+        exact_seeds: share of correctly selected teams on the right line
+        bubble_accuracy: share of the teams around the predicted cut line
+            (last BUBBLE_SIZE at-large teams in and the first BUBBLE_SIZE
+            out) whose in/out call matches the actual field
+    """
+    actual_seeds = dict(zip(field['Team'], field['seed']))
+    predicted_seeds = dict(zip(bracket.final_68['Team'],
+        bracket.final_68['seed']))
+
+    selected = [t for t in predicted_seeds if t in actual_seeds]
+    seed_diff = np.abs(np.array([predicted_seeds[t] - actual_seeds[t]
+        for t in selected], dtype=float))
+
+    # the teams without an auto bid in rank order, around the last at-large
+    summary = bracket.summary_df
+    others = summary['Team'].values[
+        ~summary['Team'].isin(bracket.auto_bid_teams).values]
+    n_at_large = len(bracket.at_large_teams)
+    bubble = list(others[max(n_at_large - BUBBLE_SIZE, 0):
+        n_at_large + BUBBLE_SIZE])
+    bubble_correct = [(t in predicted_seeds) == (t in actual_seeds)
+        for t in bubble]
+
+    return {
+        'field_overlap': len(selected) / float(len(actual_seeds)),
+        'seed_error': seed_diff.mean() if len(seed_diff) else np.nan,
+        'exact_seeds': (seed_diff == 0).mean() if len(seed_diff) else np.nan,
+        'bubble_accuracy': np.mean(bubble_correct) if bubble else np.nan,
+    }
+
+
+def _conf_winners(bracket, field):
+    """
+    Auto bids recorded in the actual field, keyed by conference
+    """
+    auto = field.loc[field['bid'] == 'auto', 'Team']
+    conf = dict(zip(bracket.team_data_df['Team'], bracket.team_data_df['Conf']))
+    return {conf[t]: t for t in auto if t in conf} or None
+
+
+def _season_sources(season_dir):
+    """
+    Registered ratings sources redirected to the archived csvs of a season
+    """
+    sources = []
+    for source in get_sources():
+        path = os.path.join(season_dir, os.path.basename(source.path))
+        if os.path.isfile(path):
+            sources.append(source.with_path(path))
+    return sources
+
+
+# Read-only state shared by every season a worker runs
+_CONFIGS = None
+
+
+def _init_worker(configs):
+    global _CONFIGS
+    _CONFIGS = configs
+
+
+def run_season(season_dir, configs=None):
+    """
+    Runs every config against one season. Returns a list of result dicts,
+    one per config. Configs that fail are recorded with their error instead
+    of stopping the season.
+    """
+    if configs is None:
+        configs = _CONFIGS
+
+    season = os.path.basename(os.path.normpath(season_dir))
+    field = load_field(season_dir)
+    bracket = Bracketeer(os.path.join(season_dir, 'compare.csv'),
+        skip_download=True)
+    bracket.ratings_sources = _season_sources(season_dir)
+    conf_winners = _conf_winners(bracket, field)
+
+    results = []
+    for config in configs:
+        row = {'season': season, 'config': config['name']}
+        kwargs = config_kwargs(config)
+        try:
+            # get_tourney_teams reports progress with print, which would
+            # swamp the output over thousands of configs
+            with contextlib.redirect_stdout(io.StringIO()):
+                bracket.get_tourney_teams(conf_winners=conf_winners, **kwargs)
+            row.update(score_selection(bracket, field))
+            row['error'] = None
+        except Exception as e:
+            row['error'] = '{}: {}'.format(type(e).__name__, e)
+        results.append(row)
+
+    return results
+
+
+def run_backtest(root, configs, max_workers=None):
+    """
+    Runs every config against every season under root in a process pool.
+
+    Outputs:
+        (per season results, per config aggregate) DataFrames. The aggregate
+        averages the scores over the seasons a config ran on and is sorted by
+        seed_error.
+    """
+    seasons = find_seasons(root)
+    if not seasons:
+        raise ValueError('No seasons with compare.csv and field.csv found in'
+            ' {}'.format(root))
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=max_workers,
+            initializer=_init_worker, initargs=(configs,)) as pool:
+        futures = [pool.submit(run_season, s) for s in seasons]
+        for future in progress.track(as_completed(futures), 'Seasons',
+                total=len(futures)):
+            rows.extend(future.result())
+
+    results = pd.DataFrame(rows).sort_values(['config', 'season'])
+    results = results.reset_index(drop=True)
+
+    return results, aggregate(results)
+
+
+def aggregate(results):
+    """
+    Averages scores per config over the seasons that ran without error
+    """
+    scores = ['field_overlap', 'seed_error', 'exact_seeds', 'bubble_accuracy']
+    ok = results[results['error'].isna()]
+    summary = ok.groupby('config')[scores].mean()
+    summary['seasons'] = ok.groupby('config').size()
+    summary['errors'] = results[results['error'].notna()] \
+        .groupby('config').size()
+    summary['errors'] = summary['errors'].fillna(0).astype(int)
+    return summary.sort_values('seed_error')
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+"""
+Batch runner for many custom bracket jobs against one snapshot.
+
+Jobs are JSON lines, one bracket per line:
+
+    {"id": "alice", "comp_polls": ["POM", "SAG"], "human_polls": false,
+     "formats": ["pdf", "csv"], "title": "Alice's Bracket"}
+
+Keys are the get_tourney_teams settings (comp_polls, conf_winners,
+use_metrics, human_polls, and poll_weights / comp_weight / human_weight as
+in backtest configs), formats (any of pdf, excel, csv, json; default pdf)
+and title. id names the output files (default: the line number). json is
+the compact export of export.py.
+
+The snapshot is parsed once in the parent and handed to every worker
+process by the pool initializer, so each worker unpickles it once instead
+of once per job. Jobs with identical settings run once: the first one's
+outputs are reused for the rest. Within a worker, jobs with the same
+selection settings but a different title or format share one
+get_tourney_teams call.
+
+Results are appended to a JSONL log as jobs finish, one line per job with
+its output paths and timings, so a long batch can be followed (or its log
+read) while it runs. With export_dir, every job's field and bid lists are
+also appended to one Arrow, Parquet or JSON lines file per table as the
+job finishes, tagged with the job id.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import contextlib
+import io
+import json
+import os
+import re
+import time
+
+import progress
+from bracket_format import BracketFormat
+
+SELECTION_KEYS = ['comp_polls', 'conf_winners', 'use_metrics', 'human_polls',
+    'poll_weights', 'comp_weight', 'human_weight']
+
+FORMATS = ['pdf', 'excel', 'csv', 'json']
+
+JOB_KEYS = set(SELECTION_KEYS) | {'id', 'formats', 'title'}
+
+_SAFE_NAME = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def read_jobs(path):
+    """
+    Reads and validates a JSONL job file. Blank lines and lines starting with
+    '#' are skipped.
+
+    Outputs:
+        List of job dictionaries, each with an id and a formats list
+    """
+    jobs = []
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                raise ValueError('{}:{}: {}'.format(path, line_no, e))
+            if not isinstance(job, dict):
+                raise ValueError('{}:{}: a job must be a JSON object'.format(
+                    path, line_no))
+            unknown = set(job) - JOB_KEYS
+            if unknown:
+                raise ValueError('{}:{}: unknown key(s) {}'.format(path,
+                    line_no, ', '.join(sorted(unknown))))
+            formats = job.get('formats', ['pdf'])
+            if isinstance(formats, str):
+                formats = [formats]
+            bad = [f for f in formats if f not in FORMATS]
+            if bad:
+                raise ValueError('{}:{}: unknown format(s) {}'.format(path,
+                    line_no, ', '.join(bad)))
+            job['formats'] = sorted(set(formats))
+            job['id'] = str(job.get('id', line_no))
+            jobs.append(job)
+
+    ids = [j['id'] for j in jobs]
+    if len(set(ids)) != len(ids):
+        raise ValueError('Job ids in {} must be unique'.format(path))
+    return jobs
+
+
+def job_key(job):
+    """
+    Canonical JSON of everything that affects a job's outputs except its id
+    """
+    return json.dumps({k: v for k, v in job.items() if k != 'id'},
+        sort_keys=True)
+
+
+def selection_key(job):
+    return json.dumps({k: job[k] for k in SELECTION_KEYS if k in job},
+        sort_keys=True)
+
+
+def dedupe(jobs):
+    """
+    Groups jobs with identical settings.
+
+    Outputs:
+        List of (job to run, ids of every job with its settings)
+    """
+    groups = {}
+    for job in jobs:
+        key = job_key(job)
+        if key in groups:
+            groups[key][1].append(job['id'])
+        else:
+            groups[key] = (job, [job['id']])
+    return list(groups.values())
+
+
+# ---- worker side ----
+
+_worker = {}
+
+
+def _init_worker(parsed, bracket_format, output_dir, export=False):
+    _worker['parsed'] = parsed
+    _worker['format'] = bracket_format
+    _worker['output_dir'] = output_dir
+    _worker['export'] = export
+    _worker['selections'] = {}
+
+
+def _selection(job):
+    """
+    Selection attributes for the job's settings, memoized per worker
+    """
+    from pipeline import _select
+    key = selection_key(job)
+    cache = _worker['selections']
+    if key not in cache:
+        # bounded, since a batch may hold thousands of distinct settings
+        if len(cache) >= 32:
+            cache.clear()
+        params = {'format': _worker['format'],
+            'selection': {k: job[k] for k in SELECTION_KEYS if k in job}}
+        cache[key] = _select(params, {'parse': _worker['parsed']})
+    return cache[key]
+
+
+def run_job(job):
+    """
+    Runs one job in a worker process.
+
+    Outputs:
+        Dictionary with the job id, status, output paths and timings in
+        seconds (select, render, total), plus the export tables under
+        'tables' when the batch exports. Failures are reported with status
+        'error' and the message rather than raised, so one bad job doesn't
+        stop the batch.
+    """
+    from export import bracket_tables, to_json
+    from pipeline import bracket_from_selection
+
+    start = time.perf_counter()
+    result = {'id': job['id'], 'pid': os.getpid()}
+    stem = os.path.join(_worker['output_dir'],
+        _SAFE_NAME.sub('_', job['id']))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            selection = _selection(job)
+            selected = time.perf_counter()
+            bracket = bracket_from_selection(_worker['parsed'], selection)
+            outputs = {}
+            if 'pdf' in job['formats']:
+                outputs['pdf'] = bracket.save_bracket_pdf(
+                    output_path=stem + '.pdf', title=job.get('title'))
+            if 'excel' in job['formats']:
+                outputs['excel'] = bracket.fill_bracket(
+                    save_file=stem + '.xlsx')
+            if 'csv' in job['formats']:
+                outputs['csv'] = stem + '.csv'
+                bracket.summary_df.to_csv(outputs['csv'], index=False)
+            tables = None
+            if 'json' in job['formats'] or _worker['export']:
+                tables = bracket_tables(bracket, polls=False)
+            if 'json' in job['formats']:
+                outputs['json'] = to_json(tables, stem + '.json')
+    except Exception as e:
+        result.update({'status': 'error',
+            'error': '{}: {}'.format(type(e).__name__, e),
+            'total_s': round(time.perf_counter() - start, 4)})
+        return result
+
+    end = time.perf_counter()
+    result.update({'status': 'ok', 'outputs': outputs,
+        'select_s': round(selected - start, 4),
+        'render_s': round(end - selected, 4),
+        'total_s': round(end - start, 4)})
+    if _worker['export']:
+        result['tables'] = tables
+    return result
+
+
+# ---- parent side ----
+
+def run_batch(jobs_path, csv_path='masseyratings.csv', output_dir='batch',
+        log_path=None, bracket_format=None, max_workers=None,
+        cache_dir='.cache', on_result=None, export_dir=None,
+        export_format='parquet'):
+    """
+    Runs every job in a JSONL file.
+
+    Inputs:
+        jobs_path: JSONL job file
+        csv_path: Massey compare.csv snapshot, parsed once (through the
+            pipeline cache, so an unchanged snapshot isn't parsed again)
+        output_dir: Directory for the job outputs
+        log_path: JSONL result log (default: <output_dir>/results.jsonl),
+            written as jobs finish
+        bracket_format: Dictionary of BracketFormat arguments for every job
+        max_workers: Worker processes (default: all cores)
+        on_result: Optional callable(result) after each job
+        export_dir: Optional directory to stream every job's export tables
+            to, plus the snapshot's poll_ranks once
+        export_format: 'arrow', 'parquet' or 'json'
+    Outputs:
+        Summary dictionary with job counts and timings
+    """
+    from export import StreamWriter
+    from pipeline import bracket_pipeline
+    from poll_analysis import poll_ranks
+
+    start = time.perf_counter()
+    jobs = read_jobs(jobs_path)
+    unique = dedupe(jobs)
+    bracket_format = bracket_format or {}
+    BracketFormat(**bracket_format)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        parsed = bracket_pipeline(csv_path=csv_path, skip_download=True,
+            cache_dir=cache_dir).run(['parse'])['parse']
+    parse_s = time.perf_counter() - start
+
+    os.makedirs(output_dir, exist_ok=True)
+    if log_path is None:
+        log_path = os.path.join(output_dir, 'results.jsonl')
+    # submit jobs sharing selection settings together, so each worker's
+    # selection memo gets hits
+    unique.sort(key=lambda u: selection_key(u[0]))
+
+    export = None
+    if export_dir is not None:
+        export = StreamWriter(export_dir, fmt=export_format)
+        # the same for every job, so written once
+        ranks = poll_ranks(parsed['team_data_df'])
+        export.write({'poll_ranks': ranks.rename_axis('Team').reset_index()})
+
+    counts = {'ok': 0, 'error': 0}
+    task = progress.stage('Batch jobs', total=len(jobs))
+    with open(log_path, 'w') as log, ProcessPoolExecutor(
+            max_workers=max_workers, initializer=_init_worker,
+            initargs=(parsed, bracket_format, output_dir,
+                export is not None)) as pool, \
+            export or contextlib.nullcontext():
+        futures = {pool.submit(run_job, job): ids for job, ids in unique}
+        for future in as_completed(futures):
+            result = future.result()
+            tables = result.pop('tables', None)
+            for job_id in futures[future]:
+                if tables is not None:
+                    export.write(tables, variant=job_id)
+                record = dict(result, id=job_id)
+                if job_id != result['id']:
+                    record['duplicate_of'] = result['id']
+                log.write(json.dumps(record) + '\n')
+                counts[result['status']] += 1
+                task.advance()
+            log.flush()
+            if on_result is not None:
+                on_result(result)
+    task.done()
+
+    summary = {'jobs': len(jobs), 'unique': len(unique), 'ok': counts['ok'],
+        'errors': counts['error'], 'parse_s': round(parse_s, 3),
+        'total_s': round(time.perf_counter() - start, 3), 'log': log_path}
+    if export is not None:
+        summary['export'] = export_dir
+    return summary
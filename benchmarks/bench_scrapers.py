@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+"""
+Parse time and peak memory of the KenPom, BPI and Dokter scrapers on the
+local fixtures (benchmarks/fixtures.py), against the BeautifulSoup parsers
+they replaced, which are kept below as the reference.
+
+Both parsers run --repeat times in turn, and each ratio is given as the
+median with the range over the runs (min-max), as timings on a shared
+machine move by a third or more between runs. Memory is measured in a
+fresh process per parser and run: the tracemalloc peak of the parse, and
+the growth of the peak resident size over the parse, which also counts the
+parser's C allocations that tracemalloc can't see. The resident size also
+counts the 5-6 MB pandas sets up for the first DataFrames of a process
+(with pyarrow installed, its string arrays), which both parsers pay, so it
+understates the ratio for small pages like Dokter's. Every parser's output
+is checked against the reference first.
+
+Usage (from the repo root):
+
+    python benchmarks/fixtures.py
+    python benchmarks/bench_scrapers.py [--repeat 5]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from bs4 import BeautifulSoup
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import scrape
+from progress import current_memory
+
+FIXTURES = os.path.join(HERE, 'fixtures')
+
+
+# ---- reference: the BeautifulSoup parsers ----
+
+def _soup_rows(table):
+    data = []
+    for row in table.find_all('tr'):
+        cols = [ele.text.strip() for ele in row.find_all('td')]
+        data.append([ele for ele in cols if ele])
+    return [x for x in data if x]
+
+
+def legacy_kenpom(html):
+    soup = BeautifulSoup(html, 'lxml')
+    ot_data = np.array(_soup_rows(soup.find('table')))
+    df = pd.DataFrame(ot_data[:, [0, 1, 2, 3, 4, 5, 7, 9, 11, -2]],
+        columns=['Rk', 'Team', 'Conf', 'W-L', 'AdjEM', 'AdjO', 'AdjD',
+        'AdjT', 'Luck', 'SOS'])
+    for col in ['AdjEM', 'AdjO', 'AdjD', 'AdjT', 'Luck', 'SOS']:
+        df[col] = df[col].astype('float')
+    return df
+
+
+def legacy_dokent(html):
+    soup = BeautifulSoup(html, 'lxml')
+    data = []
+    for row in soup.p.contents[0].split('\n'):
+        line = row.split()
+        if len(line) == 8:
+            data.append(line)
+        elif len(line) in (9, 10):
+            n = len(line) - 7
+            data.append([line[0], ' '.join(line[1:1 + n])] + line[1 + n:])
+    columns = data[0]
+    columns.pop(3)
+    columns.insert(0, 'Rk')
+    columns[1] = 'Team'
+    df = pd.DataFrame(np.array(data[1:]), columns=columns)
+    for col in ['Rk', 'w', 'l', 'power', 'sched', 'offen', 'defen']:
+        df[col] = df[col].astype('float')
+    return df
+
+
+def legacy_bpi(pages):
+    data_np = None
+    for html in pages:
+        soup = BeautifulSoup(html, 'lxml')
+        page = np.array(_soup_rows(soup.find_all('table')[1]))
+        data_np = page if data_np is None else np.append(data_np, page,
+            axis=0)
+    data_np[:, 1] = np.array([scrape.bpi_team_name(t)
+        for t in data_np[:, 1]])
+    df = pd.DataFrame(data_np[:, :7], columns=['Rk', 'Team', 'Conf', 'W-L',
+        'BPI_OFF', 'BPI_DEF', 'BPI'])
+    for col in ['Rk', 'BPI_OFF', 'BPI_DEF', 'BPI']:
+        df[col] = df[col].astype('float')
+    return df
+
+
+# ---- inputs ----
+
+def _path(name):
+    return os.path.join(FIXTURES, name)
+
+
+def _read(name):
+    with open(_path(name), encoding='utf-8') as f:
+        return f.read()
+
+
+def _chunks(name):
+    with open(_path(name), encoding='utf-8') as f:
+        while True:
+            chunk = f.read(scrape.CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+BPI_FILES = ['bpi_{}.html'.format(i + 1) for i in range(scrape.BPI_PAGES)]
+
+# site -> (reference, streaming), each reading the fixture itself, as the
+# downloaders hand over a whole response or its chunks
+PARSERS = {
+    'kenpom': (lambda: legacy_kenpom(_read('kenpom.html')),
+        lambda: scrape.parse_kenpom(_chunks('kenpom.html'))),
+    'bpi': (lambda: legacy_bpi([_read(n) for n in BPI_FILES]),
+        lambda: scrape.parse_bpi(_chunks(n) for n in BPI_FILES)),
+    'dokent': (lambda: legacy_dokent(_read('dokent.html')),
+        lambda: scrape.parse_dokent(_chunks('dokent.html'))),
+}
+
+
+# ---- measurement ----
+
+def run_times(fns, repeat):
+    """
+    Seconds of each run of each function, taking turns so that both see
+    the same machine load
+    """
+    times = [[] for _ in fns]
+    for _ in range(repeat):
+        for fn, runs in zip(fns, times):
+            start = time.perf_counter()
+            fn()
+            runs.append(time.perf_counter() - start)
+    return times
+
+
+def ratio(reference, streaming):
+    """
+    Median and range of the per-run ratios, as text
+    """
+    with np.errstate(divide='ignore'):
+        ratios = np.asarray(reference, dtype=float) / np.asarray(streaming)
+    return '{:.1f} ({:.1f}-{:.1f})'.format(np.median(ratios), ratios.min(),
+        ratios.max())
+
+
+def _peak_rss():
+    # VmHWM where available; ru_maxrss can't be reset, so elsewhere the
+    # figure is only growth over the peak of the imports
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _reset_peak_rss():
+    """
+    Resets the peak resident size to the current one where the kernel
+    allows it, and returns the new baseline
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return current_memory()
+    except OSError:
+        return _peak_rss()
+
+
+def _memory(site, which):
+    """
+    Runs one parse in this (fresh) process and returns its memory use
+    """
+    fn = PARSERS[site][which]
+    before = _reset_peak_rss()
+    tracemalloc.start()
+    fn()
+    traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'traced': traced, 'rss': max(_peak_rss() - before, 0)}
+
+
+def memory(site, which):
+    out = subprocess.check_output([sys.executable, __file__, '--memory',
+        site, str(which)])
+    return json.loads(out)
+
+
+def check(site):
+    reference, streaming = (fn() for fn in PARSERS[site])
+    pd.testing.assert_frame_equal(streaming, reference, check_dtype=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--memory', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.memory:
+        site, which = args.memory
+        print(json.dumps(_memory(site, int(which))))
+        return
+
+    if not os.path.exists(_path('kenpom.html')):
+        sys.exit('No fixtures; run python benchmarks/fixtures.py first')
+
+    print('{:<7} {:>8} {:>9} {:>17} {:>17} {:>8} {:>8} {:>17}'.format(
+        'site', 'bs4 ms', 'stream ms', 'time x', 'traced x', 'bs4 RSS',
+        'str RSS', 'RSS x'))
+    for site in PARSERS:
+        check(site)
+        times = run_times(PARSERS[site], args.repeat)
+        mems = [[memory(site, which) for _ in range(args.repeat)]
+            for which in (0, 1)]
+        traced = [[m['traced'] for m in runs] for runs in mems]
+        rss = [[m['rss'] for m in runs] for runs in mems]
+        print('{:<7} {:>8.1f} {:>9.1f} {:>17} {:>17} {:>6.1f}MB {:>6.1f}MB '
+            '{:>17}'.format(site, np.median(times[0]) * 1e3,
+            np.median(times[1]) * 1e3, ratio(*times), ratio(*traced),
+            np.median(rss[0]) / 1e6, np.median(rss[1]) / 1e6, ratio(*rss)))
+
+
+if __name__ == '__main__':
+    main()
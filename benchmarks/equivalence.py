@@ -0,0 +1,568 @@
+# -*- coding: utf-8 -*-
+
+"""
+Checks a candidate replacement of one of the selection functions against
+the current implementation on many inputs, and times both.
+
+A target is one of parse_csv, get_comp_rankings, get_tourney_teams,
+get_comp_ratings (Bracketeer methods) or _assign_teams,
+_separate_conferences (bracket_pdf). The candidate is any function with
+the target's signature, given as module:function (methods take the
+Bracketeer as first argument). Every input runs the whole selection twice,
+once with the target and once with the candidate patched in, and compares
+the golden outputs: the parsed frame and header, every team's means and
+final rank, the auto bids, at-larges and bubble, the field with its seeds,
+the computer rankings or ratings frame, and the first-round slots of every
+region (which fixes regions, pods and play-in games). An input where one
+path raises and the other doesn't, or raises a different exception, also
+diverges.
+
+Inputs are the shipped masseyratings.csv under a handful of settings, the
+dated ratings fixtures in csv_files/ (metrics mode), and --cases
+randomized synthetic compare files: variable header sections, optional
+blank row, padded values, missing and tied ranks, human polls or not,
+dropped summary columns, poll subsets and weights, conference winners and
+other field sizes.
+
+A divergent input is shrunk by delta debugging (ddmin) over its team rows
+and then its poll columns, keeping the divergence, and the minimal compare
+file and its settings are written to --out.
+
+Usage (from the repo root):
+
+    python benchmarks/equivalence.py --target get_comp_rankings \\
+        --candidate fast:get_comp_rankings [--cases 2000] [--seed 0]
+
+Without --candidate the target is checked against itself, which times the
+reference alone.
+"""
+
+import argparse
+import contextlib
+import copy
+import csv
+import glob
+import importlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+import bracket_pdf
+import metrics
+from bracket_format import BracketFormat
+from ratings import get_sources
+
+# target -> (owner, attribute, mode): mode restricts the synthetic inputs
+# to the selection mode that calls the target
+TARGETS = {
+    'parse_csv': (metrics.Bracketeer, 'parse_csv', None),
+    'get_comp_rankings': (metrics.Bracketeer, 'get_comp_rankings', 'ranks'),
+    'get_tourney_teams': (metrics.Bracketeer, 'get_tourney_teams', None),
+    'get_comp_ratings': (metrics.Bracketeer, 'get_comp_ratings', 'metrics'),
+    '_assign_teams': (bracket_pdf, '_assign_teams', None),
+    '_separate_conferences': (bracket_pdf, '_separate_conferences', None),
+}
+
+# compare.csv columns that never hold computer rankings
+SUMMARY_COLUMNS = ['Rank', 'Mean', 'Trimmed', 'Median', 'StDev']
+
+POLLS = ['MOR', 'NOL', 'OMN', 'PGH', 'POM', 'RPI', 'TRK', 'WEI', 'WIL',
+    'WLS', 'BIH', 'BMN', 'DII', 'DOK', 'ENG', 'KPK', 'LMC', 'MAS', 'MB',
+    'SAG', 'DOL', 'COL', 'EBP', 'BBT', 'SEL', 'KRA', 'TPR', 'HAS']
+
+CONFERENCES = ['ACC', 'B10', 'B12', 'SEC', 'BE', 'WCC', 'MWC', 'A10',
+    'AAC', 'MVC', 'CUSA', 'MAC', 'SB', 'WAC', 'BSky', 'BW', 'CAA', 'Horz',
+    'Ivy', 'MAAC', 'MEAC', 'NEC', 'OVC', 'Pat', 'SC', 'SWAC', 'Sum',
+    'ASun', 'AE', 'BSth', 'Slnd', 'WAC2', 'Ind']
+
+FORMATS = [{}, {'n_teams': 32}, {'n_teams': 48, 'n_regions': 2},
+    {'n_teams': 96, 'byes': True}, {'n_teams': 76}]
+
+
+# ---- inputs ----
+
+class Case(object):
+    """
+    One input: a compare.csv file as rows, the get_tourney_teams settings
+    and the bracket format
+
+    Inputs:
+        header: Rows before the column names
+        columns: Column names
+        rows: Team rows
+        blank: Whether a blank row follows the column names
+        settings: get_tourney_teams keyword arguments
+        fmt: BracketFormat keyword arguments
+        sources: Optional ratings sources for metrics mode
+        name: Label in the report
+    """
+    def __init__(self, header, columns, rows, blank=True, settings=None,
+            fmt=None, sources=None, bom=False, name=''):
+        self.header = header
+        self.columns = columns
+        self.rows = rows
+        self.blank = blank
+        self.settings = settings or {}
+        self.fmt = fmt or {}
+        self.sources = sources
+        self.bom = bom
+        self.name = name
+
+    @classmethod
+    def from_csv(cls, path, **kwargs):
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            data = list(csv.reader(f))
+        start = next(i for i, row in enumerate(data)
+            if metrics.is_column_row(row))
+        rows = data[start + 1:]
+        blank = bool(rows) and metrics.is_blank_row(rows[0])
+        return cls(data[:start], data[start], rows[1:] if blank else rows,
+            blank=blank, **kwargs)
+
+    def replace(self, **kwargs):
+        case = copy.copy(self)
+        for key, value in kwargs.items():
+            setattr(case, key, value)
+        return case
+
+    def write(self, path):
+        with open(path, 'w', newline='',
+                encoding='utf-8-sig' if self.bom else 'utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerows(self.header)
+            writer.writerow(self.columns)
+            if self.blank:
+                writer.writerow([''] * len(self.columns))
+            writer.writerows(self.rows)
+        return path
+
+    def poll_columns(self):
+        return [c.strip() for c in self.columns[2:]
+            if c.strip() not in SUMMARY_COLUMNS + ['W-L', 'AP', 'USA']]
+
+    def drop_columns(self, names):
+        keep = [i for i, c in enumerate(self.columns)
+            if c.strip() not in names]
+        return self.replace(columns=[self.columns[i] for i in keep],
+            rows=[[row[i] for i in keep if i < len(row)]
+                for row in self.rows])
+
+    def description(self):
+        return {'name': self.name, 'settings': self.settings,
+            'format': self.fmt, 'blank_row': self.blank,
+            'sources': [s.path for s in self.sources or []]}
+
+
+def fixture_sources():
+    """
+    Dated ratings fixtures in csv_files/, as date -> registered sources
+    reading them
+    """
+    dates = {}
+    for source in get_sources():
+        stem, ext = os.path.splitext(os.path.join(ROOT, source.path))
+        for path in sorted(glob.glob(stem + '_*' + ext)):
+            date = path[len(stem) + 1:-len(ext)]
+            if date.isdigit():
+                dates.setdefault(date, []).append(source.with_path(path))
+    return dates
+
+
+def real_cases():
+    """
+    The shipped compare.csv under several settings, and in metrics mode
+    with each date of ratings fixtures
+    """
+    path = os.path.join(ROOT, 'masseyratings.csv')
+    base = Case.from_csv(path, name='masseyratings.csv')
+    if not {'AP', 'USA'} <= set(base.columns):
+        base.settings = {'human_polls': False}
+    polls = [p for p in base.poll_columns() if p in POLLS]
+    cases = [
+        base,
+        base.replace(settings=dict(base.settings, comp_polls=polls[::2]),
+            name=base.name + ' half the polls'),
+        base.replace(settings=dict(base.settings, poll_weights={
+            polls[0]: 3., polls[1]: .5}), name=base.name + ' weighted'),
+    ]
+    cases += [base.replace(fmt=fmt, name=base.name + ' ' + json.dumps(fmt))
+        for fmt in FORMATS[1:]]
+    for date, sources in fixture_sources().items():
+        cases.append(base.replace(settings=dict(base.settings,
+            use_metrics=True), sources=sources,
+            name='{} ratings {}'.format(base.name, date)))
+    return cases
+
+
+def _ranks(rng, strength, noise, missing, ties):
+    score = strength + rng.normal(0, noise, len(strength))
+    ranks = np.empty(len(score), dtype=int)
+    ranks[np.argsort(-score, kind='stable')] = np.arange(1, len(score) + 1)
+    if ties:
+        ranks = (ranks + 1) // 2 * 2 - 1
+    values = ranks.astype(str).astype(object)
+    values[rng.random(len(values)) < missing] = ''
+    return values
+
+
+def synthetic_case(rng, i, mode=None, team_names=()):
+    """
+    A randomized compare file and settings
+    """
+    fmt = FORMATS[rng.integers(len(FORMATS))] if rng.random() < .3 else {}
+    n_field = BracketFormat(**fmt).n_teams
+    n_teams = int(rng.integers(n_field + 10, 400))
+    n_confs = int(rng.integers(4, min(len(CONFERENCES), n_field // 2)))
+    confs = list(rng.choice(CONFERENCES, n_confs, replace=False))
+
+    names = list(team_names)
+    rng.shuffle(names)
+    names = names[:n_teams] + ['Team {}'.format(k)
+        for k in range(n_teams - len(names))]
+    strength = rng.normal(0, 1, n_teams)
+    order = np.argsort(-strength)
+
+    polls = list(rng.choice(POLLS, int(rng.integers(2, len(POLLS))),
+        replace=False))
+    extra = [c for c in SUMMARY_COLUMNS if rng.random() < .5]
+    human = rng.random() < .7
+    columns = ['Team', 'Conf', 'W-L'] + extra + polls + (['AP', 'USA']
+        if human else [])
+
+    table = {'Team': np.array(names, dtype=object)[order],
+        'Conf': rng.choice(confs, n_teams).astype(object),
+        'W-L': np.array(['{}-{}'.format(rng.integers(30),
+            rng.integers(30)) for _ in range(n_teams)], dtype=object)}
+    strength = strength[order]
+    for col in extra:
+        table[col] = rng.normal(50, 20, n_teams).round(2).astype(str)
+    for poll in polls:
+        table[poll] = _ranks(rng, strength, rng.uniform(.05, .6),
+            rng.uniform(0, .2), rng.random() < .2)
+    if human:
+        for poll in ('AP', 'USA'):
+            ranks = _ranks(rng, strength, .2, 0, False)
+            table[poll] = np.where(ranks.astype(int) <= 25, ranks, '')
+    rows = [[str(table[c][k]) for c in columns] for k in range(n_teams)]
+    for row in rows:
+        # padded values, as Massey writes some
+        if rng.random() < .1:
+            j = int(rng.integers(len(row)))
+            row[j] = ' ' + row[j] + ' '
+
+    header = [['{}'.format(p), 'System {}'.format(p),
+        'https://example.com/{}'.format(p.lower())]
+        for p in polls[:int(rng.integers(0, 6))]]
+
+    settings = {}
+    if mode == 'metrics' or (mode is None and rng.random() < .15):
+        settings['use_metrics'] = True
+    elif rng.random() < .3:
+        settings['human_polls'] = False
+    if rng.random() < .25 and not settings.get('use_metrics'):
+        settings['comp_polls'] = sorted(rng.choice(polls,
+            int(rng.integers(1, len(polls) + 1)), replace=False).tolist())
+    if rng.random() < .2 and not settings.get('use_metrics'):
+        settings['poll_weights'] = {p: float(rng.choice([.5, 2., 3.]))
+            for p in rng.choice(polls, 2, replace=False).tolist()}
+    if rng.random() < .15:
+        conf = confs[int(rng.integers(len(confs)))]
+        teams = [r[0] for r in rows if r[1] == conf]
+        if conf != 'Ind' and teams:
+            settings['conf_winners'] = {conf: teams[-1]}
+    if mode == 'ranks':
+        settings.pop('use_metrics', None)
+
+    sources = None
+    if settings.get('use_metrics'):
+        dated = fixture_sources()
+        sources = dated[sorted(dated)[-1]] if dated else []
+    return Case(header, columns, rows, blank=rng.random() < .5,
+        settings=settings, fmt=fmt, sources=sources,
+        bom=rng.random() < .5, name='synthetic {}'.format(i))
+
+
+# ---- running ----
+
+class Timed(object):
+    """
+    Wraps a function, adding up the seconds spent in it
+    """
+    def __init__(self, fn):
+        self.fn = fn
+        self.seconds = 0.
+        self.calls = 0
+
+    def wrapper(self):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return self.fn(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - start
+                self.calls += 1
+        return timed
+
+
+def run_case(case, target, fn, path):
+    """
+    Golden outputs of the selection of a case with fn in place of the
+    target. If a stage raises, the outputs up to it are kept and the
+    exception is recorded under 'error', so that inputs too small for a
+    field still compare the parse and the rankings
+    """
+    owner, attr, _ = TARGETS[target]
+    case.write(path)
+    outputs = {}
+    settings = case.settings
+    try:
+        with mock.patch.object(owner, attr, fn), \
+                contextlib.redirect_stdout(io.StringIO()):
+            bracket = metrics.Bracketeer.__new__(metrics.Bracketeer)
+            bracket._setup(path, BracketFormat(**case.fmt))
+            bracket.parse_csv()
+            outputs['team_data_df'] = bracket.team_data_df.copy()
+            outputs['header_data'] = bracket.header_data
+            if case.sources is not None:
+                bracket.ratings_sources = case.sources
+
+            # the rankings on their own, with the settings
+            # get_tourney_teams would set
+            bracket.comp_polls = settings.get('comp_polls')
+            bracket.poll_weights = settings.get('poll_weights')
+            if settings.get('use_metrics'):
+                outputs['comp_ratings'] = bracket.get_comp_ratings(
+                    download=False)
+            else:
+                outputs['comp_rankings'] = bracket.get_comp_rankings()
+
+            bracket.get_tourney_teams(**settings)
+            outputs['summary_df'] = bracket.summary_df
+            outputs['auto_bid_teams'] = list(bracket.auto_bid_teams)
+            outputs['at_large_teams'] = list(bracket.at_large_teams)
+            outputs['bubble'] = list(bracket._ffnf)
+            outputs['final_68'] = bracket.final_68
+            outputs['slots'] = bracket_pdf.bracket_slots(bracket.final_68,
+                bracket.bracket_format)
+    except Exception as e:
+        outputs.update(error=type(e).__name__, message=str(e))
+    return outputs
+
+
+def _frame_difference(a, b, rtol):
+    if list(a.columns) != list(b.columns):
+        return 'columns {} != {}'.format(list(a.columns), list(b.columns))
+    if not a.index.equals(b.index):
+        return 'index differs'
+    for col in a.columns:
+        x, y = a[col].to_numpy(), b[col].to_numpy()
+        numeric = [pd.api.types.is_numeric_dtype(v) for v in (a[col], b[col])]
+        if numeric[0] != numeric[1]:
+            return "column '{}' dtype {} != {}".format(col, a[col].dtype,
+                b[col].dtype)
+        if numeric[0]:
+            x, y = x.astype(float), y.astype(float)
+            same = np.isclose(x, y, rtol=rtol, atol=0, equal_nan=True) \
+                if rtol else (x == y) | (np.isnan(x) & np.isnan(y))
+        else:
+            same = np.array([u == v or (pd.isna(u) and pd.isna(v))
+                for u, v in zip(x, y)], dtype=bool)
+        if not same.all():
+            row = int(np.flatnonzero(~same)[0])
+            return "column '{}' row {}: {!r} != {!r}".format(col,
+                a.index[row], x[row], y[row])
+    return None
+
+
+def difference(reference, candidate, rtol=0.):
+    """
+    First difference between two golden outputs, or None
+    """
+    for key, value in reference.items():
+        if key in ('error', 'message'):
+            continue
+        if key not in candidate:
+            break
+        other = candidate[key]
+        if isinstance(value, pd.DataFrame):
+            found = _frame_difference(value, other, rtol)
+        elif isinstance(value, list) and len(value) == len(other):
+            found = next(('item {}: {!r} != {!r}'.format(i, u, v)
+                for i, (u, v) in enumerate(zip(value, other)) if u != v),
+                None)
+        else:
+            found = None if value == other else '{!r} != {!r}'.format(
+                value, other)
+        if found:
+            return '{}: {}'.format(key, found)
+
+    if reference.get('error') != candidate.get('error') or \
+            len(reference) != len(candidate):
+        return 'reference {} but candidate {}'.format(*(
+            'raised {}: {}'.format(o['error'], o['message']) if 'error' in o
+            else 'returned' for o in (reference, candidate)))
+    return None
+
+
+def ddmin(items, fails):
+    """
+    1-minimal subset of items for which fails holds (Zeller's delta
+    debugging), given that it holds for all of them
+    """
+    n = 2
+    while len(items) >= 2:
+        chunk = len(items) / n
+        subsets = [items[int(k * chunk):int((k + 1) * chunk)]
+            for k in range(n)]
+        for k, subset in enumerate(subsets):
+            if fails(subset):
+                items, n = subset, 2
+                break
+            complement = [x for j, s in enumerate(subsets) if j != k
+                for x in s]
+            if n > 2 and fails(complement):
+                items, n = complement, max(n - 1, 2)
+                break
+        else:
+            if n >= len(items):
+                break
+            n = min(2 * n, len(items))
+    return items
+
+
+class Harness(object):
+    """
+    Inputs:
+        target: Name in TARGETS
+        candidate: Function replacing it (default: the target itself)
+        rtol: Relative tolerance of float columns; 0 compares exactly
+    """
+    def __init__(self, target, candidate=None, rtol=0.):
+        owner, attr, self.mode = TARGETS[target]
+        self.target = target
+        self.reference = Timed(getattr(owner, attr))
+        self.candidate = Timed(candidate or getattr(owner, attr))
+        self.rtol = rtol
+        self.directory = tempfile.mkdtemp(prefix='equivalence-')
+        self.path = os.path.join(self.directory, 'compare.csv')
+
+    def compare(self, case):
+        reference = run_case(case, self.target, self.reference.wrapper(),
+            self.path)
+        candidate = run_case(case, self.target, self.candidate.wrapper(),
+            self.path)
+        return difference(reference, candidate, self.rtol)
+
+    def shrink(self, case):
+        """
+        Smallest case found that still diverges. Its runs aren't timed
+        """
+        timers = [(t, t.seconds, t.calls)
+            for t in (self.reference, self.candidate)]
+        try:
+            return self._shrink(case)
+        finally:
+            for timed, seconds, calls in timers:
+                timed.seconds, timed.calls = seconds, calls
+
+    def _shrink(self, case):
+        fails = lambda rows: self.compare(case.replace(rows=rows)) is not None
+        case = case.replace(rows=ddmin(case.rows, fails))
+        polls = case.poll_columns()
+        keep = ddmin(polls, lambda kept: self.compare(case.drop_columns(
+            [p for p in polls if p not in kept])) is not None)
+        return case.drop_columns([p for p in polls if p not in keep])
+
+    def save(self, case, found, out, k):
+        os.makedirs(out, exist_ok=True)
+        stem = os.path.join(out, '{}-{}'.format(self.target, k))
+        case.write(stem + '.csv')
+        with open(stem + '.json', 'w') as f:
+            json.dump(dict(case.description(), difference=found), f,
+                indent=2, default=str)
+        return stem + '.csv'
+
+
+def load_candidate(spec):
+    module, _, name = spec.partition(':')
+    if not name:
+        raise ValueError('Give the candidate as module:function')
+    sys.path.insert(0, os.getcwd())
+    return getattr(importlib.import_module(module), name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--target', required=True, choices=sorted(TARGETS))
+    parser.add_argument('--candidate', default=None,
+        help='module:function (default: the target itself)')
+    parser.add_argument('--cases', type=int, default=1000,
+        help='Synthetic inputs (default: 1000)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rtol', type=float, default=0.,
+        help='Relative tolerance of float columns (default: exact)')
+    parser.add_argument('--max-divergences', type=int, default=3,
+        help='Divergent inputs to shrink before stopping (default: 3)')
+    parser.add_argument('--out', default=os.path.join(HERE, 'divergences'))
+    args = parser.parse_args()
+
+    candidate = load_candidate(args.candidate) if args.candidate else None
+    harness = Harness(args.target, candidate, rtol=args.rtol)
+    rng = np.random.default_rng(args.seed)
+    names = [r[0] for r in Case.from_csv(os.path.join(ROOT,
+        'masseyratings.csv')).rows]
+
+    cases = real_cases()
+    if harness.mode == 'ranks':
+        cases = [c for c in cases if not c.settings.get('use_metrics')]
+    elif harness.mode == 'metrics':
+        cases = [c for c in cases if c.settings.get('use_metrics')]
+
+    def all_cases():
+        yield from cases
+        for i in range(args.cases):
+            yield synthetic_case(rng, i, harness.mode, names)
+
+    start = time.perf_counter()
+    n, divergences = 0, []
+    for case in all_cases():
+        n += 1
+        found = harness.compare(case)
+        if found is None:
+            continue
+        print('{}: {}'.format(case.name, found))
+        small = harness.shrink(case)
+        path = harness.save(small, harness.compare(small), args.out,
+            len(divergences))
+        print('  shrunk to {} team(s) and {} poll(s): {}'.format(
+            len(small.rows), len(small.poll_columns()), path))
+        divergences.append(path)
+        if len(divergences) >= args.max_divergences:
+            break
+
+    ref, cand = harness.reference, harness.candidate
+    print('{} input(s), {} divergence(s), {:.1f} s'.format(n,
+        len(divergences), time.perf_counter() - start))
+    print('{:<10} {:>8} {:>12} {:>10}'.format('', 'calls', 'total ms',
+        'per call'))
+    for label, timed in (('reference', ref), ('candidate', cand)):
+        print('{:<10} {:>8} {:>12.1f} {:>8.3f}ms'.format(label, timed.calls,
+            timed.seconds * 1e3, timed.seconds * 1e3 / max(timed.calls, 1)))
+    if cand.seconds:
+        print('speedup    {:.2f}x'.format(ref.seconds / cand.seconds))
+    sys.exit(1 if divergences else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""
+Builds local HTML fixtures for the scraper benchmarks from the archived
+ratings csvs in csv_files/, laid out like the pages the scrapers read:
+
+    kenpom.html       one ratings table of 21 cells per team, repeated
+                      header rows and the page chrome around it
+    bpi_<n>.html      BPI_PAGES pages, the ratings in the second table
+    dokent.html       Dokter Entropy's preformatted text in a <p>
+
+Usage (from the repo root):
+
+    python benchmarks/fixtures.py
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from scrape import BPI_PAGES
+
+FIXTURES = os.path.join(HERE, 'fixtures')
+DATE = '20190318'
+
+# stand-in for navigation, scripts and footers around the tables
+CHROME = ''.join('<div class="nav"><a href="/p{0}">Link {0}</a>'
+    '<script>var x{0} = {{a: {0}, b: "{1}"}};</script></div>\n'.format(
+        i, 'x' * 40) for i in range(300))
+
+
+def _csv(name):
+    return pd.read_csv(os.path.join(ROOT, 'csv_files',
+        '{}_{}.csv'.format(name, DATE)), index_col=0)
+
+
+def _page(body):
+    return ('<!DOCTYPE html><html><head><title>Ratings</title></head>'
+        '<body>\n{0}{1}{0}</body></html>\n'.format(CHROME, body))
+
+
+def kenpom_html():
+    df = _csv('kenpom')
+    header = ('<tr class="thead2"><th>Rk</th><th>Team</th><th>Conf</th>'
+        '<th>W-L</th>' + '<th>AdjEM</th>' * 17 + '</tr>\n')
+    rows = [header, header]
+    for i, r in enumerate(df.itertuples(index=False)):
+        if i and i % 40 == 0:
+            rows.append(header)
+        name, _, seed = r.Team.rpartition(' ')
+        if not seed.isdigit():
+            name, seed = r.Team, ''
+        seed = ' <span class="seed">{}</span>'.format(seed) if seed else ''
+        rank = '<td class="td-right"><span class="seed">{}</span></td>'
+        cells = [
+            '<td class="hard_left">{}</td>'.format(r.Rk),
+            '<td class="next_left"><a href="team.php?team={0}">{0}</a>{1}'
+                '</td>'.format(name, seed),
+            '<td class="conf"><a href="conf.php?c={0}">{0}</a></td>'.format(
+                r.Conf),
+            '<td class="wl">{}</td>'.format(r[3]),
+            '<td>{:+.2f}</td>'.format(r.AdjEM),
+            '<td>{:.1f}</td>'.format(r.AdjO), rank.format(i + 3),
+            '<td>{:.1f}</td>'.format(r.AdjD), rank.format(i + 5),
+            '<td>{:.1f}</td>'.format(r.AdjT), rank.format(i + 7),
+            '<td>{:+.3f}</td>'.format(r.Luck), rank.format(i + 11),
+            '<td>{:+.2f}</td>'.format(r.AdjEM / 3), rank.format(i + 13),
+            '<td>{:.1f}</td>'.format(r.AdjO - 3), rank.format(i + 17),
+            '<td>{:.1f}</td>'.format(r.AdjD + 3), rank.format(i + 19),
+            '<td>{:+.2f}</td>'.format(r.SOS), rank.format(i + 23),
+        ]
+        rows.append('<tr class="tourney">{}</tr>\n'.format(''.join(cells)))
+    return _page('<table id="ratings-table"><thead>{}</thead><tbody>{}'
+        '</tbody></table>'.format(rows[0], ''.join(rows[1:])))
+
+
+def _abbreviation(name):
+    letters = [w[0] for w in name.replace('.', '').split() if w[0].isalpha()]
+    return ''.join(letters).upper() or 'X'
+
+
+def bpi_html():
+    df = _csv('bpi')
+    per_page = -(-len(df) // BPI_PAGES)
+    pages = []
+    for p in range(BPI_PAGES):
+        rows = ['<tr><th>RK</th><th>TEAM</th><th>CONF</th><th>W-L</th>'
+            '<th>OFF</th><th>DEF</th><th>BPI</th><th>7-DAY</th></tr>\n']
+        for r in df.iloc[p * per_page:(p + 1) * per_page].itertuples(
+                index=False):
+            rows.append('<tr><td>{}</td><td><a href="/team/{}"><span '
+                'class="long">{}</span><span class="abbr">{}</span></a></td>'
+                '<td>{}</td><td>{}</td><td>{:.1f}</td><td>{:.1f}</td>'
+                '<td>{:.1f}</td><td>{:+d}</td></tr>\n'.format(int(r.Rk),
+                r.Team, r.Team, _abbreviation(r.Team), r.Conf, r[3],
+                r.BPI_OFF, r.BPI_DEF, r.BPI, (int(r.Rk) % 5) - 2))
+        standings = '<table class="nav"><tr><td>BPI</td><td>Rankings' \
+            '</td></tr></table>'
+        pages.append(_page('{}<table class="ratings">{}</table>'.format(
+            standings, ''.join(rows))))
+    return pages
+
+
+def dokent_html():
+    df = _csv('dokent')
+    lines = ['team           w   l   |   power   sched   offen   defen']
+    for r in df.itertuples(index=False):
+        lines.append('{:4d} {:<22s}{:4d}{:4d}{:8.2f}{:8.2f}{:8.2f}'
+            '{:8.2f}'.format(int(r.Rk), r.Team, int(r.w), int(r.l), r.power,
+            r.sched, r.offen, r.defen))
+    return ('<html><head><title>Dokter Entropy</title></head><body>'
+        '<h2>College Basketball Ratings</h2><p>{}\n</p><p>Notes</p>'
+        '</body></html>\n'.format('\n'.join(lines)))
+
+
+def build():
+    os.makedirs(FIXTURES, exist_ok=True)
+    outputs = {'kenpom.html': kenpom_html(), 'dokent.html': dokent_html()}
+    for i, page in enumerate(bpi_html()):
+        outputs['bpi_{}.html'.format(i + 1)] = page
+    for name, html in outputs.items():
+        with open(os.path.join(FIXTURES, name), 'w') as f:
+            f.write(html)
+    return sorted(outputs)
+
+
+if __name__ == '__main__':
+    for name in build():
+        print(os.path.join(FIXTURES, name))
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+
+"""
+Bit-packed brackets and vectorized scoring of pool entries.
+
+A filled-in bracket of up to 64 first-round slots is one uint64: bit g is
+the pick of game g, 0 if the winner comes from the game's first (upper)
+half and 1 from its second. Games are numbered round by round, each round
+in bracket order: the 32 first-round games in the slot order of
+bracket_pdf.bracket_slots (regions in order, each in MATCHUP_ORDER), then
+the 16 second-round games and so on up to the championship as bit 62.
+Play-in games aren't part of the code: a slot holding a play-in game is
+one position, whichever team wins it.
+
+Entries live in flat uint64 arrays saved as .npy files, which open memory
+mapped, so a pool of 10M entries is 80 MB on disk and needn't fit in
+memory to be scored.
+
+A pick is correct when the picked team won the game, which holds when the
+pick agrees with the outcome in that game and in every game of the
+winner's path below it. Scoring works on each round's bits spread out to
+the positions of their first-round games, so a round's correct picks come
+from the previous round's with a few word-wide operations per entry and
+outcome:
+
+    from_child = (C & ~o & M) | ((C >> s) & o)   # child the outcome took
+    C = from_child & ~(entry ^ o) & M            # ... and the pick agrees
+
+and the score adds np.bitwise_count(C) times the round's weight. The
+spread words of a chunk of entries and of the outcomes are computed once
+and reused for every pair.
+
+    codec = BracketCodec.from_bracketeer(bracket)
+    outcomes = codec.simulate(10000)
+    entries = load_entries('entries.npy')
+    result = score_summary(entries, outcomes)
+"""
+
+import numpy as np
+import pandas as pd
+
+import progress
+from bracket_pdf import bracket_slots
+from win_model import team_strength, win_prob_matrix
+
+# points per correct pick in each round, from the first round up
+ROUND_WEIGHTS = (10, 20, 40, 80, 160, 320)
+
+# entries read from disk at a time
+ENTRY_CHUNK = 1 << 16
+
+# entries x outcomes scored at a time, small enough to stay in cache
+TILE_ENTRIES = 64
+TILE_OUTCOMES = 1024
+
+
+def n_rounds(n_slots):
+    rounds = n_slots.bit_length() - 1
+    if n_slots < 2 or n_slots != 1 << rounds or n_slots > 64:
+        raise ValueError('Bit-packed brackets need 2 to 64 first-round '
+            'slots, a power of two; got {}'.format(n_slots))
+    return rounds
+
+
+def round_offsets(n_slots):
+    """
+    Bit of the first game of every round, and one past the last game
+    """
+    sizes = [n_slots >> r for r in range(1, n_rounds(n_slots) + 1)]
+    return np.concatenate([[0], np.cumsum(sizes)]).astype(int)
+
+
+def spread_rounds(codes, n_slots=64):
+    """
+    Each round's picks spread to the positions of their first-round games.
+
+    Outputs:
+        List of uint32 arrays, one per round. In round r (0 for the first
+        round) the pick of game k is at bit k << r
+    """
+    codes = np.asarray(codes, dtype=np.uint64)
+    offsets = round_offsets(n_slots)
+    words = []
+    for r in range(n_rounds(n_slots)):
+        start, stop = offsets[r], offsets[r + 1]
+        bits = (codes >> np.uint64(start)) & \
+            np.uint64((1 << (stop - start)) - 1)
+        if r == 0:
+            words.append(bits.astype(np.uint32))
+            continue
+        word = np.zeros(codes.shape, dtype=np.uint32)
+        for k in range(stop - start):
+            word |= ((bits >> np.uint64(k)) & np.uint64(1)).astype(
+                np.uint32) << np.uint32(k << r)
+        words.append(word)
+    return words
+
+
+def _round_masks(n_slots):
+    return [np.uint32(sum(1 << (k << r) for k in range(n_slots >> (r + 1))))
+        for r in range(n_rounds(n_slots))]
+
+
+class Scorer(object):
+    """
+    Scores entries against a fixed set of outcomes, with the outcomes'
+    spread words computed once.
+
+    Inputs:
+        outcomes: uint64 codes of the actual or simulated results
+        weights: Points per correct pick of each round. For brackets with
+            fewer rounds the last weights are used
+        n_slots: First-round slots of the bracket
+    """
+    def __init__(self, outcomes, weights=ROUND_WEIGHTS, n_slots=64):
+        rounds = n_rounds(n_slots)
+        if len(weights) < rounds:
+            raise ValueError('Need a weight for each of the {} '
+                'rounds'.format(rounds))
+        self.outcomes = np.atleast_1d(np.asarray(outcomes, dtype=np.uint64))
+        self.n_slots = n_slots
+        self.weights = [int(w) for w in list(weights)[-rounds:]]
+        self.masks = _round_masks(n_slots)
+        top = sum(w * (n_slots >> (r + 1))
+            for r, w in enumerate(self.weights))
+        self.dtype = np.int16 if top <= np.iinfo(np.int16).max else np.int32
+
+        self.words = spread_rounds(self.outcomes, n_slots)
+        # games whose winner came from the first child
+        self.first = [~o & m for o, m in zip(self.words, self.masks)]
+        # entry ^ ~o has the bits where the pick agrees with the outcome
+        self.agree = [~o for o in self.words]
+
+    def block(self, entry_words, start=0, stop=None):
+        """
+        (entries, outcomes[start:stop]) scores of entries given as
+        spread_rounds words
+        """
+        cols = slice(start, stop)
+        shape = (len(entry_words[0]), len(self.outcomes[cols]))
+        correct = np.empty(shape, dtype=np.uint32)
+        tmp = np.empty(shape, dtype=np.uint32)
+        count = np.empty(shape, dtype=np.uint8)
+        score = np.zeros(shape, dtype=self.dtype)
+        points = np.empty(shape, dtype=self.dtype)
+        for r, (mask, weight) in enumerate(zip(self.masks, self.weights)):
+            if r > 0:
+                # the previous round's correct picks in the child game the
+                # winner came from
+                np.right_shift(correct, np.uint32(1 << (r - 1)), out=tmp)
+                tmp &= self.words[r][None, cols]
+                correct &= self.first[r][None, cols]
+                correct |= tmp
+                np.bitwise_xor(entry_words[r][:, None],
+                    self.agree[r][None, cols], out=tmp)
+                correct &= tmp
+            else:
+                np.bitwise_xor(entry_words[0][:, None],
+                    self.agree[0][None, cols], out=correct)
+                correct &= mask
+            np.bitwise_count(correct, out=count)
+            np.multiply(count, weight, out=points, dtype=self.dtype)
+            score += points
+        return score
+
+    def tiles(self, entries, name):
+        """
+        Yields (first entry, outcome slice, scores) over cache-sized tiles
+        of all entries x outcomes, reading entries a chunk at a time
+        """
+        n_entries, n_outcomes = len(entries), len(self.outcomes)
+        with progress.stage(name, total=n_entries) as task:
+            for start in range(0, n_entries, ENTRY_CHUNK):
+                stop = min(start + ENTRY_CHUNK, n_entries)
+                words = spread_rounds(entries[start:stop], self.n_slots)
+                for e in range(0, stop - start, TILE_ENTRIES):
+                    tile = [w[e:e + TILE_ENTRIES] for w in words]
+                    for o in range(0, n_outcomes, TILE_OUTCOMES):
+                        cols = slice(o, o + TILE_OUTCOMES)
+                        yield start + e, cols, self.block(tile, cols.start,
+                            cols.stop)
+                task.advance(stop - start)
+
+
+def score(entries, outcomes, weights=ROUND_WEIGHTS, n_slots=64):
+    """
+    Scores of every entry against every outcome.
+
+    Inputs:
+        entries: uint64 codes of the entries
+        outcomes, weights, n_slots: As for Scorer
+    Outputs:
+        (entries, outcomes) integer array
+    """
+    scorer = Scorer(outcomes, weights, n_slots)
+    return scorer.block(spread_rounds(entries, n_slots))
+
+
+def score_summary(entries, outcomes, weights=ROUND_WEIGHTS, n_slots=64,
+        wins=True):
+    """
+    Expected score and chance of winning the pool of every entry, for pools
+    too large to hold the entries x outcomes scores.
+
+    Entries are read a chunk at a time (a memory-mapped array is never read
+    whole) and scored in tiles small enough to stay in cache. The first
+    pass keeps each outcome's best score, how many entries reached it and
+    the first that did; outcomes with a tie for best are scored again to
+    split them.
+
+    Inputs:
+        entries: uint64 codes, e.g. from load_entries
+        outcomes: uint64 codes of simulated results
+        weights, n_slots: As for Scorer
+        wins: Whether to compute win shares
+    Outputs:
+        DataFrame with mean_score and, with wins, win_share (outcomes won,
+        ties split, over the number of outcomes) per entry
+    """
+    scorer = Scorer(outcomes, weights, n_slots)
+    n_entries, n_outcomes = len(entries), len(scorer.outcomes)
+    total = np.zeros(n_entries, dtype=np.int64)
+    best = np.full(n_outcomes, -1, dtype=np.int64)
+    n_best = np.zeros(n_outcomes, dtype=np.int64)
+    winner = np.zeros(n_outcomes, dtype=np.int64)
+
+    for start, cols, block in scorer.tiles(entries, 'Scoring entries'):
+        total[start:start + len(block)] += block.sum(axis=1)
+        top = block.max(axis=0)
+        count = (block == top).sum(axis=0)
+        better = top > best[cols]
+        n_best[cols] = np.where(better, count,
+            np.where(top == best[cols], n_best[cols] + count, n_best[cols]))
+        if better.any():
+            winner[cols] = np.where(better, start + block.argmax(axis=0),
+                winner[cols])
+        best[cols] = np.maximum(best[cols], top)
+
+    result = pd.DataFrame({'mean_score': total / n_outcomes})
+    if wins:
+        unique = n_best == 1
+        share = np.bincount(winner[unique], minlength=n_entries).astype(
+            float)
+        tied = np.flatnonzero(~unique)
+        if len(tied):
+            rescore = Scorer(scorer.outcomes[tied], weights, n_slots)
+            for start, cols, block in rescore.tiles(entries, 'Splitting '
+                    'ties'):
+                share[start:start + len(block)] += ((block ==
+                    best[tied][cols]) / n_best[tied][cols]).sum(axis=1)
+        result['win_share'] = share / n_outcomes
+    return result
+
+
+def create_entries(path, n):
+    """
+    New memory-mapped .npy array of n entry codes, to be filled in chunks
+    """
+    return np.lib.format.open_memmap(path, mode='w+', dtype=np.uint64,
+        shape=(n,))
+
+
+def load_entries(path):
+    """
+    Memory-mapped read-only view of a .npy array of entry codes
+    """
+    entries = np.load(path, mmap_mode='r')
+    if entries.dtype != np.uint64 or entries.ndim != 1:
+        raise ValueError('{} must hold a flat uint64 array, not {} {}'.format(
+            path, entries.dtype, entries.shape))
+    return entries
+
+
+class BracketCodec(object):
+    """
+    Encodes and decodes brackets of one field.
+
+    Inputs:
+        slots: First-round slots in bracket order, as from
+            bracket_pdf.bracket_slots: team names, (team, team) play-in
+            tuples or None for byes
+    """
+    def __init__(self, slots):
+        self.slots = list(slots)
+        self.n_slots = len(self.slots)
+        self.n_rounds = n_rounds(self.n_slots)
+        self.offsets = round_offsets(self.n_slots)
+        self.n_games = int(self.offsets[-1])
+        self.slot_of = {}
+        for i, slot in enumerate(self.slots):
+            for team in (slot if isinstance(slot, tuple) else [slot]):
+                if team is not None:
+                    self.slot_of[team] = i
+        self.win_prob = None
+        self.teams = None
+
+    @classmethod
+    def from_bracketeer(cls, bracket, slots=None):
+        """
+        Codec of a Bracketeer's field after get_tourney_teams, with the
+        win_model probabilities used by simulate. slots defaults to the
+        bracket_slots of the field; pass excel_import.template_slots for
+        entries read from Excel brackets
+        """
+        field = bracket.final_68
+        if slots is None:
+            slots = bracket_slots(field, bracket.bracket_format)
+        codec = cls(slots)
+        strength = team_strength(field['final_rank'].values,
+            use_metrics=bracket.use_metrics,
+            n_teams=len(bracket.team_data_df))
+        codec.teams = list(field['Team'])
+        codec.win_prob = win_prob_matrix(strength)
+        return codec
+
+    def label(self, slot):
+        team = self.slots[slot]
+        if isinstance(team, tuple):
+            return '/'.join(team)
+        return team
+
+    def game_round(self, game):
+        return int(np.searchsorted(self.offsets, game, side='right')) - 1
+
+    def encode_slots(self, winners):
+        """
+        Codes from winning slots.
+
+        Inputs:
+            winners: (n, n_games) int array of the first-round slot of each
+                game's winner, games in code order
+        Outputs:
+            uint64 array of n codes. Winners that couldn't have played in
+            their game raise ValueError
+        """
+        winners = np.atleast_2d(np.asarray(winners, dtype=np.int64))
+        codes = np.zeros(len(winners), dtype=np.uint64)
+        previous = None
+        for r in range(self.n_rounds):
+            start, stop = self.offsets[r], self.offsets[r + 1]
+            slots = winners[:, start:stop]
+            games = np.arange(stop - start)
+            if ((slots >> (r + 1)) != games).any():
+                raise ValueError('A round {} winner is not from its '
+                    'game'.format(r + 1))
+            bits = (slots >> r) & 1
+            if previous is not None:
+                # the winner must have won the child game it came from
+                child = np.take_along_axis(previous, 2 * games + bits, axis=1)
+                if (child != slots).any():
+                    raise ValueError('A round {} winner did not win its '
+                        'previous game'.format(r + 1))
+            codes |= (bits.astype(np.uint64) << np.arange(start, stop,
+                dtype=np.uint64)).sum(axis=1, dtype=np.uint64)
+            previous = slots
+        return codes
+
+    def decode_slots(self, codes):
+        """
+        (n, n_games) array of each game's winning first-round slot
+        """
+        codes = np.atleast_1d(np.asarray(codes, dtype=np.uint64))
+        winners = np.empty((len(codes), self.n_games), dtype=np.int64)
+        previous = np.arange(self.n_slots)[None, :].repeat(len(codes), 0)
+        for r in range(self.n_rounds):
+            start, stop = self.offsets[r], self.offsets[r + 1]
+            bits = ((codes[:, None] >> np.arange(start, stop,
+                dtype=np.uint64)) & np.uint64(1)).astype(np.int64)
+            games = np.arange(stop - start)
+            previous = np.take_along_axis(previous, 2 * games + bits, axis=1)
+            winners[:, start:stop] = previous
+        return winners
+
+    def encode(self, winners):
+        """
+        Code of one bracket from the winner of every game in code order
+        (team names; either team of a play-in game stands for its slot)
+        """
+        if len(winners) != self.n_games:
+            raise ValueError('Need {} winners, got {}'.format(self.n_games,
+                len(winners)))
+        try:
+            slots = [self.slot_of[w] for w in winners]
+        except KeyError as e:
+            raise KeyError('{} is not in the bracket'.format(e))
+        return int(self.encode_slots([slots])[0])
+
+    def decode(self, code):
+        """
+        Winner of every game of a code, in code order
+        """
+        return [self.label(s) for s in self.decode_slots([code])[0]]
+
+    def to_frame(self, code):
+        """
+        DataFrame of round (1 for the first round) and winner of every game
+        """
+        return pd.DataFrame({
+            'round': [self.game_round(g) + 1 for g in range(self.n_games)],
+            'winner': self.decode(code),
+        })
+
+    def simulate(self, n, win_prob=None, seed=None):
+        """
+        Codes of n simulated tournaments.
+
+        Inputs:
+            n: Number of tournaments
+            win_prob: Matrix where win_prob[i, j] is the probability
+                self.teams[i] beats self.teams[j] (default: the matrix from
+                from_bracketeer)
+            seed: Random seed
+        """
+        win_prob = self.win_prob if win_prob is None else np.asarray(
+            win_prob)
+        if win_prob is None or self.teams is None:
+            raise ValueError('simulate needs teams and win probabilities; '
+                'build the codec with from_bracketeer')
+        rng = np.random.default_rng(seed)
+        index = {t: i for i, t in enumerate(self.teams)}
+
+        # each slot's team, with play-in games played first; -1 is a bye
+        current = np.full((n, self.n_slots), -1, dtype=np.int64)
+        for s, slot in enumerate(self.slots):
+            if isinstance(slot, tuple):
+                a, b = index[slot[0]], index[slot[1]]
+                current[:, s] = np.where(rng.random(n) < win_prob[a, b], a,
+                    b)
+            elif slot is not None:
+                current[:, s] = index[slot]
+
+        codes = np.zeros(n, dtype=np.uint64)
+        for r in range(self.n_rounds):
+            a, b = current[:, 0::2], current[:, 1::2]
+            p = win_prob[np.maximum(a, 0), np.maximum(b, 0)]
+            p = np.where(b < 0, 1., np.where(a < 0, 0., p))
+            first = rng.random(p.shape) < p
+            start, stop = self.offsets[r], self.offsets[r + 1]
+            codes |= ((~first).astype(np.uint64) << np.arange(start, stop,
+                dtype=np.uint64)).sum(axis=1, dtype=np.uint64)
+            current = np.where(first, a, b)
+        return codes
@@ -0,0 +1,188 @@
+"""Field-size independent description of a tournament bracket.
+
+The NCAA shape (68 teams, 4 regions of 16, four play-in games on the 11 and
+16 lines) is one instance of ``BracketFormat``.  Seed lines, play-in slots,
+byes, matchup order, pods and round names are all derived from the field size
+and region count, so NIT-style 32-team fields, expanded 76/96-team proposals
+and simulated leagues with thousands of teams use the same code path.
+"""
+
+import numpy as np
+
+
+REGION_NAMES = ['SOUTH', 'WEST', 'EAST', 'MIDWEST']
+
+
+def matchup_order(size):
+    """Return the seeds of a ``size``-team region in bracket order.
+
+    Seeds that meet in the first round are adjacent, and each block of
+    2**k slots holds the seeds that can meet by round k.  Blocks are split
+    the standard way (the block led by seed s pairs with the block led by
+    ``2 * size / k + 1 - s``).  As on the NCAA bracket, the block holding the
+    top seed is listed first and otherwise the stronger block is listed
+    second, with the better seed first in each first-round game.  For 16
+    teams this gives 1, 16, 8, 9, 5, 12, 4, 13, 6, 11, 3, 14, 7, 10, 2, 15.
+
+    Runs in O(size).
+    """
+    if size < 2 or size & (size - 1):
+        raise ValueError(f'region size must be a power of two >= 2, '
+                         f'got {size}')
+
+    def block(k, best):
+        if k == 2:
+            return [best, size + 1 - best]
+        partner = 2 * size // k + 1 - best
+        top, other = block(k // 2, best), block(k // 2, partner)
+        return top + other if best == 1 else other + top
+
+    return block(size, 1)
+
+
+def round_name(round_idx, n_rounds):
+    """Name of round ``round_idx`` (1-based) in a tournament of n_rounds."""
+    from_end = n_rounds - round_idx
+    names = ['Championship', 'Final Four', 'Elite Eight', 'Sweet 16']
+    if from_end < len(names) and round_idx > 1:
+        return names[from_end]
+    suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(
+        round_idx if round_idx < 20 else round_idx % 10, 'th')
+    return f'{round_idx}{suffix} Round'
+
+
+class BracketFormat:
+    """Shape of a single-elimination tournament split into regions.
+
+    Parameters
+    ----------
+    n_teams : int
+        Teams in the field (68 for the NCAA tournament).
+    n_regions : int
+        Number of regions, a power of two >= 2.
+    byes : bool
+        How a field that doesn't fill the regions exactly is handled.  If
+        False (default) each region has the largest power-of-two size that
+        fits and the extra teams play in on top of it.  If True each region
+        has the smallest power-of-two size that holds the field and the top
+        seeds get byes (e.g. the 96-team proposal: 4 regions of 32, seeds
+        1-8 on a bye).
+    play_in_lines : dict, optional
+        Seed line -> number of play-in games on that line.  Defaults to
+        splitting the games between the bottom line (automatic bids) and the
+        last at-large line (line 11 of 16), moving up a line whenever one is
+        full.
+    region_names : list of str, optional
+        Defaults to the NCAA regions for four regions, 'REGION n' otherwise.
+    bubble_size : int
+        Teams just outside the at-large cut reported as first four out /
+        next four out.
+    """
+
+    def __init__(self, n_teams=68, n_regions=4, byes=False,
+                 play_in_lines=None, region_names=None, bubble_size=8):
+        if n_regions < 2 or n_regions & (n_regions - 1):
+            raise ValueError(f'n_regions must be a power of two >= 2, '
+                             f'got {n_regions}')
+        if n_teams < 2 * n_regions:
+            raise ValueError(f'{n_teams} teams cannot fill {n_regions} '
+                             f'regions')
+
+        self.n_teams = n_teams
+        self.n_regions = n_regions
+        self.bubble_size = bubble_size
+
+        size = 2
+        while n_regions * size * 2 <= n_teams:
+            size *= 2
+        if byes and n_regions * size < n_teams:
+            size *= 2
+        self.region_size = size
+        self.n_slots = n_regions * size
+
+        n_games = max(n_teams - self.n_slots, 0)
+        if play_in_lines is None:
+            play_in_lines = self._default_play_in_lines(n_games)
+        elif sum(play_in_lines.values()) != n_games:
+            raise ValueError(f'play_in_lines holds '
+                             f'{sum(play_in_lines.values())} games, the '
+                             f'field needs {n_games}')
+        elif max(play_in_lines.values(), default=0) > n_regions:
+            raise ValueError('a seed line can hold at most one play-in game '
+                             'per region')
+        self.play_in_lines = {s: g for s, g in sorted(play_in_lines.items())
+                              if g}
+        self.n_play_in_games = n_games
+        self.n_byes = max(self.n_slots - n_teams, 0)
+
+        if region_names is None:
+            region_names = REGION_NAMES if n_regions == 4 else [
+                f'REGION {i + 1}' for i in range(n_regions)]
+        if len(region_names) != n_regions:
+            raise ValueError('need one region name per region')
+        self.region_names = list(region_names)
+
+        self.matchup_order = matchup_order(size)
+        self.region_rounds = size.bit_length() - 1
+
+        # Seeds that can meet within the first two rounds of a region
+        pod = min(4, size)
+        self.pods = [set(self.matchup_order[i:i + pod])
+                     for i in range(0, size, pod)]
+
+        lines = np.arange(1, size + 1)
+        if byes:
+            counts = np.full(size, n_regions)
+            full, extra = divmod(n_teams, n_regions)
+            counts[full:] = 0
+            if extra:
+                counts[full] = extra
+        else:
+            counts = np.full(size, n_regions)
+            for s, g in self.play_in_lines.items():
+                counts[s - 1] += g
+        self.line_counts = counts
+        self.seeds = np.repeat(lines, counts)
+
+    def __repr__(self):
+        return (f'BracketFormat(n_teams={self.n_teams}, '
+                f'n_regions={self.n_regions}, '
+                f'region_size={self.region_size})')
+
+    @property
+    def is_default(self):
+        """True for the standard 68-team NCAA shape."""
+        return (self.n_teams == 68 and self.n_regions == 4
+                and self.region_size == 16
+                and self.play_in_lines == {11: 2, 16: 2})
+
+    def _default_play_in_lines(self, n_games):
+        """Alternate games between the bottom and last at-large lines."""
+        size, cap = self.region_size, self.n_regions
+        anchors = [size, size - size // 4 - 1 if size >= 4 else 1]
+        lines = {}
+        for i in range(n_games):
+            s = anchors[i % 2]
+            while lines.get(s, 0) >= cap:
+                s -= 1
+                if s < 1:
+                    s = size
+            lines[s] = lines.get(s, 0) + 1
+            anchors[i % 2] = s
+        return lines
+
+    def line_starts(self):
+        """Index into the seeded field where each seed line starts."""
+        return np.concatenate([[0], np.cumsum(self.line_counts)[:-1]])
+
+    def pod_of_seed(self):
+        """Dictionary of seed -> index of its pod within the region."""
+        return {s: i for i, pod in enumerate(self.pods) for s in pod}
+
+    def round_names(self):
+        """Names of every round after the play-in games."""
+        total = self.n_slots.bit_length() - 1
+        return [round_name(r, total) for r in range(1, total + 1)]
+
+
+DEFAULT_FORMAT = BracketFormat()
@@ -6,6 +6,8 @@ from reportlab.lib.colors import HexColor
 import datetime
 import os
 
+from bracket_format import DEFAULT_FORMAT, REGION_NAMES
+
 
 # Page and layout
 PAGE_W, PAGE_H = landscape(letter)  # 792 x 612
@@ -20,12 +22,12 @@ NAVY = HexColor('#0a2240')
 MID_GRAY = HexColor('#666666')
 LINE_COLOR = HexColor('#333333')
 
-# Bracket constants
-MATCHUP_ORDER = [1, 16, 8, 9, 5, 12, 4, 13, 6, 11, 3, 14, 7, 10, 2, 15]
-REGION_NAMES = ['SOUTH', 'WEST', 'EAST', 'MIDWEST']
+# Bracket constants (the 68-team NCAA shape; see bracket_format)
+MATCHUP_ORDER = DEFAULT_FORMAT.matchup_order
 
 
-def generate_bracket_pdf(final_68_df, output_path=None, title=None):
+def generate_bracket_pdf(final_68_df, output_path=None, title=None,
+                         bracket_format=None):
     """Generate a PDF bracket from the final 68 teams DataFrame.
 
     Parameters
@@ -37,6 +39,9 @@ def generate_bracket_pdf(final_68_df, output_path=None, title=None):
         Where to save the PDF.  Defaults to brackets/bracket_<date>.pdf
     title : str, optional
         Title printed at the top of the bracket.
+    bracket_format : BracketFormat, optional
+        Shape of the field.  Defaults to the 68-team NCAA bracket; other
+        shapes split the regions evenly between the two sides of the page.
 
     Returns
     -------
@@ -52,7 +57,8 @@ def generate_bracket_pdf(final_68_df, output_path=None, title=None):
 
     os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
 
-    regions, first_four = _assign_teams(final_68_df)
+    fmt = bracket_format or DEFAULT_FORMAT
+    regions, first_four = _assign_teams(final_68_df, fmt)
 
     c = pdf_canvas.Canvas(output_path, pagesize=landscape(letter))
 
@@ -61,15 +67,19 @@ def generate_bracket_pdf(final_68_df, output_path=None, title=None):
     bracket_bottom = MARGIN + FF_H
     bracket_h = bracket_top - bracket_bottom
 
+    # Regions are stacked half on each side of the page
+    per_side = fmt.n_regions // 2
     region_gap = 8
-    region_h = (bracket_h - region_gap) / 2
+    region_h = (bracket_h - region_gap * (per_side - 1)) / per_side
 
-    # Uniform column widths: 11 equal cols (4 left + 3 center + 4 right)
-    # Team names are drawn inside the first round column on each side.
+    # Uniform column widths: one per regional round on each side plus the
+    # national rounds in the center (11 for 68 teams: 4 left + 3 center + 4
+    # right).  Team names are drawn inside the first round column.
+    center_cols = 2 * (per_side.bit_length() - 1) + 1
     total_w = PAGE_W - 2 * MARGIN
-    round_w = total_w / 11
-    center_w = round_w * 3
-    half_w = round_w * 4
+    round_w = total_w / (2 * fmt.region_rounds + center_cols)
+    center_w = round_w * center_cols
+    half_w = round_w * fmt.region_rounds
     name_w = 0
 
     # Title
@@ -79,26 +89,24 @@ def generate_bracket_pdf(final_68_df, output_path=None, title=None):
 
     # Round headers
     _draw_round_headers(c, MARGIN, half_w, center_w, name_w, round_w,
-                        PAGE_H - MARGIN - TITLE_H - 10)
+                        PAGE_H - MARGIN - TITLE_H - 10, fmt.round_names())
 
-    # Four regions
+    # Regions: the first half top to bottom on the left, the rest on the
+    # right (for four regions: 0 top-left, 1 bottom-left, 2 top-right,
+    # 3 bottom-right)
     left_x = MARGIN
     right_x = PAGE_W - MARGIN - half_w
-    top_y = bracket_top
-    bot_y = bracket_top - region_h - region_gap
-
-    configs = [
-        (left_x,  top_y, 'right'),   # region 0 – top-left
-        (left_x,  bot_y, 'right'),   # region 1 – bottom-left
-        (right_x, top_y, 'left'),    # region 2 – top-right
-        (right_x, bot_y, 'left'),    # region 3 – bottom-right
-    ]
+    configs = []
+    for x, d in ((left_x, 'right'), (right_x, 'left')):
+        for k in range(per_side):
+            configs.append((x, bracket_top - k * (region_h + region_gap), d))
 
+    empty = 'BYE' if fmt.n_byes else 'TBD'
     finals_y = []
     for i, (rx, ry, d) in enumerate(configs):
-        teams = _matchup_order(regions[i])
+        teams = _matchup_order(regions[i], fmt.matchup_order, empty)
         fy = _draw_region(c, teams, rx, ry, d, half_w, region_h,
-                          name_w, round_w, REGION_NAMES[i])
+                          name_w, round_w, fmt.region_names[i])
         finals_y.append(fy)
 
     # Final Four + Championship
@@ -116,58 +124,89 @@ def generate_bracket_pdf(final_68_df, output_path=None, title=None):
 # Internal helpers
 # ---------------------------------------------------------------------------
 
-def _assign_teams(df):
-    """S-curve assignment of 68 teams into 4 regions + First Four list.
+def _assign_teams(df, bracket_format=None):
+    """S-curve assignment of the field into regions + First Four list.
 
     After initial placement, swaps same-seeded teams between regions to
     minimize same-conference matchups in the first two rounds.
     """
-    regions = {i: {} for i in range(4)}
+    fmt = bracket_format or DEFAULT_FORMAT
+    n = fmt.n_regions
+    regions = {i: {} for i in range(n)}
     first_four = []
 
     seed_groups = {}
-    for _, row in df.iterrows():
-        seed = int(row['seed'])
-        seed_groups.setdefault(seed, []).append(row['Team'])
+    for team, seed in zip(df['Team'], df['seed']):
+        seed_groups.setdefault(int(seed), []).append(team)
 
     for seed in sorted(seed_groups):
         teams = seed_groups[seed]
-        order = [0, 1, 2, 3] if seed % 2 == 1 else [3, 2, 1, 0]
-
-        if len(teams) == 4:
-            for i, r in enumerate(order):
-                regions[r][seed] = teams[i]
-        elif len(teams) == 6:
-            # First two go directly; next four form two play-in games
-            regions[order[0]][seed] = teams[0]
-            regions[order[1]][seed] = teams[1]
-            regions[order[2]][seed] = 'Play-in'
-            regions[order[3]][seed] = 'Play-in'
-            first_four.append((teams[2], teams[3], seed))
-            first_four.append((teams[4], teams[5], seed))
+        order = list(range(n)) if seed % 2 == 1 else list(range(n - 1, -1, -1))
+
+        # The best teams on the line go directly; any extra teams pair up
+        # into play-in games for the remaining regions (68 teams: two
+        # direct and two play-in games on the 11 and 16 lines).  Regions
+        # left over on a short line get a bye.
+        n_games = max(len(teams) - n, 0)
+        n_direct = len(teams) - 2 * n_games
+        for i in range(n_direct):
+            regions[order[i]][seed] = teams[i]
+        for g in range(n_games):
+            regions[order[n_direct + g]][seed] = 'Play-in'
+            first_four.append((teams[n_direct + 2 * g],
+                               teams[n_direct + 2 * g + 1], seed))
 
     # Build team -> conference lookup if conference data is available
     if 'Conf' in df.columns:
-        team_conf = {}
-        for _, row in df.iterrows():
-            team_conf[row['Team']] = row['Conf']
-        regions = _separate_conferences(regions, team_conf)
+        team_conf = dict(zip(df['Team'], df['Conf']))
+        regions = _separate_conferences(regions, team_conf, fmt.pods)
 
     return regions, first_four
 
 
+def bracket_slots(final_68_df, bracket_format=None):
+    """Return every first-round slot of the bracket in drawing order.
+
+    Regions in order, each in matchup order, exactly as the PDF places
+    them.  A slot is a team name, a (team, team) tuple for a play-in game,
+    or None for a bye.
+    """
+    fmt = bracket_format or DEFAULT_FORMAT
+    regions, first_four = _assign_teams(final_68_df, fmt)
+    n = fmt.n_regions
+
+    # _assign_teams fills play-in regions in S-curve order, and conference
+    # separation never moves a play-in slot
+    play_ins = {}
+    games = {}
+    for t1, t2, seed in first_four:
+        games.setdefault(seed, []).append((t1, t2))
+    for seed, pairs in games.items():
+        order = range(n) if seed % 2 == 1 else range(n - 1, -1, -1)
+        open_regions = [r for r in order if regions[r].get(seed) == 'Play-in']
+        for r, pair in zip(open_regions, pairs):
+            play_ins[(r, seed)] = pair
+
+    slots = []
+    for r in range(n):
+        for seed in fmt.matchup_order:
+            team = regions[r].get(seed)
+            slots.append(play_ins.get((r, seed), team))
+    return slots
+
+
 # Round-2 pods: seeds that can meet by the second round within a region
-_PODS = [{1, 16, 8, 9}, {5, 12, 4, 13}, {6, 11, 3, 14}, {7, 10, 2, 15}]
+_PODS = DEFAULT_FORMAT.pods
 
 
-def _conf_conflicts(regions, team_conf):
+def _conf_conflicts(regions, team_conf, pods=_PODS):
     """Count same-conference pairs sharing a region, weighted by proximity.
 
     Pod-level conflicts (can meet in rounds 1-2) score 2.
     Same-region but different-pod conflicts (meet in Sweet 16) score 1.
     """
     score = 0
-    for r in range(4):
+    for r in range(len(regions)):
         teams_in_region = [
             (seed, team) for seed, team in regions[r].items()
             if team != 'Play-in'
@@ -178,30 +217,60 @@ def _conf_conflicts(regions, team_conf):
                 s_j, t_j = teams_in_region[j]
                 if team_conf.get(t_i) == team_conf.get(t_j):
                     same_pod = any(
-                        s_i in pod and s_j in pod for pod in _PODS
+                        s_i in pod and s_j in pod for pod in pods
                     )
                     score += 2 if same_pod else 1
     return score
 
 
-def _separate_conferences(regions, team_conf):
+def _separate_conferences(regions, team_conf, pods=_PODS):
     """Swap same-seeded teams between regions to reduce conference conflicts.
 
     Iterates over each seed line and tries all pairwise region swaps,
     greedily accepting any swap that lowers the total conflict score.
     Multiple passes until no improvement is found.
+
+    The score of _conf_conflicts equals the number of same-conference pairs
+    per region plus the number per pod, so it is kept as conference counts
+    per region and per pod and each swap is scored in O(1) from the counts
+    it changes instead of recounting every pair in the bracket.
     """
+    pod_of = {s: i for i, pod in enumerate(pods) for s in pod}
+    region_counts = {}
+    pod_counts = {}
+
+    def conf_of(team):
+        conf = team_conf.get(team)
+        return None if conf != conf else conf  # NaN never conflicts
+
+    def move(r, seed, conf, step):
+        """Add (step=1) or remove (step=-1) a team; return the score change."""
+        if conf is None:
+            return 0
+        delta = 0
+        for counts, key in ((region_counts, (r, conf)),
+                            (pod_counts, (r, pod_of.get(seed), conf))):
+            n = counts.get(key, 0)
+            delta += n if step > 0 else -(n - 1)
+            counts[key] = n + step
+        return delta
+
+    for r in regions:
+        for seed, team in regions[r].items():
+            if team != 'Play-in':
+                move(r, seed, conf_of(team), 1)
+
     improved = True
     while improved:
         improved = False
         seeds_in_bracket = set()
-        for r in range(4):
+        for r in regions:
             seeds_in_bracket.update(regions[r].keys())
 
         for seed in sorted(seeds_in_bracket):
             # Collect which regions have a real team at this seed
             candidates = [
-                r for r in range(4)
+                r for r in regions
                 if regions[r].get(seed) and regions[r][seed] != 'Play-in'
             ]
             if len(candidates) < 2:
@@ -210,52 +279,67 @@ def _separate_conferences(regions, team_conf):
             for a in range(len(candidates)):
                 for b in range(a + 1, len(candidates)):
                     ra, rb = candidates[a], candidates[b]
-                    before = _conf_conflicts(regions, team_conf)
+                    ca = conf_of(regions[ra][seed])
+                    cb = conf_of(regions[rb][seed])
+                    if ca == cb:
+                        continue
 
                     # Try swap
-                    regions[ra][seed], regions[rb][seed] = (
-                        regions[rb][seed], regions[ra][seed]
-                    )
-                    after = _conf_conflicts(regions, team_conf)
+                    delta = (move(ra, seed, ca, -1) + move(rb, seed, cb, -1)
+                             + move(ra, seed, cb, 1) + move(rb, seed, ca, 1))
 
-                    if after < before:
-                        improved = True  # keep swap, restart
-                    else:
-                        # revert
+                    if delta < 0:
                         regions[ra][seed], regions[rb][seed] = (
                             regions[rb][seed], regions[ra][seed]
                         )
+                        improved = True  # keep swap, restart
+                    else:
+                        # revert
+                        move(ra, seed, cb, -1)
+                        move(rb, seed, ca, -1)
+                        move(ra, seed, ca, 1)
+                        move(rb, seed, cb, 1)
 
     return regions
 
 
-def _matchup_order(region):
+def _matchup_order(region, order=MATCHUP_ORDER, empty='TBD'):
     """Return [(seed, team), ...] in standard bracket order for a region."""
-    return [(s, region.get(s, 'TBD')) for s in MATCHUP_ORDER]
+    return [(s, region.get(s, empty)) for s in order]
 
 
 # ---------------------------------------------------------------------------
 # Drawing helpers
 # ---------------------------------------------------------------------------
 
-def _draw_round_headers(c, margin, half_w, center_w, name_w, round_w, y):
+def _draw_round_headers(c, margin, half_w, center_w, name_w, round_w, y,
+                        round_names=None):
+    if round_names is None:
+        round_names = DEFAULT_FORMAT.round_names()
+    n_region = int(round(half_w / round_w))
+    national = round_names[n_region:-1]
+    center_cols = 2 * len(national) + 1
+
     c.setFont('Helvetica', 5.5)
     c.setFillColor(MID_GRAY)
 
-    left_labels = ['1st Round', '2nd Round', 'Sweet 16', 'Elite Eight']
+    left_labels = round_names[:n_region]
     for i, lbl in enumerate(left_labels):
         x = margin + (i + 0.5) * round_w
         c.drawCentredString(x, y, lbl)
 
     cx = margin + half_w
-    c.setFont('Helvetica', 5)
-    c.drawCentredString(cx + center_w * 0.2, y, 'Final Four')
+    for i, lbl in enumerate(national):
+        c.setFont('Helvetica', 5)
+        c.drawCentredString(cx + center_w * (i + 0.6) / center_cols, y, lbl)
     c.setFont('Helvetica-Bold', 5)
-    c.drawCentredString(cx + center_w * 0.5, y, 'Championship')
-    c.setFont('Helvetica', 5)
-    c.drawCentredString(cx + center_w * 0.8, y, 'Final Four')
+    c.drawCentredString(cx + center_w * 0.5, y, round_names[-1])
+    for i, lbl in reversed(list(enumerate(national))):
+        c.setFont('Helvetica', 5)
+        c.drawCentredString(cx + center_w * (1 - (i + 0.6) / center_cols),
+                            y, lbl)
 
-    right_labels = ['Elite Eight', 'Sweet 16', '2nd Round', '1st Round']
+    right_labels = left_labels[::-1]
     rx = margin + half_w + center_w
     for i, lbl in enumerate(right_labels):
         x = rx + (i + 0.5) * round_w
@@ -269,22 +353,27 @@ def _draw_round_headers(c, margin, half_w, center_w, name_w, round_w, y):
 
 def _draw_region(c, teams, x0, y0, direction, width, height,
                  name_w, round_w, region_name):
-    """Draw one 16-team region bracket. Returns y of region winner."""
-    n = 16
+    """Draw one region bracket. Returns y of region winner."""
+    n = len(teams)
+    rounds = n.bit_length() - 1
     slot_h = height / n
 
-    # y positions per round (round 0 = 16 slots, ..., round 4 = 1 slot)
+    # y positions per round (round 0 = n slots, ..., last round = 1 slot)
     ys = [[y0 - (i + 0.5) * slot_h for i in range(n)]]
-    for _ in range(4):
+    for _ in range(rounds):
         prev = ys[-1]
         ys.append([(prev[j] + prev[j + 1]) / 2
                    for j in range(0, len(prev), 2)])
 
     # x of each vertical junction — names are inside the first round column
     if direction == 'right':
-        jx = [x0 + (i + 1) * round_w for i in range(4)]
+        jx = [x0 + (i + 1) * round_w for i in range(rounds)]
     else:
-        jx = [x0 + width - (i + 1) * round_w for i in range(4)]
+        jx = [x0 + width - (i + 1) * round_w for i in range(rounds)]
+
+    # Shrink text for large regions so rows don't overlap
+    font = min(5.5, slot_h * 0.8)
+    seed_w = max(12, c.stringWidth(str(n), 'Helvetica-Bold', font) + 3)
 
     # Region label – above the bracket area
     c.setFont('Helvetica-Bold', 5.5)
@@ -299,7 +388,7 @@ def _draw_region(c, teams, x0, y0, direction, width, height,
     c.setStrokeColor(LINE_COLOR)
     c.setLineWidth(0.5)
 
-    for rd in range(4):
+    for rd in range(rounds):
         positions = ys[rd]
         if rd == 0:
             h_start = x0 if direction == 'right' else x0 + width
@@ -313,55 +402,65 @@ def _draw_region(c, teams, x0, y0, direction, width, height,
             c.line(jx[rd], yt, jx[rd], yb)
 
     # Winner line
-    wy = ys[4][0]
+    wy = ys[rounds][0]
     if direction == 'right':
-        c.line(jx[3], wy, jx[3] + round_w * 0.5, wy)
+        c.line(jx[-1], wy, jx[-1] + round_w * 0.5, wy)
     else:
-        c.line(jx[3], wy, jx[3] - round_w * 0.5, wy)
+        c.line(jx[-1], wy, jx[-1] - round_w * 0.5, wy)
 
     # Team names (drawn inside the first round column)
     for i, (seed, team) in enumerate(teams):
         y = ys[0][i]
         display = team if len(team) <= 16 else team[:15] + '.'
 
+        label = '' if team == 'BYE' else str(seed)
         if direction == 'right':
-            c.setFont('Helvetica-Bold', 5.5)
+            c.setFont('Helvetica-Bold', font)
             c.setFillColor(DARK)
-            c.drawString(x0 + 1, y + 1.5, str(seed))
-            c.setFont('Helvetica', 5.5)
-            c.drawString(x0 + 12, y + 1.5, display)
+            c.drawString(x0 + 1, y + 1.5, label)
+            c.setFont('Helvetica', font)
+            c.drawString(x0 + seed_w, y + 1.5, display)
         else:
-            c.setFont('Helvetica', 5.5)
+            c.setFont('Helvetica', font)
             c.setFillColor(DARK)
-            c.drawRightString(x0 + width - 12, y + 1.5, display)
-            c.setFont('Helvetica-Bold', 5.5)
-            c.drawRightString(x0 + width - 1, y + 1.5, str(seed))
+            c.drawRightString(x0 + width - seed_w, y + 1.5, display)
+            c.setFont('Helvetica-Bold', font)
+            c.drawRightString(x0 + width - 1, y + 1.5, label)
 
     return wy
 
 
 def _draw_final_four(c, cx, cw, finals_y, round_w):
-    """Draw Final Four and Championship connectors in the center."""
+    """Draw Final Four and Championship connectors in the center.
+
+    The left half of finals_y are the region winners on the left side and
+    the rest those on the right.  Each side is paired down to one team, one
+    column per national round, before the championship in the middle.
+    """
     c.setStrokeColor(LINE_COLOR)
     c.setLineWidth(0.5)
 
-    semi_w = cw / 3
-
-    # Left semifinal (regions 0 & 1)
-    y0, y1 = finals_y[0], finals_y[1]
-    lj = cx + semi_w
-    c.line(cx, y0, lj, y0)
-    c.line(cx, y1, lj, y1)
-    c.line(lj, y0, lj, y1)
-    l_mid = (y0 + y1) / 2
-
-    # Right semifinal (regions 2 & 3)
-    y2, y3 = finals_y[2], finals_y[3]
-    rj = cx + cw - semi_w
-    c.line(cx + cw, y2, rj, y2)
-    c.line(cx + cw, y3, rj, y3)
-    c.line(rj, y2, rj, y3)
-    r_mid = (y2 + y3) / 2
+    half = len(finals_y) // 2
+    levels = half.bit_length() - 1
+    semi_w = cw / (2 * levels + 1)
+
+    def pair_down(ys, edge, step):
+        x = edge
+        for level in range(levels):
+            junction = edge + step * (level + 1) * semi_w
+            merged = []
+            for j in range(0, len(ys), 2):
+                y_a, y_b = ys[j], ys[j + 1]
+                c.line(x, y_a, junction, y_a)
+                c.line(x, y_b, junction, y_b)
+                c.line(junction, y_a, junction, y_b)
+                merged.append((y_a + y_b) / 2)
+            ys, x = merged, junction
+        return x, ys[0]
+
+    # Left semifinal (regions 0 & 1), right semifinal (regions 2 & 3)
+    lj, l_mid = pair_down(finals_y[:half], cx, 1)
+    rj, r_mid = pair_down(finals_y[half:], cx + cw, -1)
 
     # Championship
     champ_x = cx + cw / 2
@@ -383,18 +482,31 @@ def _draw_first_four(c, first_four, x0, y0, width, height):
     if not first_four:
         return
 
+    n = len(first_four)
+
     # Section label
     c.setFont('Helvetica-Bold', 7)
     c.setFillColor(NAVY)
-    c.drawString(x0, y0 + height - 2, 'FIRST FOUR')
+    c.drawString(x0, y0 + height - 2,
+                 'FIRST FOUR' if n == 4 else 'PLAY-IN GAMES')
+
+    # Very large fields have more games than fit in one row; list the count
+    if n > width // 60:
+        c.setFont('Helvetica', 6.5)
+        c.setFillColor(DARK)
+        c.drawString(x0, y0 + height - 16,
+                     f'{n} play-in games on seed lines '
+                     f'{min(g[2] for g in first_four)}-'
+                     f'{max(g[2] for g in first_four)}')
+        return
 
     # Separator line above
     c.setStrokeColor(HexColor('#cccccc'))
     c.setLineWidth(0.3)
     c.line(x0, y0 + height + 4, x0 + width, y0 + height + 4)
 
-    n = len(first_four)
     game_w = width / n
+    line_w = min(85, game_w - 34)
 
     c.setStrokeColor(LINE_COLOR)
     c.setLineWidth(0.5)
@@ -417,7 +529,7 @@ def _draw_first_four(c, first_four, x0, y0, width, height):
         c.drawString(nx, yb + 1.5, t2[:22])
 
         # Mini bracket lines
-        line_end = nx + 85
+        line_end = nx + line_w
         c.line(nx - 2, yt, line_end, yt)
         c.line(nx - 2, yb, line_end, yb)
         c.line(line_end, yt, line_end, yb)
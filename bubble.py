@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+"""
+How close every team is to the cut line and to the next seed lines.
+
+Given the final_rank ordering from get_tourney_teams, a team's rank only has
+to move past one other team's rank to change its outcome, so every margin is
+a difference between its rank and a boundary rank looked up in a sorted
+array:
+
+    at-large team:  cushion = rank of the first team out - its rank
+    team left out:  deficit = its rank - rank of the last at-large team in,
+                    or to its conference's auto bid holder if that is less
+    auto bid:       gap = rank of the conference's second team - its rank,
+                    unless it would still get an at-large bid after losing
+                    the auto bid
+    seed lines:     distance to the last team on the line above, or to the
+                    first team on the line below
+
+with everyone else held fixed. Auto bids set by conf_winners, and those of
+one-team conferences, can't change hands. Margins are in final_rank units (composite
+rank, or the standardized rating in metrics mode) and are the change needed
+to reach the boundary, so a tie is not enough to cross it. All teams are
+covered in one vectorized pass.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def bubble_margins(bracket):
+    """
+    Inputs:
+        bracket: Bracketeer after get_tourney_teams
+    Outputs:
+        DataFrame of every team in final_rank order with
+        bid: 'auto', 'at-large' or 'out'
+        seed: seed line, NaN outside the field
+        field_margin: for field teams the rank change that would drop
+            them out (positive), for teams left out minus the change that
+            would get them in. NaN for auto bids that can't change hands
+        teams_to_cut: non-auto-bid teams between the team and the cut line
+        seed_up_margin, seed_down_margin: change that would move a field
+            team up or down a seed line (NaN on the top line, the bottom
+            line, or if the field would change first)
+    """
+    summary = bracket.summary_df.reset_index(drop=True)
+    sign = -1. if bracket.use_metrics else 1.
+    # lower is better from here on
+    score = sign * summary['final_rank'].values.astype(float)
+    n = len(score)
+
+    is_auto = summary['Team'].isin(bracket.auto_bid_teams).values
+    n_at_large = len(bracket.at_large_teams)
+
+    # Field line: non-auto-bid teams in rank order
+    non_auto = score[~is_auto]
+    na_pos = np.cumsum(~is_auto) - 1
+    is_in = ~is_auto & (na_pos < n_at_large)
+    is_out = ~is_auto & ~is_in
+
+    field_margin = np.full(n, np.nan)
+    teams_to_cut = np.full(n, np.nan)
+    if n_at_large < len(non_auto):
+        first_out = non_auto[n_at_large]
+        field_margin[is_in] = first_out - score[is_in]
+        teams_to_cut[is_in] = n_at_large - na_pos[is_in]
+    if n_at_large > 0:
+        last_in = non_auto[n_at_large - 1]
+        field_margin[is_out] = -(score[is_out] - last_in)
+        teams_to_cut[is_out] = na_pos[is_out] - n_at_large + 1
+
+    # Auto bids: a conference's top team holds it until it falls behind the
+    # second team, which then takes it
+    conf = summary['Conf']
+    decided = [c for c, t in (bracket.conf_winners or {}).items()
+        if t is not None]
+    open_conf = (conf.notna() & ~conf.str.contains('Ind', na=False) &
+        ~conf.isin(decided)).values
+    conf_pos = summary.groupby('Conf', sort=False).cumcount().values
+
+    def by_conf(values, how):
+        return pd.Series(values).groupby(conf.values, sort=False)\
+            .transform(how).values
+
+    leader = by_conf(score, 'first')
+    second = by_conf(np.where(conf_pos == 1, score, np.nan), 'max')
+    # the second team's place among the non-auto teams
+    second_pos = by_conf(np.where(conf_pos == 1, na_pos, np.nan), 'max')
+    holds = is_auto & open_conf & (conf_pos == 0) & ~np.isnan(second)
+    gap = second - score
+
+    # a holder that loses its bid joins the non-auto teams in place of the
+    # second team, and stays in the field ahead of the n_at_large-th of the
+    # others
+    runner_in = holds & (second_pos < n_at_large)
+    bound_in = non_auto[n_at_large] if n_at_large < len(non_auto) \
+        else np.nan
+    bound_out = non_auto[n_at_large - 1] if n_at_large else -np.inf
+    stays_until = np.where(runner_in, bound_in, bound_out) - score
+    field_margin[holds] = np.fmax(gap, stays_until)[holds]
+    # nobody left to take its place
+    field_margin[runner_in & np.isnan(stays_until)] = np.nan
+
+    # a team left out can also take its conference's auto bid
+    takes_bid = is_out & open_conf
+    field_margin[takes_bid] = -np.fmin(-field_margin[takes_bid],
+        score[takes_bid] - leader[takes_bid])
+
+    # Seed lines: the field in rank order holds the seeds in order
+    in_field = is_auto | is_in
+    field_score = score[in_field]
+    seeds = np.asarray(bracket.seeds)
+    lines = np.unique(seeds)
+    line_start = np.searchsorted(seeds, lines, 'left')
+    line_idx = np.searchsorted(lines, seeds)
+
+    up = np.full(len(field_score), np.nan)
+    down = np.full(len(field_score), np.nan)
+    has_up = line_idx > 0
+    up[has_up] = field_score[has_up] - \
+        field_score[line_start[line_idx[has_up]] - 1]
+    has_down = line_idx < len(lines) - 1
+    down[has_down] = field_score[line_start[line_idx[has_down] + 1]] - \
+        field_score[has_down]
+
+    # a team falling out of the field never reaches the next line, nor does
+    # a holder that lets a team from outside it take the auto bid
+    cushion = np.where(holds & ~runner_in, gap, field_margin)[in_field]
+    down[down >= cushion] = np.nan
+
+    seed = np.full(n, np.nan)
+    seed[in_field] = seeds
+    seed_up = np.full(n, np.nan)
+    seed_up[in_field] = up
+    seed_down = np.full(n, np.nan)
+    seed_down[in_field] = down
+
+    result = pd.DataFrame({
+        'Team': summary['Team'].values,
+        'Conf': summary['Conf'].values,
+        'final_rank': summary['final_rank'].values,
+        'bid': np.where(is_auto, 'auto', np.where(is_in, 'at-large', 'out')),
+        'seed': seed,
+        'field_margin': field_margin,
+        'teams_to_cut': teams_to_cut,
+        'seed_up_margin': seed_up,
+        'seed_down_margin': seed_down,
+    })
+    return result
+
+
+def near_cut(margins, window=8):
+    """
+    The window at-large teams closest to the cut line on each side
+    """
+    teams = margins[margins['bid'] != 'auto']
+    return teams[teams['teams_to_cut'] <= window]
+
+
+def export(margins, path):
+    """
+    Saves margins as csv, or json records if path ends in .json
+    """
+    if path.lower().endswith('.json'):
+        margins.to_json(path, orient='records', indent=1)
+    else:
+        margins.to_csv(path, index=False)
+    return path
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+
+"""
+Bulk import of filled-in Excel brackets.
+
+Bracketeer.fill_bracket writes the field into the bracket_template.xlsx
+layout (metrics.EXCEL_PLACEMENTS): first-round teams in column C (left)
+and R (right), rows 7 to 69, and the play-in games at rows 71 and 73 (D
+and F on the left, Q and O on the right). Entrants then write the winner
+of every game in the template's round columns, each winner level with the
+middle of the two teams it beat:
+
+    round           left        right       rows
+    2nd Round       D           Q           8, 12, ... 68
+    3rd Round       E           P           10, 18, ... 66
+    4th Round       F           O           14, 30, 46, 62
+    5th Round       G           M           22, 54
+    Final           I29         K47
+    Champion        J39
+
+A play-in winner may also be written over the 'Play-in' cell of its slot
+(C9, C57, R9, R57); it is optional, but when given, later picks must agree
+with it. Otherwise the first pick from a play-in slot implies its winner
+and every later pick from that slot must name the same team.
+
+Workbooks are opened with openpyxl's read-only mode, which streams the
+sheet XML instead of building every cell, and only the rows and columns of
+the bracket are read. Picks are checked against the seeded field and every
+valid entry becomes one bit-packed code (bitbracket) of the template's own
+game order: left regions then right regions, the left semifinal between
+the two left regions. The codes score with a BracketCodec of
+template_slots, which `main.py pool --layout excel` uses.
+
+Files are parsed in a process pool and a file that can't be read or holds
+invalid picks is reported rather than stopping the batch:
+
+    entries, report = import_entries(['entries/'], bracket.final_68,
+        output='entries.npy')
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.utils import coordinate_to_tuple
+
+import bitbracket
+import progress
+from metrics import EXCEL_PLACEMENTS
+
+TEMPLATE = 'bracket_template.xlsx'
+
+FIRST_ROUND_ROWS = list(range(7, 70, 2))
+
+# winner columns of the 2nd to 5th rounds, left and right side
+ROUND_COLUMNS = [('D', 'Q'), ('E', 'P'), ('F', 'O'), ('G', 'M')]
+
+# the template's merged finalist and champion cells
+FINAL_CELLS = ('I29', 'K47')
+
+CHAMPION_CELL = 'J39'
+
+# slot cell of each play-in game -> cells of its two teams
+PLAY_IN_CELLS = {'C9': ('F71', 'F73'), 'C57': ('D71', 'D73'),
+    'R9': ('O71', 'O73'), 'R57': ('Q71', 'Q73')}
+
+# problems listed per invalid file
+MAX_PROBLEMS = 5
+
+
+def slot_cells():
+    """
+    First-round cells in code order: the left regions top to bottom, then
+    the right ones
+    """
+    return ['{}{}'.format(col, row) for col in 'CR'
+        for row in FIRST_ROUND_ROWS]
+
+
+def pick_cells():
+    """
+    Cell of every game's winner, in code order
+    """
+    cells = []
+    for r, columns in enumerate(ROUND_COLUMNS):
+        first, step = 6 + (2 << r), 4 << r
+        for col in columns:
+            cells.extend('{}{}'.format(col, row) for row in range(first,
+                FIRST_ROUND_ROWS[-1] + 1, step))
+    return cells + list(FINAL_CELLS) + [CHAMPION_CELL]
+
+
+def template_slots(final_68):
+    """
+    First-round slots of the template in code order, as written by
+    fill_bracket: team names or (team, team) play-in tuples
+    """
+    if len(final_68) != len(EXCEL_PLACEMENTS):
+        raise ValueError('The Excel template only fits the 68 team '
+            'bracket, not {} teams'.format(len(final_68)))
+    teams = dict(zip(EXCEL_PLACEMENTS, final_68['Team']))
+    slots = []
+    for cell in slot_cells():
+        if cell in PLAY_IN_CELLS:
+            slots.append(tuple(teams[c] for c in PLAY_IN_CELLS[cell]))
+        else:
+            slots.append(teams[cell])
+    return slots
+
+
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+class TemplateLayout(object):
+    """
+    Cells of the template for one field and the checks of a filled-in
+    workbook.
+
+    Inputs:
+        final_68: Field DataFrame in final_rank order, as fill_bracket
+            writes it
+    """
+    def __init__(self, final_68):
+        self.slots = template_slots(final_68)
+        self.codec = bitbracket.BracketCodec(self.slots)
+        self.field = dict(zip(EXCEL_PLACEMENTS, final_68['Team']))
+        self.picks = pick_cells()
+
+        # (row, column) of every cell read -> its name
+        names = list(self.field) + self.picks + list(PLAY_IN_CELLS)
+        self.cells = {coordinate_to_tuple(c): c for c in names}
+        rows = [r for r, _ in self.cells]
+        cols = [c for _, c in self.cells]
+        self.bounds = dict(min_row=min(rows), max_row=max(rows),
+            min_col=min(cols), max_col=max(cols))
+
+    def read_cells(self, path):
+        """
+        Values of the layout's cells in a workbook, streamed in read-only
+        mode
+        """
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            ws = wb.active
+            values = {}
+            start_row, start_col = self.bounds['min_row'], \
+                self.bounds['min_col']
+            for i, row in enumerate(ws.iter_rows(values_only=True,
+                    **self.bounds)):
+                for j, value in enumerate(row):
+                    name = self.cells.get((start_row + i, start_col + j))
+                    if name is not None and value is not None:
+                        values[name] = value
+        finally:
+            wb.close()
+        return values
+
+    def check(self, values):
+        """
+        Winning slot of every game from a workbook's cell values.
+
+        Outputs:
+            Tuple of the winners array (None if there were problems) and
+            the list of problems found
+        """
+        codec = self.codec
+        problems = []
+        for cell, team in self.field.items():
+            found = _text(values.get(cell))
+            if found is not None and found != team:
+                problems.append('{} holds {}, not {}'.format(cell, found,
+                    team))
+
+        # a play-in winner written over its slot
+        play_in = {}
+        for cell, pair in PLAY_IN_CELLS.items():
+            found = _text(values.get(cell))
+            if found is None or found == 'Play-in':
+                continue
+            teams = [self.field[c] for c in pair]
+            if found not in teams:
+                problems.append('{} holds {}, not {} or {}'.format(cell,
+                    found, *teams))
+            else:
+                play_in[codec.slot_of[found]] = found
+
+        winners = np.full(codec.n_games, -1, dtype=np.int64)
+        for g, cell in enumerate(self.picks):
+            pick = _text(values.get(cell))
+            if pick is None:
+                problems.append('no pick in {}'.format(cell))
+                continue
+            slot = codec.slot_of.get(pick)
+            if slot is None:
+                problems.append('{}: {} is not in the field'.format(cell,
+                    pick))
+                continue
+            if play_in.get(slot, pick) != pick:
+                problems.append('{}: {} lost its play-in game'.format(cell,
+                    pick))
+                continue
+            r = codec.game_round(g)
+            k = g - codec.offsets[r]
+            if r == 0:
+                played = slot >> 1 == k
+            else:
+                child = codec.offsets[r - 1] + 2 * k
+                children = winners[child:child + 2]
+                # a game below with a bad pick is reported already
+                played = slot in children or (children < 0).any()
+            if not played:
+                problems.append('{}: {} did not reach this game'.format(
+                    cell, pick))
+                continue
+            if isinstance(self.slots[slot], tuple):
+                # the first pick from a play-in slot implies its winner
+                play_in[slot] = pick
+            winners[g] = slot
+        return (winners if not problems else None), problems
+
+    def read(self, path):
+        """
+        Code of one filled-in workbook. Raises ValueError listing the
+        problems of an invalid one
+        """
+        winners, problems = self.check(self.read_cells(path))
+        if problems:
+            more = len(problems) - MAX_PROBLEMS
+            raise ValueError('; '.join(problems[:MAX_PROBLEMS]) + (
+                ' (and {} more)'.format(more) if more > 0 else ''))
+        return int(self.codec.encode_slots(winners[None, :])[0])
+
+    def write(self, path, code, template=TEMPLATE):
+        """
+        Writes the bracket of a code into a copy of the template, the
+        inverse of read
+        """
+        wb = load_workbook(template)
+        ws = wb.active
+        for cell, team in self.field.items():
+            ws[cell] = team
+        for cell, s in zip(self.picks, self.codec.decode_slots(code)[0]):
+            # a play-in slot's picks name its first team
+            slot = self.slots[s]
+            ws[cell] = slot[0] if isinstance(slot, tuple) else slot
+        wb.save(path)
+        return path
+
+
+# ---- worker side ----
+
+_worker = {}
+
+
+def _init_worker(final_68):
+    _worker['layout'] = TemplateLayout(final_68)
+
+
+def read_entry(path):
+    """
+    Reads one workbook in a worker process.
+
+    Outputs:
+        Dictionary with the path, status and the code, or the error.
+        Failures are returned rather than raised, so one bad file doesn't
+        stop the batch
+    """
+    try:
+        return {'path': path, 'status': 'ok',
+            'code': _worker['layout'].read(path)}
+    except Exception as e:
+        return {'path': path, 'status': 'error',
+            'error': '{}: {}'.format(type(e).__name__, e)}
+
+
+# ---- parent side ----
+
+def workbook_paths(paths):
+    """
+    Expands directories to the .xlsx files in them, sorted
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(glob.glob(os.path.join(path, '*.xlsx'))))
+        else:
+            found.append(path)
+    return found
+
+
+def import_entries(paths, final_68, output=None, max_workers=None,
+        chunksize=16):
+    """
+    Reads every filled-in workbook.
+
+    Inputs:
+        paths: Workbooks and directories of workbooks
+        final_68: Field DataFrame the brackets were filled from
+        output: Optional .npy path for the codes of the valid entries
+        max_workers: Worker processes (default: all cores)
+        chunksize: Files handed to a worker at a time
+    Outputs:
+        Tuple of the uint64 codes of the valid entries (memory mapped when
+        written to output) and a DataFrame report with path, entry (its
+        index in the codes, -1 if invalid) and error per file
+    """
+    paths = workbook_paths(paths)
+    final_68 = final_68[['Team']].reset_index(drop=True)
+    TemplateLayout(final_68)
+
+    codes, report = [], []
+    with progress.stage('Importing brackets', total=len(paths)) as task, \
+            ProcessPoolExecutor(max_workers=max_workers,
+                initializer=_init_worker, initargs=(final_68,)) as pool:
+        for result in pool.map(read_entry, paths, chunksize=chunksize):
+            if result['status'] == 'ok':
+                report.append((result['path'], len(codes), None))
+                codes.append(result['code'])
+            else:
+                report.append((result['path'], -1, result['error']))
+            task.advance()
+
+    codes = np.array(codes, dtype=np.uint64)
+    if output is not None:
+        np.save(output, codes)
+        codes = bitbracket.load_entries(output)
+    return codes, pd.DataFrame(report, columns=['path', 'entry', 'error'])
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+"""
+Machine-readable export of a selection: the field, the bid lists, per-poll
+ranks and any computed probabilities, as tables.
+
+    field        final_68 plus bid (auto / at-large) and play_in
+    lists        team, list (auto_bid, at_large, first_four_out,
+                 next_four_out) and its order within the list
+    poll_ranks   Team and one column of ranks per poll, for every team
+    <name>       any extra DataFrame passed in, e.g. live advancement
+                 probabilities or game_sim summaries
+
+Tables are written as Arrow IPC files (memory-mapped by readers, so other
+processes load them without copying) or Parquet, one file per table, or
+as one compact column-oriented JSON document for web clients. Arrow and
+Parquet need pyarrow, which is only imported when used.
+
+Many variants (batch jobs, sweeps) go through StreamWriter, which appends
+each variant's tables to the open files as it is produced, tagged with a
+variant column, instead of collecting every variant in memory first:
+
+    with StreamWriter('out', fmt='parquet') as writer:
+        for variant, bracket in variants:
+            writer.write(bracket_tables(bracket, polls=False), variant)
+"""
+
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from bracket_pdf import bracket_slots
+from poll_analysis import poll_ranks
+
+FORMATS = ['arrow', 'parquet', 'json']
+
+_EXTENSIONS = {'arrow': '.arrow', 'parquet': '.parquet', 'json': '.json'}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Arrow and Parquet export need pyarrow (pip '
+            'install pyarrow); JSON export works without it') from None
+    return pyarrow
+
+
+def bracket_tables(bracket, probabilities=None, polls=True):
+    """
+    Inputs:
+        bracket: Bracketeer after get_tourney_teams
+        probabilities: Optional dictionary of table name -> DataFrame to
+            export alongside
+        polls: Whether to include the poll_ranks table (the same for every
+            selection from one snapshot)
+    Outputs:
+        Dictionary of table name -> DataFrame
+    """
+    field = bracket.final_68.reset_index(drop=True)
+    auto = set(bracket.auto_bid_teams)
+    play_in = {t for slot in bracket_slots(field, bracket.bracket_format)
+        if isinstance(slot, tuple) for t in slot}
+    field = field.assign(
+        bid=np.where(field['Team'].isin(auto), 'auto', 'at-large'),
+        play_in=field['Team'].isin(play_in).values)
+
+    # the first four out, then the next four out: the best teams without a
+    # bid, after the at-large teams
+    summary = bracket.summary_df
+    others = summary['Team'].values[~summary['Team'].isin(auto).values]
+    n_at_large = len(bracket.at_large_teams)
+    bubble = list(others[n_at_large:n_at_large +
+        bracket.bracket_format.bubble_size])
+    half = len(bubble) // 2
+    named = [('auto_bid', list(bracket.auto_bid_teams)),
+        ('at_large', list(bracket.at_large_teams)),
+        ('first_four_out', bubble[:half]),
+        ('next_four_out', bubble[half:])]
+    listed = [t for _, teams in named for t in teams]
+    if len(set(listed)) != len(listed):
+        twice = sorted({t for t in listed if listed.count(t) > 1})
+        raise ValueError('Teams in more than one list: {}'.format(
+            ', '.join(twice)))
+    lists = pd.DataFrame({
+        'team': [t for _, teams in named for t in teams],
+        'list': [name for name, teams in named for _ in teams],
+        'order': [i for _, teams in named for i in range(1, len(teams) + 1)],
+    })
+
+    tables = {'field': field, 'lists': lists}
+    if polls:
+        ranks = poll_ranks(bracket.team_data_df)
+        tables['poll_ranks'] = ranks.rename_axis('Team').reset_index()
+    for name, df in (probabilities or {}).items():
+        if name in tables:
+            raise ValueError("'{}' is already an exported table".format(name))
+        tables[name] = df.reset_index(drop=True)
+    return tables
+
+
+def _json_value(x):
+    if isinstance(x, (np.integer, np.bool_)):
+        return x.item()
+    if isinstance(x, (float, np.floating)):
+        return None if math.isnan(x) else float(x)
+    return x
+
+
+def _json_columns(df, digits):
+    """
+    Column name -> list of values, floats rounded and NaN as null
+    """
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_float_dtype(values):
+            values = values.round(digits)
+        columns[str(col)] = [_json_value(x) for x in values.tolist()]
+    return columns
+
+
+def to_json(tables, path=None, digits=4):
+    """
+    Compact column-oriented JSON of the tables:
+    {"field": {"Team": [...], "seed": [...], ...}, ...}. Written to path if
+    given, returned otherwise
+    """
+    record = {name: _json_columns(df, digits) for name, df in tables.items()}
+    text = json.dumps(record, separators=(',', ':'), allow_nan=False)
+    if path is None:
+        return text
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def write_tables(tables, directory, fmt='arrow'):
+    """
+    Writes every table to <directory>/<name>.arrow or .parquet, or all of
+    them to <directory>/tables.json.
+
+    Outputs:
+        List of paths written
+    """
+    if fmt not in FORMATS:
+        raise ValueError("Unknown format '{}'; use one of {}".format(fmt,
+            ', '.join(FORMATS)))
+    os.makedirs(directory, exist_ok=True)
+    if fmt == 'json':
+        return [to_json(tables, os.path.join(directory, 'tables.json'))]
+
+    with StreamWriter(directory, fmt=fmt) as writer:
+        writer.write(tables)
+    return writer.paths
+
+
+def read_table(path):
+    """
+    Reads an exported table as a pyarrow Table. Arrow files are memory
+    mapped, so the columns are not copied into this process; call
+    to_pandas() on the result for a DataFrame.
+    """
+    pa = _pyarrow()
+    if path.endswith('.parquet'):
+        return pa.parquet.read_table(path, memory_map=True)
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+class StreamWriter(object):
+    """
+    Appends tables to one file per table name as they are produced.
+
+    Inputs:
+        directory: Output directory
+        fmt: 'arrow', 'parquet' or 'json'. JSON is written as JSON lines,
+            one compact record of all of a variant's tables per line
+        digits: Decimals kept in JSON
+    """
+    def __init__(self, directory, fmt='arrow', digits=4):
+        if fmt not in FORMATS:
+            raise ValueError("Unknown format '{}'; use one of {}".format(
+                fmt, ', '.join(FORMATS)))
+        self.directory = directory
+        self.fmt = fmt
+        self.digits = digits
+        self.paths = []
+        self._writers = {}
+        self._schemas = {}
+        self._json = None
+        if fmt != 'json':
+            self._pa = _pyarrow()
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self, name, table):
+        pa = self._pa
+        path = os.path.join(self.directory, name + _EXTENSIONS[self.fmt])
+        if self.fmt == 'parquet':
+            writer = pa.parquet.ParquetWriter(path, table.schema,
+                compression='zstd')
+        else:
+            writer = pa.ipc.new_file(path, table.schema)
+        self.paths.append(path)
+        self._writers[name] = writer
+        self._schemas[name] = table.schema
+        return writer
+
+    def write(self, tables, variant=None):
+        """
+        Appends a dictionary of table name -> DataFrame. With a variant id,
+        every row is tagged with it in a leading variant column.
+        """
+        if self.fmt == 'json':
+            if self._json is None:
+                path = os.path.join(self.directory, 'tables.jsonl')
+                self._json = open(path, 'w')
+                self.paths.append(path)
+            record = {name: _json_columns(df, self.digits)
+                for name, df in tables.items()}
+            if variant is not None:
+                record = dict(variant=variant, **record)
+            self._json.write(json.dumps(record, separators=(',', ':'),
+                allow_nan=False) + '\n')
+            self._json.flush()
+            return
+
+        pa = self._pa
+        for name, df in tables.items():
+            if variant is not None:
+                df = df.assign(variant=str(variant))
+                df = df[['variant'] + [c for c in df.columns
+                    if c != 'variant']]
+            schema = self._schemas.get(name)
+            # later variants are cast to the first one's schema, so a
+            # column that is all null in one variant keeps its type
+            table = pa.Table.from_pandas(df, schema=schema,
+                preserve_index=False)
+            writer = self._writers.get(name) or self._open(name, table)
+            writer.write_table(table)
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+        if self._json is not None:
+            self._json.close()
+            self._json = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+
+"""
+Possession-level game simulator from KenPom adjusted efficiencies and tempo.
+
+Each simulated game draws
+    * its number of possessions, around the expected tempo of the two teams
+      (AdjT_a * AdjT_b / average tempo)
+    * each team's efficiency for the night, around its expected points per
+      possession against this opponent (AdjO_a * AdjD_b / average
+      efficiency), so a team can have an off night
+    * each team's score as the sum of its possessions. Every possession
+      scores 0 to 3 points, with a fixed split of made shots between free
+      throws, twos and threes and the scoring chance set by the night's
+      efficiency; the sum over the possessions is drawn from the normal
+      with the same mean and variance
+    * overtime periods while the score is tied
+
+Every game of every pair of teams in the field is simulated at once in
+numpy, a chunk of games at a time, and only the margin and total
+histograms of each pair are kept, so the full distributions of all 2,278
+pairs of a 68-team field take seconds and a few megabytes.
+
+Teams without KenPom numbers get Division I average tempo and efficiencies
+shifted by their composite strength (win_model scale), so a field always
+simulates. Results are cached per ratings snapshot: the cache key is a
+hash of the teams, their numbers and the settings.
+
+    sim = simulate_field(bracket, n_sims=10000)
+    sim.win_prob(['Duke'], ['Virginia'])
+    sim.margin_distribution('Duke', 'Virginia')
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import progress
+from ratings import RATINGS_SOURCES
+from win_model import RATING_SD, team_strength
+
+# bump to invalidate cached simulations after changing the model
+CACHE_VERSION = 1
+
+# game-to-game spread of possessions around the expected tempo
+TEMPO_SD = 4.
+# spread of a team's efficiency for one game, relative to its expected
+EFF_SD = 0.06
+# share of scoring possessions ending with 1, 2 and 3 points
+POINTS_SPLIT = np.array([0.09, 0.63, 0.28])
+# overtime periods are 5 of a game's 40 minutes
+OT_SHARE = 5. / 40.
+MAX_OT = 8
+
+# histogram ranges of margins and totals; outliers land in the end bins
+MARGIN_RANGE = (-90, 90)
+TOTAL_RANGE = (60, 260)
+
+# game x simulation values held at a time
+CHUNK_ELEMENTS = 1 << 21
+
+_POINTS = np.arange(1, 4)
+_MEAN_POINTS = POINTS_SPLIT @ _POINTS
+_MEAN_SQUARE = POINTS_SPLIT @ _POINTS ** 2
+
+
+def possession_var(ppp):
+    """
+    Variance of one possession's points at ppp expected points per
+    possession
+    """
+    return ppp / _MEAN_POINTS * _MEAN_SQUARE - ppp ** 2
+
+
+def team_inputs(bracket, download=False):
+    """
+    KenPom adjusted offense, defense and tempo of the field.
+
+    Inputs:
+        bracket: Bracketeer after get_tourney_teams
+        download: Whether the KenPom csv may be downloaded if missing
+    Outputs:
+        DataFrame indexed by team with AdjO, AdjD, AdjT and source ('kenpom'
+        or 'composite' where KenPom numbers were filled in)
+    """
+    field = bracket.final_68
+    teams = field['Team'].values
+    df = pd.DataFrame({'AdjO': np.nan, 'AdjD': np.nan, 'AdjT': np.nan},
+        index=pd.Index(teams, name='Team'))
+
+    kenpom = RATINGS_SOURCES.get('kenpom')
+    ratings = kenpom.load(download=download) if kenpom is not None else None
+    if ratings is not None and {'AdjO', 'AdjD', 'AdjT'} <= set(
+            ratings.columns):
+        rows = ratings.reindex(teams)
+        for col in ['AdjO', 'AdjD', 'AdjT']:
+            df[col] = pd.to_numeric(rows[col], errors='coerce').values
+        avg_eff = pd.to_numeric(ratings['AdjO'], errors='coerce').mean()
+        avg_tempo = pd.to_numeric(ratings['AdjT'], errors='coerce').mean()
+    else:
+        # Division I averages of recent seasons
+        avg_eff, avg_tempo = 103., 68.
+
+    missing = df[['AdjO', 'AdjD', 'AdjT']].isna().any(axis=1).values
+    df['source'] = np.where(missing, 'composite', 'kenpom')
+    if missing.any():
+        strength = team_strength(field['final_rank'].values,
+            use_metrics=bracket.use_metrics,
+            n_teams=len(bracket.team_data_df))
+        # half of the rating in points per 100 possessions on each end
+        half = strength[missing] * RATING_SD / 2.
+        df.loc[missing, 'AdjO'] = avg_eff + half
+        df.loc[missing, 'AdjD'] = avg_eff - half
+        df.loc[missing, 'AdjT'] = avg_tempo
+    df.attrs['avg_eff'] = float(avg_eff)
+    df.attrs['avg_tempo'] = float(avg_tempo)
+    return df
+
+
+class SimResults(object):
+    """
+    Margin and total histograms of every pair of teams.
+
+    Inputs:
+        teams: Array of team names
+        margin_counts: (pairs, bins) int array of margins of team i over
+            team j for the pairs i < j in pair_index order
+        total_counts: (pairs, bins) int array of totals
+        n_sims: Simulations per pair
+    """
+    def __init__(self, teams, margin_counts, total_counts, n_sims):
+        self.teams = np.asarray(teams, dtype=object)
+        self.index = {t: i for i, t in enumerate(self.teams)}
+        self.margin_counts = margin_counts
+        self.total_counts = total_counts
+        self.n_sims = n_sims
+        self.margins = np.arange(MARGIN_RANGE[0], MARGIN_RANGE[1] + 1)
+        self.totals = np.arange(TOTAL_RANGE[0], TOTAL_RANGE[1] + 1)
+
+    def _pairs(self, team_a, team_b):
+        """
+        Pair rows and whether each query is reversed (team_a after team_b)
+        """
+        try:
+            a = np.array([self.index[t] for t in np.atleast_1d(team_a)])
+            b = np.array([self.index[t] for t in np.atleast_1d(team_b)])
+        except KeyError as e:
+            raise KeyError('{} is not in the simulated field'.format(e))
+        if (a == b).any():
+            raise ValueError('A team cannot play itself')
+        return pair_index(np.minimum(a, b), np.maximum(a, b),
+            len(self.teams)), a > b
+
+    def win_prob(self, team_a, team_b):
+        """
+        Array of probabilities that team_a[i] beats team_b[i]
+        """
+        rows, flip = self._pairs(team_a, team_b)
+        counts = self.margin_counts[rows]
+        wins = counts[:, self.margins > 0].sum(axis=1)
+        losses = counts[:, self.margins < 0].sum(axis=1)
+        return np.where(flip, losses, wins) / self.n_sims
+
+    def margin_distribution(self, team_a, team_b):
+        """
+        Series of margin (team_a minus team_b) -> probability
+        """
+        rows, flip = self._pairs(team_a, team_b)
+        probs = self.margin_counts[rows[0]] / self.n_sims
+        if flip[0]:
+            return pd.Series(probs[::-1], index=-self.margins[::-1])
+        return pd.Series(probs, index=self.margins)
+
+    def total_distribution(self, team_a, team_b):
+        """
+        Series of total points -> probability
+        """
+        rows, _ = self._pairs(team_a, team_b)
+        return pd.Series(self.total_counts[rows[0]] / self.n_sims,
+            index=self.totals)
+
+    def win_prob_matrix(self):
+        """
+        Matrix P where P[i, j] is the probability teams[i] beats teams[j]
+        """
+        n = len(self.teams)
+        i, j = np.triu_indices(n, 1)
+        wins = self.margin_counts[:, self.margins > 0].sum(axis=1)
+        matrix = np.full((n, n), 0.5)
+        matrix[i, j] = wins / self.n_sims
+        matrix[j, i] = 1. - matrix[i, j]
+        return matrix
+
+    def summary(self):
+        """
+        DataFrame of every pair: team_a, team_b, win_prob (team_a wins),
+        margin_mean, margin_sd, margin_p05, margin_p95 (team_a minus
+        team_b), total_mean and total_sd
+        """
+        i, j = np.triu_indices(len(self.teams), 1)
+        margin = _moments(self.margin_counts, self.margins)
+        total = _moments(self.total_counts, self.totals)
+        return pd.DataFrame({
+            'team_a': self.teams[i],
+            'team_b': self.teams[j],
+            'win_prob': self.margin_counts[:, self.margins > 0].sum(axis=1)
+                / self.n_sims,
+            'margin_mean': margin[0],
+            'margin_sd': margin[1],
+            'margin_p05': _quantile(self.margin_counts, self.margins, 0.05),
+            'margin_p95': _quantile(self.margin_counts, self.margins, 0.95),
+            'total_mean': total[0],
+            'total_sd': total[1],
+        })
+
+    def save(self, path):
+        np.savez_compressed(path, teams=self.teams.astype(str),
+            margin_counts=self.margin_counts, total_counts=self.total_counts,
+            n_sims=self.n_sims)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['teams'].astype(object), data['margin_counts'],
+            data['total_counts'], int(data['n_sims']))
+
+
+def pair_index(i, j, n):
+    """
+    Row of the pair (i, j), i < j, in np.triu_indices(n, 1) order
+    """
+    return i * (2 * n - i - 1) // 2 + (j - i - 1)
+
+
+def _moments(counts, values):
+    p = counts / counts.sum(axis=1, keepdims=True)
+    mean = p @ values
+    return mean, np.sqrt(np.maximum(p @ values ** 2 - mean ** 2, 0.))
+
+
+def _quantile(counts, values, q):
+    cdf = np.cumsum(counts, axis=1)
+    return values[(cdf < q * cdf[:, -1:]).sum(axis=1)]
+
+
+def _histogram(values, lo, hi):
+    """
+    Per-row counts of the integer values in lo..hi, clipped into the end
+    bins, in one bincount
+    """
+    n_bins = hi - lo + 1
+    bins = np.clip(values.astype(np.int64) - lo, 0, n_bins - 1)
+    bins += np.arange(len(values))[:, None] * n_bins
+    return np.bincount(bins.ravel(), minlength=len(values) * n_bins) \
+        .reshape(len(values), n_bins)
+
+
+def _scores(rng, ppp, poss):
+    """
+    Points from poss possessions at ppp expected points each, as the normal
+    with the possessions' summed mean and variance
+    """
+    draw = rng.standard_normal(ppp.shape, dtype=np.float32)
+    draw *= np.sqrt(poss * possession_var(ppp))
+    draw += poss * ppp
+    return np.maximum(np.rint(draw, out=draw), 0., out=draw)
+
+
+def simulate_games(adj_o, adj_d, adj_t, a, b, n_sims, avg_eff, avg_tempo,
+        rng):
+    """
+    Simulates n_sims games of every pair (a[k], b[k]).
+
+    Inputs:
+        adj_o, adj_d, adj_t: Arrays of KenPom adjusted offense, defense and
+            tempo per team
+        a, b: Arrays of team indices of the games
+        n_sims: Simulations per game
+        avg_eff, avg_tempo: Division I averages the adjustments are
+            relative to
+        rng: numpy Generator
+    Outputs:
+        (points of a, points of b), each a (games, n_sims) float32 array
+    """
+    # single precision: the draws end up as integer points anyway
+    shape = (len(a), n_sims)
+    tempo = (adj_t[a] * adj_t[b] / avg_tempo).astype(np.float32)[:, None]
+    poss = rng.standard_normal(shape, dtype=np.float32)
+    poss *= TEMPO_SD
+    poss += tempo
+    np.maximum(poss, 40., out=poss)
+
+    def night(off, dfn):
+        expected = (adj_o[off] * adj_d[dfn] / avg_eff / 100.).astype(
+            np.float32)[:, None]
+        ppp = rng.standard_normal(shape, dtype=np.float32)
+        ppp *= EFF_SD
+        ppp += 1.
+        ppp *= expected
+        # a possession can't average more than 3 points
+        return np.clip(ppp, 0.05, 0.99 * _MEAN_POINTS, out=ppp)
+
+    ppp_a, ppp_b = night(a, b), night(b, a)
+    points_a = _scores(rng, ppp_a, poss)
+    points_b = _scores(rng, ppp_b, poss)
+
+    for _ in range(MAX_OT):
+        tied = np.nonzero(points_a == points_b)
+        if not len(tied[0]):
+            break
+        ot_poss = poss[tied] * OT_SHARE
+        points_a[tied] += _scores(rng, ppp_a[tied], ot_poss)
+        points_b[tied] += _scores(rng, ppp_b[tied], ot_poss)
+    # still level after MAX_OT periods: settle it by a point
+    tied = points_a == points_b
+    points_a += tied & (rng.random(shape) < 0.5)
+    points_b += tied & (points_a == points_b)
+    return points_a, points_b
+
+
+def simulate_all(teams_df, n_sims=10000, seed=0):
+    """
+    Simulates every pair of teams.
+
+    Inputs:
+        teams_df: DataFrame from team_inputs (AdjO, AdjD, AdjT per team, and
+            avg_eff / avg_tempo in attrs)
+        n_sims: Simulations per pair
+        seed: Random seed
+    Outputs:
+        SimResults
+    """
+    adj_o, adj_d, adj_t = (teams_df[c].to_numpy(dtype=float)
+        for c in ['AdjO', 'AdjD', 'AdjT'])
+    avg_eff = teams_df.attrs.get('avg_eff', np.mean(adj_o))
+    avg_tempo = teams_df.attrs.get('avg_tempo', np.mean(adj_t))
+    i, j = np.triu_indices(len(teams_df), 1)
+    rng = np.random.default_rng(seed)
+
+    n_margin = MARGIN_RANGE[1] - MARGIN_RANGE[0] + 1
+    n_total = TOTAL_RANGE[1] - TOTAL_RANGE[0] + 1
+    margin_counts = np.zeros((len(i), n_margin), dtype=np.int32)
+    total_counts = np.zeros((len(i), n_total), dtype=np.int32)
+
+    step = max(1, CHUNK_ELEMENTS // n_sims)
+    with progress.stage('Simulating games', total=len(i)) as task:
+        for start in range(0, len(i), step):
+            rows = slice(start, start + step)
+            points_a, points_b = simulate_games(adj_o, adj_d, adj_t,
+                i[rows], j[rows], n_sims, avg_eff, avg_tempo, rng)
+            margin_counts[rows] = _histogram(points_a - points_b,
+                *MARGIN_RANGE)
+            total_counts[rows] = _histogram(points_a + points_b,
+                *TOTAL_RANGE)
+            task.advance(len(i[rows]))
+
+    return SimResults(teams_df.index.values, margin_counts, total_counts,
+        n_sims)
+
+
+def cache_key(teams_df, n_sims, seed):
+    """
+    sha256 of everything a simulation depends on
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps([CACHE_VERSION, n_sims, seed, TEMPO_SD, EFF_SD,
+        POINTS_SPLIT.tolist(), MAX_OT, MARGIN_RANGE, TOTAL_RANGE,
+        teams_df.attrs.get('avg_eff'), teams_df.attrs.get('avg_tempo'),
+        [str(t) for t in teams_df.index]]).encode())
+    h.update(teams_df[['AdjO', 'AdjD', 'AdjT']].to_numpy(
+        dtype=float).tobytes())
+    return h.hexdigest()
+
+
+def simulate_field(bracket, n_sims=10000, seed=0, cache_dir='.cache',
+        download=False, _memo={}):
+    """
+    Simulated distributions of every matchup in the field, from the cache
+    when the same teams, ratings and settings were simulated before.
+
+    Inputs:
+        bracket: Bracketeer after get_tourney_teams
+        n_sims: Simulations per pair
+        seed: Random seed
+        cache_dir: Directory for cached results. None disables the cache
+        download: Whether the KenPom csv may be downloaded if missing
+    Outputs:
+        SimResults, with the team inputs as its inputs attribute
+    """
+    teams_df = team_inputs(bracket, download=download)
+    key = cache_key(teams_df, n_sims, seed)
+    if key in _memo:
+        return _memo[key]
+
+    path = None
+    sim = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, 'game_sim-{}.npz'.format(key))
+        if os.path.isfile(path):
+            sim = SimResults.load(path)
+    if sim is None:
+        sim = simulate_all(teams_df, n_sims=n_sims, seed=seed)
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = '{}.{}.tmp.npz'.format(path[:-4], os.getpid())
+            sim.save(tmp)
+            os.replace(tmp, path)
+
+    sim.inputs = teams_df
+    # one snapshot at a time is the common case
+    if len(_memo) >= 4:
+        _memo.clear()
+    _memo[key] = sim
+    return sim
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+
+"""
+Streaming ingestion of archived Massey compare.csv snapshots.
+
+A season of daily snapshots over many seasons is thousands of files and
+millions of team-poll rows, too much to hold the way parse_csv does. Here
+everything is a generator pipeline that only ever holds one chunk of rows:
+
+    iter_sources     files in directories, members of tar/zip archives
+        |            (read as streams), plain files
+    iter_chunks      splits each source into snapshots with parse_csv's
+        |            header rules and yields fixed-size chunks of rows.
+        |            A source may hold many snapshots back to back
+    RankStats.update per-team rolling statistics of the consensus rank
+                     (mean of every poll rank in the row)
+
+RankStats keeps a fixed set of running sums per team (Welford mean and
+variance, day-to-day change volatility, least squares trend, exponentially
+weighted rank), so memory is bounded by the number of teams, not snapshots.
+Its state, including how many snapshots of each source were ingested, is
+saved to a file so a later run only ingests new files and snapshots
+appended to existing ones.
+"""
+
+import csv
+import datetime
+import os
+import pickle
+import re
+import tarfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+# ingest takes a progress callback, hence the alias
+from progress import stage as progress_stage
+from metrics import is_blank_row, is_column_row
+from poll_analysis import NON_POLL_COLUMNS
+
+CHUNK_SIZE = 5000
+
+# half life, in days, of the exponentially weighted rank
+HALF_LIFE = 14.
+
+_DATE = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})')
+
+
+def snapshot_day(name):
+    """
+    Day number (proleptic ordinal) of a YYYYMMDD or YYYY-MM-DD date in a
+    file name, or None
+    """
+    match = _DATE.search(os.path.basename(name))
+    if match is None:
+        return None
+    try:
+        return datetime.date(*map(int, match.groups())).toordinal()
+    except ValueError:
+        return None
+
+
+def _is_csv(name):
+    return name.lower().endswith(('.csv', '.txt'))
+
+
+def _lines(stream):
+    """
+    Decoded lines of a binary archive member, without the byte order mark
+    of any line
+    """
+    for line in stream:
+        yield line.decode('utf-8-sig')
+
+
+def iter_sources(paths, skip=None):
+    """
+    Yields (source name, signature, iterable of text lines) for every csv under
+    paths, in name order. Directories are walked and the members of
+    .tar/.tar.gz/.tgz and .zip archives are read one at a time.
+
+    skip: Optional callable (name, signature) -> bool for sources that can
+        be skipped unopened
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            files = []
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, n) for n in names)
+            for sub in _iter_files(sorted(files), skip):
+                yield sub
+        else:
+            for sub in _iter_files([path], skip):
+                yield sub
+
+
+def _iter_files(files, skip):
+    for path in files:
+        st = os.stat(path)
+        signature = (st.st_size, st.st_mtime_ns)
+        lower = path.lower()
+        if lower.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')):
+            # archives are signed per member, so a grown archive only
+            # re-reads what is new. Members are read in name order like
+            # every other source, not in the order they were stored, so
+            # the statistics see the snapshots in date order
+            with tarfile.open(path, mode='r:*') as tar:
+                members = sorted(tar.getmembers(), key=lambda m: m.name)
+                for member in members:
+                    name = '{}:{}'.format(path, member.name)
+                    sig = (member.size, member.mtime)
+                    if not member.isfile() or not _is_csv(member.name) or \
+                            (skip and skip(name, sig)):
+                        continue
+                    with tar.extractfile(member) as f:
+                        yield name, sig, _lines(f)
+        elif lower.endswith('.zip'):
+            with zipfile.ZipFile(path) as zf:
+                for info in sorted(zf.infolist(), key=lambda i: i.filename):
+                    name = '{}:{}'.format(path, info.filename)
+                    sig = (info.file_size, info.CRC)
+                    if info.is_dir() or not _is_csv(info.filename) or \
+                            (skip and skip(name, sig)):
+                        continue
+                    with zf.open(info) as f:
+                        yield name, sig, _lines(f)
+        elif _is_csv(path):
+            if skip and skip(path, signature):
+                continue
+            with open(path, encoding='utf-8-sig', newline='') as f:
+                yield path, signature, f
+
+
+def iter_chunks(name, stream, chunk_size=CHUNK_SIZE):
+    """
+    Splits a source into snapshots and yields (snapshot number within the
+    source, column names, list of at most chunk_size rows).
+
+    Each snapshot is a header section, the column row starting with 'Team'
+    and an optional blank row, then data, exactly as parse_csv reads a
+    single file. A data row with a different number of fields than the
+    column row ends the snapshot and starts the next one's header, so
+    snapshots can be concatenated into one file.
+    """
+    snapshot = -1
+    columns = None
+    rows = []
+    expect_blank = False
+    for row in csv.reader(stream):
+        # concatenated snapshots may each start with a byte order mark,
+        # which utf-8-sig only strips from the start of the file
+        if row and row[0].startswith('\ufeff'):
+            row[0] = row[0].lstrip('\ufeff')
+        if is_column_row(row):
+            if rows:
+                yield snapshot, columns, rows
+                rows = []
+            snapshot += 1
+            columns = [c.lstrip() for c in row]
+            expect_blank = True
+            continue
+        if columns is None:
+            continue
+        if expect_blank:
+            expect_blank = False
+            if is_blank_row(row):
+                continue
+        if len(row) != len(columns):
+            # header section of the next snapshot
+            if rows:
+                yield snapshot, columns, rows
+                rows = []
+            columns = None
+            continue
+        rows.append(row)
+        if len(rows) >= chunk_size:
+            yield snapshot, columns, rows
+            rows = []
+    if rows:
+        yield snapshot, columns, rows
+
+
+def chunk_ranks(columns, rows):
+    """
+    Team names and consensus rank (mean over every numeric poll column) of
+    a chunk
+    """
+    poll_idx = [i for i, c in enumerate(columns) if c not in NON_POLL_COLUMNS]
+    team_idx = columns.index('Team')
+    teams = np.array([r[team_idx].strip() for r in rows], dtype=object)
+    values = pd.DataFrame([[r[i] for i in poll_idx] for r in rows]) \
+        .apply(lambda x: pd.to_numeric(x.str.strip(), errors='coerce')) \
+        .values.astype(float) if poll_idx else np.empty((len(rows), 0))
+    with np.errstate(invalid='ignore'):
+        ranks = np.nanmean(values, axis=1) if values.shape[1] else \
+            np.full(len(rows), np.nan)
+    # keep the first row of a team listed twice, and only ranked teams
+    first = np.zeros(len(rows), dtype=bool)
+    first[np.unique(teams, return_index=True)[1]] = True
+    keep = first & ~np.isnan(ranks)
+    return teams[keep], ranks[keep]
+
+
+class RankStats(object):
+    """
+    Rolling per-team statistics of the consensus rank, updated chunk by
+    chunk with O(teams) memory.
+
+    Inputs:
+        half_life: Half life in days of the exponentially weighted rank
+    """
+    FIELDS = ['n', 'mean', 'm2', 'last', 'last_day', 'first_day',
+        'd_n', 'd_mean', 'd_m2', 'sx', 'sy', 'sxx', 'sxy', 'ewm']
+
+    def __init__(self, half_life=HALF_LIFE):
+        self.half_life = half_life
+        self.index = {}
+        self.teams = []
+        self.arrays = {f: np.zeros(0) for f in self.FIELDS}
+        # source name -> (signature, snapshots ingested)
+        self.sources = {}
+        self.n_snapshots = 0
+        self.n_rows = 0
+
+    def _indices(self, teams):
+        new = [t for t in teams if t not in self.index]
+        for t in dict.fromkeys(new):
+            self.index[t] = len(self.teams)
+            self.teams.append(t)
+        size = len(self.arrays['n'])
+        if len(self.teams) > size:
+            grow = max(len(self.teams), 2 * size, 64) - size
+            for f in self.FIELDS:
+                self.arrays[f] = np.concatenate([self.arrays[f],
+                    np.zeros(grow)])
+        return np.fromiter((self.index[t] for t in teams), dtype=int,
+            count=len(teams))
+
+    def update(self, teams, ranks, day):
+        """
+        Adds one chunk of a snapshot taken on the given day. A team must
+        appear at most once per snapshot.
+        """
+        idx = self._indices(teams)
+        a = {f: self.arrays[f] for f in self.FIELDS}
+        x = ranks
+
+        seen = a['n'][idx] > 0
+        a['first_day'][idx[~seen]] = day
+
+        # Welford mean and variance of the rank
+        n = a['n'][idx] + 1
+        delta = x - a['mean'][idx]
+        a['mean'][idx] += delta / n
+        a['m2'][idx] += delta * (x - a['mean'][idx])
+        a['n'][idx] = n
+
+        # volatility of the change since the previous snapshot
+        s = idx[seen]
+        change = x[seen] - a['last'][s]
+        dn = a['d_n'][s] + 1
+        d_delta = change - a['d_mean'][s]
+        a['d_mean'][s] += d_delta / dn
+        a['d_m2'][s] += d_delta * (change - a['d_mean'][s])
+        a['d_n'][s] = dn
+
+        # least squares trend of rank on day, relative to the first day to
+        # keep the sums small
+        t = day - a['first_day'][idx]
+        a['sx'][idx] += t
+        a['sy'][idx] += x
+        a['sxx'][idx] += t * t
+        a['sxy'][idx] += t * x
+
+        # exponentially weighted rank, decayed by the days since last seen
+        gap = np.where(seen, day - a['last_day'][idx], np.inf)
+        keep = np.where(seen, 0.5 ** (np.maximum(gap, 0) / self.half_life),
+            0.)
+        a['ewm'][idx] = keep * a['ewm'][idx] + (1. - keep) * x
+
+        a['last'][idx] = x
+        a['last_day'][idx] = day
+        self.n_rows += len(idx)
+
+    def summary(self):
+        """
+        DataFrame of every team's statistics
+        """
+        k = len(self.teams)
+        a = {f: v[:k] for f, v in self.arrays.items()}
+        n = a['n']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            denom = n * a['sxx'] - a['sx'] ** 2
+            slope = np.where(denom > 0,
+                (n * a['sxy'] - a['sx'] * a['sy']) / denom, np.nan)
+            result = pd.DataFrame({
+                'Team': self.teams,
+                'snapshots': n.astype(int),
+                'mean_rank': a['mean'],
+                'rank_sd': np.sqrt(a['m2'] / (n - 1)),
+                'change_sd': np.sqrt(a['d_m2'] / (a['d_n'] - 1)),
+                'trend_per_day': slope,
+                'ewm_rank': a['ewm'],
+                'last_rank': a['last'],
+                'first_seen': [_date(d) for d in a['first_day']],
+                'last_seen': [_date(d) for d in a['last_day']],
+            })
+        return result.sort_values('ewm_rank').reset_index(drop=True)
+
+    def save(self, path):
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, half_life=HALF_LIFE):
+        """
+        Loads saved state, or returns empty stats if path doesn't exist
+        """
+        if path is not None and os.path.isfile(path):
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        return cls(half_life)
+
+
+def _date(day):
+    if not day or day < 1 or day > datetime.date.max.toordinal():
+        return None
+    return datetime.date.fromordinal(int(day)).isoformat()
+
+
+def ingest(paths, state_path=None, chunk_size=CHUNK_SIZE,
+        half_life=HALF_LIFE, progress=None):
+    """
+    Streams every snapshot under paths into RankStats, resuming from
+    state_path if it exists and saving the state after each source.
+
+    Snapshots are dated from YYYYMMDD / YYYY-MM-DD in their file name, with
+    further snapshots concatenated in the same file on the following days.
+    Undated snapshots are placed one day after the last snapshot seen.
+
+    Outputs:
+        (RankStats, number of snapshots ingested by this call)
+    """
+    stats = RankStats.load(state_path, half_life)
+
+    def unchanged(name, signature):
+        done = stats.sources.get(name)
+        return done is not None and done[0] == signature
+
+    new_snapshots = 0
+    task = progress_stage('Ingesting team rows')
+    for name, signature, stream in iter_sources(paths, skip=unchanged):
+        done = stats.sources.get(name, (None, 0))[1]
+        base_day = snapshot_day(name)
+        last = -1
+        for snapshot, columns, rows in iter_chunks(name, stream, chunk_size):
+            if snapshot < done:
+                continue
+            if snapshot != last:
+                last = snapshot
+                stats.n_snapshots += 1
+                new_snapshots += 1
+                if base_day is not None:
+                    day = base_day + snapshot
+                else:
+                    day = stats.arrays['last_day'].max(initial=0) + 1 \
+                        if len(stats.teams) else 1
+            teams, ranks = chunk_ranks(columns, rows)
+            stats.update(teams, ranks, day)
+            task.advance(len(rows))
+        stats.sources[name] = (signature, max(done, last + 1))
+        if state_path is not None:
+            stats.save(state_path)
+        if progress is not None:
+            progress(name, stats)
+    task.done()
+
+    return stats, new_snapshots
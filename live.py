@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+"""
+Live advancement probabilities once the tournament has started.
+
+The bracket built from final_68 is kept as a tree of games. Every game node
+stores the probability that each team below it wins it, computed exactly by
+dynamic programming from its two children:
+
+    P(t wins node) = P(t wins its child) * sum_u P(u wins other child) P(t beats u)
+
+Completed results are read from a local csv with winner and loser columns
+(Massey team names), which can be appended to as games finish. A result
+fixes the winner of its game and of the earlier games on both teams' paths,
+and only those nodes and their ancestors are recomputed. Every other subtree
+keeps its cached distribution, so an update costs a few small matrix-vector
+products rather than a new simulation.
+"""
+
+import csv
+
+import numpy as np
+import pandas as pd
+
+from bracket_format import BracketFormat
+from bracket_pdf import bracket_slots
+from win_model import team_strength, win_prob_matrix
+
+
+def read_results(path, start=0):
+    """
+    Reads the results csv from data row start on. Rows without both teams
+    are skipped but counted, so the next read starts after them.
+
+    Outputs:
+        ([(data row, winner, loser), ...], number of data rows in the file)
+    """
+    results = []
+    rows = 0
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for i, row in enumerate(csv.DictReader(f)):
+            rows = i + 1
+            if i < start:
+                continue
+            winner = (row.get('winner') or '').strip()
+            loser = (row.get('loser') or '').strip()
+            if winner and loser:
+                results.append((i, winner, loser))
+    return results, rows
+
+
+class LiveBracket(object):
+    """
+    Round-by-round advancement probabilities conditioned on results.
+
+    Inputs:
+        slots: First-round slots in bracket order, as from
+            bracket_pdf.bracket_slots: team names, (team, team) play-in
+            tuples or None for byes
+        teams: List of every team name in the field
+        win_prob: Matrix where win_prob[i, j] is the probability teams[i]
+            beats teams[j]
+        round_names: Names of the rounds after the play-in games
+    """
+    def __init__(self, slots, teams, win_prob, round_names):
+        self.teams = list(teams)
+        self.team_index = {t: i for i, t in enumerate(self.teams)}
+        self.win_prob = np.asarray(win_prob, dtype=float)
+        self.round_names = list(round_names)
+        self.has_play_in = any(isinstance(s, tuple) for s in slots)
+
+        # Node arrays. Leaves are single teams (or empty for byes); every
+        # other node is a game with round 0 for play-ins, 1 for the first
+        # round up to len(round_names) for the championship
+        self.children = []
+        self.parent = []
+        self.round = []
+        self.members = []
+        self.probs = []
+        self.fixed = []
+        self.leaf = {}
+
+        level = [self._slot_node(s) for s in slots]
+        for rd in range(1, len(self.round_names) + 1):
+            level = [self._game_node(level[j], level[j + 1], rd)
+                for j in range(0, len(level), 2)]
+        self.root = level[0]
+
+        # advance[t, k]: probability team t wins its game in round k
+        # (column 0 is the play-in round)
+        self.advance = np.zeros((len(self.teams), len(self.round_names) + 1))
+        self.advance[:, 0] = 1.
+        for node in range(len(self.children)):
+            self._compute(node)
+
+        # results applied, data rows of the results csv read, and the
+        # rows that couldn't be applied as (row, winner, loser, error)
+        self.n_results = 0
+        self.n_rows = 0
+        self.rejected = []
+
+    @classmethod
+    def from_bracketeer(cls, bracket):
+        """
+        Builds the live bracket from a Bracketeer after get_tourney_teams
+        """
+        fmt = getattr(bracket, 'bracket_format', None) or BracketFormat()
+        field = bracket.final_68
+        strength = team_strength(field['final_rank'].values,
+            use_metrics=bracket.use_metrics,
+            n_teams=len(bracket.team_data_df))
+        live = cls(bracket_slots(field, fmt), field['Team'].values,
+            win_prob_matrix(strength), fmt.round_names())
+        live.seeds = dict(zip(field['Team'], field['seed']))
+        return live
+
+    def _add_node(self, children, rd, members):
+        node = len(self.children)
+        self.children.append(children)
+        self.parent.append(None)
+        self.round.append(rd)
+        self.members.append(np.asarray(members, dtype=int))
+        self.probs.append(np.ones(len(members)))
+        self.fixed.append(None)
+        if children is not None:
+            for child in children:
+                self.parent[child] = node
+        return node
+
+    def _leaf_node(self, team):
+        members = [] if team is None else [self.team_index[team]]
+        node = self._add_node(None, -1, members)
+        if team is not None:
+            self.leaf[self.team_index[team]] = node
+        return node
+
+    def _slot_node(self, slot):
+        if isinstance(slot, tuple):
+            a, b = (self._leaf_node(t) for t in slot)
+            return self._game_node(a, b, 0)
+        return self._leaf_node(slot)
+
+    def _game_node(self, a, b, rd):
+        members = np.concatenate([self.members[a], self.members[b]])
+        return self._add_node((a, b), rd, members)
+
+    def _compute(self, node):
+        """
+        Recomputes one node from its children and updates advance
+        """
+        children = self.children[node]
+        if children is None:
+            return
+        a, b = children
+        ma, mb = self.members[a], self.members[b]
+        pa, pb = self.probs[a], self.probs[b]
+
+        if self.fixed[node] is not None:
+            probs = (self.members[node] == self.fixed[node]).astype(float)
+        elif len(ma) == 0 or len(mb) == 0:
+            # bye: the other side advances untouched
+            probs = np.concatenate([pa, pb])
+        else:
+            w = self.win_prob[np.ix_(ma, mb)]
+            probs = np.concatenate([pa * (w @ pb), pb * ((1. - w).T @ pa)])
+
+        self.probs[node] = probs
+        self.advance[self.members[node], self.round[node]] = probs
+
+    def _path(self, team):
+        """
+        Game nodes from the team's leaf up to the root
+        """
+        path = []
+        node = self.parent[self.leaf[team]]
+        while node is not None:
+            path.append(node)
+            node = self.parent[node]
+        return path
+
+    def record_result(self, winner, loser):
+        """
+        Conditions the bracket on winner beating loser and updates every
+        affected probability. Returns the round of the game.
+        """
+        for team in (winner, loser):
+            if team not in self.team_index:
+                raise KeyError('{} is not in the field'.format(team))
+        w, l = self.team_index[winner], self.team_index[loser]
+
+        # The game is where the two teams' paths meet
+        w_path, l_path = self._path(w), self._path(l)
+        l_nodes = set(l_path)
+        game = next(n for n in w_path if n in l_nodes)
+        if self.fixed[game] is not None and self.fixed[game] != w:
+            raise ValueError('{} already beat {}'.format(
+                self.teams[self.fixed[game]], winner))
+
+        for team, path in ((w, w_path), (l, l_path)):
+            below = path[:path.index(game)]
+            child = below[-1] if below else self.leaf[team]
+            p = self.probs[child][self.members[child] == team]
+            if p.sum() == 0:
+                raise ValueError('{} was already eliminated before meeting'
+                    ' {}'.format(self.teams[team], self.teams[w + l - team]))
+
+        # Both teams won every earlier game on their paths
+        changed = []
+        for team, path in ((w, w_path), (l, l_path)):
+            for node in path[:path.index(game)]:
+                self.fixed[node] = team
+                changed.append(node)
+        self.fixed[game] = w
+
+        # Recompute the changed nodes, then the game and its ancestors,
+        # bottom up. Every other subtree is reused as is
+        for node in sorted(changed, key=lambda n: self.round[n]):
+            self._compute(node)
+        for node in w_path[w_path.index(game):]:
+            self._compute(node)
+
+        self.n_results += 1
+        return self.round[game]
+
+    def update_from_file(self, path):
+        """
+        Applies results added to the results csv since the last call.
+        A result that contradicts earlier ones (or names a team outside the
+        field) is skipped and added to rejected instead of stopping the
+        update. Returns the number of new results applied.
+        """
+        results, self.n_rows = read_results(path, start=self.n_rows)
+        applied = 0
+        for row, winner, loser in results:
+            try:
+                self.record_result(winner, loser)
+            except (KeyError, ValueError) as e:
+                self.rejected.append((row, winner, loser, str(e).strip("'")))
+                continue
+            applied += 1
+        return applied
+
+    def probabilities(self):
+        """
+        DataFrame of each team's probability of winning its game in every
+        round, sorted by championship probability
+        """
+        columns = self.round_names
+        values = self.advance[:, 1:]
+        if self.has_play_in:
+            columns = ['First Four'] + columns
+            values = self.advance
+
+        df = pd.DataFrame(values, columns=columns)
+        df.insert(0, 'Team', self.teams)
+        seeds = getattr(self, 'seeds', None)
+        if seeds is not None:
+            df.insert(1, 'seed', df['Team'].map(seeds))
+        return df.sort_values(columns[::-1], ascending=False)\
+            .reset_index(drop=True)
@@ -2,9 +2,12 @@
 """CLI to seed an NCAA tournament and produce a PDF bracket."""
 
 import argparse
+import contextlib
 import sys
 
-from metrics import Bracketeer
+from memory import MemoryBudgetError, MemoryTracker, parse_budgets
+from pipeline import bracket_from_selection, bracket_pipeline
+from progress import Dashboard, note
 
 
 def parse_conf_winners(pairs):
@@ -22,6 +25,416 @@ def parse_conf_winners(pairs):
     return winners
 
 
+def run_optimize_command(args):
+    """Fit poll weights and the computer/human mix to past fields."""
+    import json
+
+    from optimize_weights import optimize
+
+    config, cv = optimize(args.root, reg=args.reg,
+                          cross_validate=not args.no_cv,
+                          max_workers=args.workers)
+    if cv is not None:
+        print(cv.to_string(index=False, float_format='{:.3f}'.format))
+        print(f'Held-out seed error: {config["cv_seed_error"]:.3f} '
+              f'(default settings: {config["cv_default_seed_error"]:.3f})')
+    with open(args.output, 'w') as f:
+        json.dump(config, f, indent=1)
+    print(f'Weights saved to: {args.output} '
+          f'(use with --weights-config {args.output})')
+
+
+def run_backtest_command(args):
+    """Run the multi-season backtest and print the best configs."""
+    from backtest import load_configs, run_backtest
+
+    configs = load_configs(args.configs)
+    note(f'Backtesting {len(configs)} config(s)...')
+    results, summary = run_backtest(args.root, configs,
+                                    max_workers=args.workers)
+    results.to_csv(args.output, index=False)
+    print(summary.head(20).to_string())
+    print(f'Per-season results saved to: {args.output}')
+
+
+def run_batch_command(args):
+    """Run a JSONL file of bracket jobs on a worker pool."""
+    from batch import run_batch
+
+    def on_result(result):
+        if result['status'] == 'error':
+            print(f'  {result["id"]}: {result["error"]}', file=sys.stderr)
+
+    try:
+        summary = run_batch(
+            args.jobs, csv_path=args.csv, output_dir=args.output,
+            log_path=args.log,
+            bracket_format={'n_teams': args.field_size,
+                            'n_regions': args.regions, 'byes': args.byes},
+            max_workers=args.workers,
+            cache_dir=None if args.no_cache else args.cache_dir,
+            on_result=on_result, export_dir=args.export,
+            export_format=args.export_format)
+    except ImportError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        sys.exit(1)
+    print(f'{summary["jobs"]} job(s), {summary["unique"]} unique, '
+          f'{summary["errors"]} failed in {summary["total_s"]:.1f} s '
+          f'(snapshot parsed once in {summary["parse_s"]:.2f} s)')
+    print(f'Results logged to: {summary["log"]}')
+    if args.export:
+        print(f'Tables exported to: {args.export}')
+
+
+def run_polls_command(args):
+    """Correlation and agreement analytics for one or more snapshots."""
+    import os
+
+    from poll_analysis import analyze_snapshots
+
+    snapshots = args.snapshots or [args.csv]
+    results = analyze_snapshots(
+        snapshots, include_ratings=args.ratings,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        max_workers=args.workers)
+
+    os.makedirs(args.output, exist_ok=True)
+    for path, result in zip(snapshots, results):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        for name in ('spearman', 'kendall', 'outliers', 'qq'):
+            result[name].to_csv(os.path.join(args.output,
+                                             f'{stem}_{name}.csv'),
+                                index=name != 'qq')
+        print(f'{path}: {len(result["kendall"])} polls')
+        print(result['outliers'].head(args.top).to_string(
+            float_format='{:.3f}'.format))
+    print(f'Results saved to: {args.output}')
+
+
+def run_ingest_command(args):
+    """Stream archived snapshots into rolling per-team rank statistics."""
+    from ingest import ingest
+
+    stats, n_new = ingest(args.paths, state_path=args.state,
+                          chunk_size=args.chunk_size)
+    summary = stats.summary()
+    print(f'{n_new} new snapshot(s), {stats.n_snapshots} total, '
+          f'{stats.n_rows} team rows, {len(stats.teams)} teams')
+    print(summary.head(args.top).to_string(index=False,
+                                           float_format='{:.2f}'.format))
+    if args.output:
+        summary.to_csv(args.output, index=False)
+        print(f'Team statistics saved to: {args.output}')
+
+
+def run_matchup_command(args, bracket):
+    """Predicted margin and win probability for one or many matchups."""
+    from matchups import MatchupIndex
+
+    index = MatchupIndex(bracket)
+    if args.pairs:
+        results = index.query_file(args.pairs)
+    elif len(args.teams) == 2:
+        results = index.query([args.teams[0]], [args.teams[1]])
+    else:
+        print('Error: give two teams or --pairs FILE', file=sys.stderr)
+        sys.exit(1)
+
+    for name in set(results.loc[results['method'] == 'unknown',
+                                ['team_a', 'team_b']].values.ravel()):
+        if (index.resolve([name]) < 0).all():
+            print(f"Unknown team '{name}'. Did you mean: "
+                  f"{', '.join(index.suggest(name)) or '?'}",
+                  file=sys.stderr)
+
+    if args.output:
+        results.to_csv(args.output, index=False)
+        print(f'{len(results)} matchup(s) saved to: {args.output}')
+    else:
+        print(results.to_string(index=False, float_format='{:.3f}'.format))
+
+
+def run_simulate_command(args, bracket):
+    """Simulated margin and total distributions of every matchup."""
+    from game_sim import simulate_field
+
+    sim = simulate_field(bracket, n_sims=args.sims, seed=args.seed,
+                         cache_dir=None if args.no_cache else args.cache_dir)
+    filled = sim.inputs.index[sim.inputs['source'] == 'composite']
+    if len(filled):
+        note(f'No KenPom numbers for {", ".join(filled)}; '
+             'using composite strength')
+
+    if len(args.teams) == 2:
+        team_a, team_b = args.teams
+        for name in args.teams:
+            if name not in sim.index:
+                print(f"Error: '{name}' is not in the field", file=sys.stderr)
+                sys.exit(1)
+        margin = sim.margin_distribution(team_a, team_b)
+        total = sim.total_distribution(team_a, team_b)
+        mean = (margin.index * margin).sum()
+        cdf = margin.cumsum()
+        low, high = (margin.index[(cdf < q).sum()] for q in (0.05, 0.95))
+        print(f'{team_a} vs {team_b} ({args.sims:,} games)')
+        print(f'  {team_a} wins: '
+              f'{sim.win_prob([team_a], [team_b])[0]:.1%}')
+        print(f'  Margin: {mean:+.1f} (90% between {low:+d} and {high:+d})')
+        print(f'  Total: {(total.index * total).sum():.1f}')
+        return
+    if args.teams:
+        print('Error: give two teams or none', file=sys.stderr)
+        sys.exit(1)
+
+    summary = sim.summary()
+    if args.output:
+        summary.to_csv(args.output, index=False)
+        print(f'{len(summary)} matchup(s) saved to: {args.output}')
+    else:
+        print(summary.to_string(index=False, float_format='{:.3f}'.format))
+
+
+def run_import_excel_command(args, bracket):
+    """Read filled-in Excel brackets into bit-packed pool entries."""
+    import os
+
+    from excel_import import import_entries
+
+    try:
+        entries, report = import_entries(args.paths, bracket.final_68,
+                                         output=args.output,
+                                         max_workers=args.workers)
+    except ValueError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        sys.exit(1)
+    report_path = os.path.splitext(args.output)[0] + '.csv'
+    report.to_csv(report_path, index=False)
+
+    errors = report[report['entry'] < 0]
+    for row in errors.head(args.show_errors).itertuples():
+        note(f'{row.path}: {row.error}')
+    print(f'{len(entries):,} of {len(report):,} bracket(s) saved to: '
+          f'{args.output}')
+    if len(errors):
+        print(f'{len(errors):,} invalid, listed in: {report_path}')
+
+
+def run_pool_command(args, bracket):
+    """Expected score and pool win chances of bit-packed bracket entries."""
+    import os
+
+    import bitbracket
+
+    slots = None
+    if args.layout == 'excel':
+        from excel_import import template_slots
+        slots = template_slots(bracket.final_68)
+    codec = bitbracket.BracketCodec.from_bracketeer(bracket, slots=slots)
+    if args.generate:
+        entries = bitbracket.create_entries(args.entries, args.generate)
+        chunk = bitbracket.ENTRY_CHUNK
+        for start in range(0, args.generate, chunk):
+            n = min(chunk, args.generate - start)
+            entries[start:start + n] = codec.simulate(n, seed=args.seed + 1 +
+                                                      start // chunk)
+        entries.flush()
+        del entries
+        print(f'{args.generate:,} model-picked entries saved to: '
+              f'{args.entries}')
+    if not os.path.isfile(args.entries):
+        print(f'Error: {args.entries} not found', file=sys.stderr)
+        sys.exit(1)
+    weights = bitbracket.ROUND_WEIGHTS
+    if args.weights:
+        weights = [int(w) for w in args.weights.split(',')]
+    try:
+        entries = bitbracket.load_entries(args.entries)
+        outcomes = codec.simulate(args.sims, seed=args.seed)
+        result = bitbracket.score_summary(entries, outcomes, weights=weights)
+    except ValueError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        sys.exit(1)
+
+    result.insert(0, 'entry', range(len(result)))
+    top = result.sort_values(['win_share', 'mean_score'], ascending=False)
+    top = top.head(args.top) if not args.output else top
+    champions = codec.decode_slots(entries[top['entry'].values])[:, -1]
+    top['champion'] = [codec.label(s) for s in champions]
+    if args.output:
+        top.to_csv(args.output, index=False)
+        print(f'{len(top):,} entries saved to: {args.output}')
+    else:
+        print(top.to_string(index=False, float_format='{:.4f}'.format))
+
+
+def run_sites_command(args, bracket):
+    """First-weekend sites of the protected seeds' pods."""
+    import os
+
+    from sites import SiteTable
+
+    for path in (args.campuses, args.sites):
+        if not os.path.isfile(path):
+            print(f'Error: {path} not found', file=sys.stderr)
+            sys.exit(1)
+    table = SiteTable.from_csv(args.campuses, args.sites)
+    try:
+        assignment = table.assign(bracket.final_68, bracket.bracket_format)
+    except ValueError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        sys.exit(1)
+
+    if args.output:
+        assignment.to_csv(args.output, index=False)
+        print(f'{len(assignment)} pod(s) saved to: {args.output}')
+    else:
+        print(assignment.drop(columns='members').to_string(
+            index=False, float_format='{:.0f}'.format))
+
+
+def run_export_command(args, bracket):
+    """Write the selection and its probabilities as machine-readable tables."""
+    from export import bracket_tables, write_tables
+    from live import LiveBracket
+
+    probabilities = {
+        'advancement': LiveBracket.from_bracketeer(bracket).probabilities()}
+    tables = bracket_tables(bracket, probabilities=probabilities)
+    try:
+        paths = write_tables(tables, args.output, fmt=args.format)
+    except ImportError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        sys.exit(1)
+    for path in paths:
+        print(f'Saved: {path}')
+
+
+def run_scenarios_command(args, bracket):
+    """Field and seed probabilities over all remaining conference winners."""
+    import json
+
+    from scenarios import ScenarioEngine
+
+    with open(args.remaining) as f:
+        remaining = json.load(f)
+    engine = ScenarioEngine(bracket, remaining)
+    results = engine.compute()
+
+    print(f'{len(remaining)} live conference(s), bubble:')
+    print(engine.bubble(results)[['Team', 'Conf', 'p_auto', 'p_at_large',
+                                  'p_field', 'expected_seed']]
+          .to_string(index=False, float_format='{:.3f}'.format))
+    if args.output:
+        results.to_csv(args.output, index=False)
+        print(f'Scenario probabilities saved to: {args.output}')
+
+
+def run_project_command(args, bracket):
+    """Field and seed probabilities from simulating the remaining schedule."""
+    import os
+
+    from projection import SeasonProjection, read_schedule
+
+    if not os.path.isfile(args.schedule):
+        print(f'Error: schedule {args.schedule} not found', file=sys.stderr)
+        sys.exit(1)
+    try:
+        projection = SeasonProjection(bracket, read_schedule(args.schedule))
+    except ValueError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        sys.exit(1)
+    results = projection.run(args.sims, seed=args.seed,
+                             max_workers=args.workers)
+
+    print(f'{projection.n_games} remaining game(s), {args.sims} '
+          f'simulations, bubble:')
+    print(projection.bubble(results)[['Team', 'Conf', 'p_auto', 'p_at_large',
+                                      'p_field', 'expected_seed']]
+          .to_string(index=False, float_format='{:.3f}'.format))
+    if args.output:
+        results.to_csv(args.output, index=False)
+        print(f'Projected probabilities saved to: {args.output}')
+
+
+def run_bubble_command(args, bracket):
+    """How far each team is from the cut line and its neighbouring seeds."""
+    from bubble import bubble_margins, export, near_cut
+
+    margins = bubble_margins(bracket)
+    print(near_cut(margins, args.window).to_string(
+        index=False, float_format='{:.2f}'.format))
+    if args.output:
+        export(margins, args.output)
+        print(f'Margins for all {len(margins)} teams saved to: {args.output}')
+
+
+def run_diff_command(args, selection, bracket_format):
+    """Field, seed and poll movement between two snapshots."""
+    import os
+    import time
+
+    from snapshot_diff import diff_snapshots, format_diff, load_snapshot, \
+        to_json
+
+    new_path = args.new or args.csv
+    old = load_snapshot(args.old, selection, bracket_format)
+    mtime = None
+    while True:
+        if os.path.isfile(new_path) and \
+                os.path.getmtime(new_path) != mtime:
+            mtime = os.path.getmtime(new_path)
+            start = time.perf_counter()
+            new = load_snapshot(new_path, selection, bracket_format)
+            diff = diff_snapshots(old, new, top=args.top)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f'{old.path} -> {new.path} ({elapsed:.0f} ms)')
+            print(format_diff(diff))
+            if args.output:
+                to_json(diff, args.output)
+                print(f'Diff saved to: {args.output}')
+            if args.rolling:
+                old = new
+        if not args.watch:
+            break
+        time.sleep(args.interval)
+
+
+def run_live_command(args, bracket):
+    """Condition the bracket on completed results, optionally as they come in."""
+    import os
+    import time
+
+    from live import LiveBracket
+
+    live = LiveBracket.from_bracketeer(bracket)
+    mtime = None
+    while True:
+        if os.path.isfile(args.results) and \
+                os.path.getmtime(args.results) != mtime:
+            mtime = os.path.getmtime(args.results)
+            start = time.perf_counter()
+            n_rejected = len(live.rejected)
+            n_new = live.update_from_file(args.results)
+            elapsed = (time.perf_counter() - start) * 1000
+            for row, winner, loser, error in live.rejected[n_rejected:]:
+                print(f'Error: {args.results} data row {row + 1} ({winner} over '
+                      f'{loser}) skipped: {error}', file=sys.stderr)
+            if n_new or live.n_results == 0:
+                probs = live.probabilities()
+                print(f'{live.n_results} result(s) applied '
+                      f'({n_new} new, {elapsed:.1f} ms)')
+                print(probs.head(args.top).to_string(
+                    index=False, float_format='{:.3f}'.format))
+                if args.output:
+                    probs.to_csv(args.output, index=False)
+        if not args.watch:
+            break
+        time.sleep(args.interval)
+
+    if args.output:
+        print(f'Advancement probabilities saved to: {args.output}')
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Generate an NCAA tournament bracket PDF.')
@@ -45,32 +458,340 @@ def main():
                         help='Skip downloading CSV; use existing file at --csv path')
     parser.add_argument('--excel', action='store_true',
                         help='Also save an Excel bracket file')
+    parser.add_argument('--field-size', type=int, default=68,
+                        help='Number of teams in the field (default: 68)')
+    parser.add_argument('--regions', type=int, default=4,
+                        help='Number of regions, a power of two (default: 4)')
+    parser.add_argument('--byes', action='store_true',
+                        help='Give top seeds byes instead of adding play-in '
+                             'games when the field does not fill the regions')
+    parser.add_argument('--weights-config', default=None,
+                        help='JSON poll weights and computer/human mix, '
+                             'e.g. from the optimize command')
+    parser.add_argument('--memory-report', action='store_true',
+                        help='Print bytes allocated by each stage')
+    parser.add_argument('--memory-budget', nargs='+', default=None,
+                        metavar='STAGE=MB',
+                        help='Fail if a stage peaks above its budget '
+                             '(e.g. select=5 comp_rankings=1)')
+    parser.add_argument('--quiet', action='store_true',
+                        help='No progress dashboard or status messages '
+                             '(e.g. for cron)')
+    parser.add_argument('--cache-dir', default='.cache',
+                        help='Directory for cached pipeline stages '
+                             '(default: .cache)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Run every stage without reading or writing '
+                             'the cache')
+
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND',
+        help='Optional analysis command (default: generate a bracket)')
+
+    backtest_parser = subparsers.add_parser('backtest',
+        help='Score selection configs against past committee fields')
+    backtest_parser.add_argument('root',
+        help='Directory with one <season>/compare.csv + field.csv per season')
+    backtest_parser.add_argument('--configs', default=None,
+        help='JSON file with a list of configs or a {"grid": ...} spec')
+    backtest_parser.add_argument('--workers', type=int, default=None,
+        help='Number of worker processes (default: all cores)')
+    backtest_parser.add_argument('-o', '--output', default='backtest.csv',
+        help='Per-season results CSV (default: backtest.csv)')
+
+    optimize_parser = subparsers.add_parser('optimize',
+        help='Fit poll weights to past committee seeding')
+    optimize_parser.add_argument('root',
+        help='Directory with one <season>/compare.csv + field.csv per season')
+    optimize_parser.add_argument('--reg', type=float, default=0.001,
+        help='L2 penalty pulling weights toward uniform (default: 0.001)')
+    optimize_parser.add_argument('--no-cv', action='store_true',
+        help='Skip leave-one-season-out cross-validation')
+    optimize_parser.add_argument('--workers', type=int, default=None,
+        help='Number of worker processes for the folds')
+    optimize_parser.add_argument('-o', '--output', default='weights.json',
+        help='Config file to write (default: weights.json)')
+
+    batch_parser = subparsers.add_parser('batch',
+        help='Run a JSONL file of bracket jobs on a worker pool')
+    batch_parser.add_argument('jobs',
+        help='JSONL file, one job per line (see batch.py for the keys)')
+    batch_parser.add_argument('--workers', type=int, default=None,
+        help='Number of worker processes (default: all cores)')
+    batch_parser.add_argument('--log', default=None,
+        help='JSONL result log (default: <output>/results.jsonl)')
+    batch_parser.add_argument('-o', '--output', default='batch',
+        help='Output directory (default: batch)')
+    batch_parser.add_argument('--export', default=None, metavar='DIR',
+        help='Also stream every job\'s field and bid lists to tables in DIR')
+    batch_parser.add_argument('--export-format', default='parquet',
+        choices=['arrow', 'parquet', 'json'],
+        help='Format of the --export tables (default: parquet)')
+
+    export_parser = subparsers.add_parser('export',
+        help='Field, bid lists, poll ranks and probabilities as tables')
+    export_parser.add_argument('--format', default='arrow',
+        choices=['arrow', 'parquet', 'json'],
+        help='Arrow IPC or Parquet files per table, or one compact JSON '
+             '(default: arrow)')
+    export_parser.add_argument('-o', '--output', default='export',
+        help='Output directory (default: export)')
+
+    polls_parser = subparsers.add_parser('polls',
+        help='Poll correlation matrices, outlier scores and QQ quantiles')
+    polls_parser.add_argument('snapshots', nargs='*',
+        help='compare.csv snapshots to analyze (default: --csv)')
+    polls_parser.add_argument('--ratings', action='store_true',
+        help='Include the local ratings source csvs')
+    polls_parser.add_argument('--workers', type=int, default=None,
+        help='Number of worker processes (default: all cores)')
+    polls_parser.add_argument('--top', type=int, default=10,
+        help='Number of outlier polls to print (default: 10)')
+    polls_parser.add_argument('-o', '--output', default='poll_analysis',
+        help='Output directory (default: poll_analysis)')
+
+    ingest_parser = subparsers.add_parser('ingest',
+        help='Stream archived compare.csv snapshots into team statistics')
+    ingest_parser.add_argument('paths', nargs='+',
+        help='Snapshot files, directories, .tar(.gz) or .zip archives')
+    ingest_parser.add_argument('--state', default='ingest_state.pkl',
+        help='State file to resume from (default: ingest_state.pkl)')
+    ingest_parser.add_argument('--chunk-size', type=int, default=5000,
+        help='Rows held in memory at a time (default: 5000)')
+    ingest_parser.add_argument('--top', type=int, default=25,
+        help='Number of teams to print (default: 25)')
+    ingest_parser.add_argument('-o', '--output', default=None,
+        help='Save every team\'s statistics to this CSV')
+
+    matchup_parser = subparsers.add_parser('matchup',
+        help='Predicted margin and win probability for team pairs')
+    matchup_parser.add_argument('teams', nargs='*', metavar='TEAM',
+        help='Two team names, e.g. Duke "North Carolina"')
+    matchup_parser.add_argument('--pairs', default=None,
+        help='CSV of matchups with team_a,team_b columns')
+    matchup_parser.add_argument('-o', '--output', default=None,
+        help='Save the results to this CSV')
+
+    simulate_parser = subparsers.add_parser('simulate',
+        help='Possession-level score distributions of every matchup')
+    simulate_parser.add_argument('teams', nargs='*', metavar='TEAM',
+        help='Two teams to show (default: every pair of the field)')
+    simulate_parser.add_argument('--sims', type=int, default=10000,
+        help='Simulated games per matchup (default: 10000)')
+    simulate_parser.add_argument('--seed', type=int, default=0,
+        help='Random seed (default: 0)')
+    simulate_parser.add_argument('-o', '--output', default=None,
+        help='Save every matchup\'s summary to this CSV')
+
+    pool_parser = subparsers.add_parser('pool',
+        help='Score bit-packed bracket entries against simulated tournaments')
+    pool_parser.add_argument('entries',
+        help='.npy array of uint64 bracket codes (see bitbracket.py)')
+    pool_parser.add_argument('--sims', type=int, default=10000,
+        help='Simulated tournaments (default: 10000)')
+    pool_parser.add_argument('--seed', type=int, default=0,
+        help='Random seed (default: 0)')
+    pool_parser.add_argument('--weights', default=None,
+        help='Comma-separated points per correct pick of each round '
+             '(default: 10,20,40,80,160,320)')
+    pool_parser.add_argument('--generate', type=int, default=0, metavar='N',
+        help='First write N entries picked from the model to ENTRIES')
+    pool_parser.add_argument('--layout', choices=['pdf', 'excel'],
+        default='pdf',
+        help='Game order of the entries: the PDF bracket\'s (default) or '
+             'the Excel template\'s, for entries from import-excel')
+    pool_parser.add_argument('--top', type=int, default=20,
+        help='Entries to show (default: 20)')
+    pool_parser.add_argument('-o', '--output', default=None,
+        help='Save every entry\'s results to this CSV')
+
+    import_excel_parser = subparsers.add_parser('import-excel',
+        help='Read filled-in Excel brackets into pool entries')
+    import_excel_parser.add_argument('paths', nargs='+', metavar='PATH',
+        help='Workbooks, or directories of .xlsx workbooks')
+    import_excel_parser.add_argument('-o', '--output', default='entries.npy',
+        help='.npy file for the entries; the per-file report goes next to '
+             'it as .csv (default: entries.npy)')
+    import_excel_parser.add_argument('--workers', type=int, default=None,
+        help='Worker processes (default: all cores)')
+    import_excel_parser.add_argument('--show-errors', type=int, default=10,
+        metavar='N', help='Invalid files to list (default: 10)')
+
+    sites_parser = subparsers.add_parser('sites',
+        help='Assign the protected seeds\' pods to first-weekend sites')
+    sites_parser.add_argument('--campuses', default='csv_files/campuses.csv',
+        help='CSV of Team,lat,lon (default: csv_files/campuses.csv)')
+    sites_parser.add_argument('--sites', default='csv_files/sites.csv',
+        help='CSV of site,lat,lon[,capacity,host,host_conf] '
+             '(default: csv_files/sites.csv)')
+    sites_parser.add_argument('-o', '--output', default=None,
+        help='Save the assignment to this CSV')
+
+    scenarios_parser = subparsers.add_parser('scenarios',
+        help='Field and seed odds over remaining conference tournaments')
+    scenarios_parser.add_argument('remaining',
+        help='JSON of conference -> list of possible winners, or '
+             'conference -> {team: probability}')
+    scenarios_parser.add_argument('-o', '--output', default=None,
+        help='Save every team\'s probabilities to this CSV')
+
+    project_parser = subparsers.add_parser('project',
+        help='Field and seed odds from simulating the remaining schedule')
+    project_parser.add_argument('--schedule',
+        default='csv_files/schedule.csv',
+        help='CSV of id,date,home,away[,neutral,final] games still to play; '
+             'W:<id> stands for the winner of an earlier game '
+             '(default: csv_files/schedule.csv)')
+    project_parser.add_argument('--sims', type=int, default=10000,
+        help='Simulated seasons (default: 10000)')
+    project_parser.add_argument('--seed', type=int, default=0,
+        help='Random seed (default: 0)')
+    project_parser.add_argument('--workers', type=int, default=None,
+        help='Worker processes (default: all cores)')
+    project_parser.add_argument('-o', '--output', default=None,
+        help='Save every team\'s probabilities to this CSV')
+
+    bubble_parser = subparsers.add_parser('bubble',
+        help='Rank margins to the cut line and neighbouring seed lines')
+    bubble_parser.add_argument('--window', type=int, default=8,
+        help='Teams to show on each side of the cut line (default: 8)')
+    bubble_parser.add_argument('-o', '--output', default=None,
+        help='Save margins for every team to this CSV (or .json)')
+
+    diff_parser = subparsers.add_parser('diff',
+        help='Field, seed and poll movement between two snapshots')
+    diff_parser.add_argument('old', help='Earlier compare.csv snapshot')
+    diff_parser.add_argument('new', nargs='?', default=None,
+        help='Later snapshot (default: --csv)')
+    diff_parser.add_argument('--watch', action='store_true',
+        help='Keep running and diff again whenever the new snapshot changes')
+    diff_parser.add_argument('--interval', type=float, default=5.,
+        help='Seconds between checks of the new snapshot (default: 5)')
+    diff_parser.add_argument('--rolling', action='store_true',
+        help='In watch mode, diff each refresh against the previous one '
+             'instead of the old snapshot')
+    diff_parser.add_argument('--top', type=int, default=5,
+        help='Risers and fallers to keep per poll (default: 5)')
+    diff_parser.add_argument('-o', '--output', default=None,
+        help='Save the diff as JSON')
+
+    live_parser = subparsers.add_parser('live',
+        help='Advancement probabilities conditioned on completed games')
+    live_parser.add_argument('--results', default='results.csv',
+        help='CSV of completed games with winner,loser columns '
+             '(default: results.csv)')
+    live_parser.add_argument('--watch', action='store_true',
+        help='Keep running and update whenever the results file changes')
+    live_parser.add_argument('--interval', type=float, default=2.,
+        help='Seconds between checks of the results file (default: 2)')
+    live_parser.add_argument('--top', type=int, default=16,
+        help='Number of teams to print (default: 16)')
+    live_parser.add_argument('-o', '--output', default=None,
+        help='Also save the full probability table to this CSV')
 
     args = parser.parse_args()
+    with Dashboard(quiet=args.quiet):
+        run(args)
+
+
+def run(args):
+    """Dispatch the parsed command line."""
+
+    if args.command == 'backtest':
+        run_backtest_command(args)
+        return
+    if args.command == 'optimize':
+        run_optimize_command(args)
+        return
+    if args.command == 'batch':
+        run_batch_command(args)
+        return
+    if args.command == 'polls':
+        run_polls_command(args)
+        return
+    if args.command == 'ingest':
+        run_ingest_command(args)
+        return
 
     conf_winners = parse_conf_winners(args.conf_winner)
 
+    selection = {'comp_polls': args.polls,
+                 'conf_winners': conf_winners,
+                 'use_metrics': args.use_metrics,
+                 'human_polls': not args.no_human_polls}
+    if args.weights_config:
+        from optimize_weights import load_weights_config
+        weights = load_weights_config(args.weights_config)
+        selection.update({k: weights[k] for k in
+                          ('poll_weights', 'comp_weight', 'human_weight')
+                          if k in weights})
+    bracket_format = {'n_teams': args.field_size,
+                      'n_regions': args.regions, 'byes': args.byes}
+
+    if args.command == 'diff':
+        run_diff_command(args, selection, bracket_format)
+        return
+
     if args.skip_download:
-        print('Using existing CSV file...')
+        note('Using existing CSV file...')
     else:
-        print('Initializing bracket (downloading latest Massey Ratings)...')
-    bracket = Bracketeer(csv_save_path=args.csv, skip_download=args.skip_download)
-
-    print('Selecting tournament field and seeding teams...')
-    bracket.get_tourney_teams(
-        comp_polls=args.polls,
-        conf_winners=conf_winners,
-        use_metrics=args.use_metrics,
-        human_polls=not args.no_human_polls,
+        note('Initializing bracket (downloading latest Massey Ratings)...')
+
+    # Each stage is cached by its inputs, so e.g. a new --title only
+    # re-renders the PDF
+    pipe = bracket_pipeline(
+        csv_path=args.csv,
+        skip_download=args.skip_download,
+        bracket_format=bracket_format,
+        selection=selection,
+        pdf=None if args.command else {'output_path': args.output,
+                                       'title': args.title},
+        excel={'save_file': None} if args.excel and not args.command else None,
+        cache_dir=None if args.no_cache else args.cache_dir,
     )
 
-    pdf_path = bracket.save_bracket_pdf(output_path=args.output, title=args.title)
-    print(f'Bracket PDF saved to: {pdf_path}')
+    note('Selecting tournament field and seeding teams...')
+    tracker = None
+    if args.memory_report or args.memory_budget:
+        try:
+            budgets = parse_budgets(args.memory_budget)
+        except ValueError as e:
+            print(f'Error: {e}', file=sys.stderr)
+            sys.exit(1)
+        tracker = MemoryTracker(budgets=budgets,
+                                strict=bool(args.memory_budget))
+    with tracker or contextlib.nullcontext():
+        try:
+            outputs = pipe.run()
+        except MemoryBudgetError as e:
+            print(f'Error: {e}', file=sys.stderr)
+            sys.exit(1)
+    for stage, status, seconds in pipe.report:
+        note(f'  {stage:<9}{status:<7}{seconds * 1000:8.1f} ms')
+    if tracker is not None:
+        report = tracker.report()
+        for row in report.itertuples():
+            flag = '  over budget' if row.over_budget else ''
+            print(f'  {row.stage:<28}{row.net_bytes / 1e6:8.2f} MB net '
+                  f'{row.peak_bytes / 1e6:8.2f} MB peak{flag}')
+
+    commands = {'live': run_live_command, 'matchup': run_matchup_command,
+                'simulate': run_simulate_command,
+                'pool': run_pool_command,
+                'import-excel': run_import_excel_command,
+                'sites': run_sites_command,
+                'export': run_export_command,
+                'scenarios': run_scenarios_command,
+                'project': run_project_command,
+                'bubble': run_bubble_command}
+    if args.command in commands:
+        bracket = bracket_from_selection(outputs['parse'], outputs['select'],
+                                         csv_path=args.csv)
+        commands[args.command](args, bracket)
+        return
 
+    print(f'Bracket PDF saved to: {outputs["pdf"]}')
     if args.excel:
-        bracket.fill_bracket()
-        print('Excel bracket saved.')
-
+        print(f'Excel bracket saved to: {outputs["excel"]}')
 
 if __name__ == '__main__':
     main()
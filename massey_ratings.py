@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+
+"""
+Massey-style least-squares ratings computed from a local game results csv,
+so metrics mode doesn't have to scrape every rating.
+
+Each game is one equation
+
+    r_home - r_away + h * home_court = home_score - away_score
+
+with a rating r per team and one home court edge h, solved in the least
+squares sense. The game x team incidence matrix is kept as two index
+arrays (COO form without the values, which are all +1 and -1), so the
+normal equations are never built: their product with a vector is two
+bincounts over the games, and they are solved with Jacobi-preconditioned
+conjugate gradient. A small ridge keeps the system positive definite even
+for disconnected schedules (several seasons, or teams outside Division I)
+and pins each component's ratings near mean zero.
+
+Offense and defense follow Massey's split: the points team i scores
+against j are o_i - d_j with o + d = r, which for fixed r gives
+
+    (T + P) d = T r - f
+
+where T holds each team's games, P the games between each pair and f the
+points scored (with the home court edge taken out). It is solved the same
+way. SoS is the mean rating of a team's opponents.
+
+Updates are incremental. The games absorbed so far, the ratings and how
+far into the results csv they go are kept in a state file, so a new day of
+games appended to the csv is read on its own and both solves start from
+the previous solution, which converges in a handful of iterations instead
+of a full solve. A csv that was edited rather than appended to is rebuilt
+from scratch.
+
+The results csv has one row per game:
+
+    home, away              Team names (Massey names)
+    home_score, away_score  Final score; rows without one, or tied (e.g.
+                            0-0 placeholders), are skipped
+    neutral                 Optional, 1 for neutral-site games
+
+and other columns (e.g. date) are ignored. The ratings are registered as
+the 'lsq' ratings source, written like csv_files/massey.csv with Team,
+W-L, Rat, Off, Def, SoS and Games columns.
+"""
+
+import hashlib
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+GAMES_PATH = 'csv_files/games.csv'
+
+RATINGS_PATH = 'csv_files/lsq_ratings.csv'
+
+STATE_PATH = 'csv_files/lsq_ratings.npz'
+
+# weight of the prior pulling every unknown toward zero, in games
+RIDGE = 1e-3
+
+# relative residual the solves stop at
+TOL = 1e-10
+
+MAX_ITER = 2000
+
+
+def conjugate_gradient(matvec, rhs, x0, diag, tol=TOL, max_iter=MAX_ITER):
+    """
+    Jacobi-preconditioned conjugate gradient for a symmetric positive
+    definite system.
+
+    Inputs:
+        matvec: Callable x -> A x
+        rhs: Right-hand side
+        x0: Starting point, e.g. the previous solution
+        diag: Diagonal of A
+        tol: Stop once |rhs - A x| <= tol * |rhs|
+        max_iter: Iteration limit
+    Outputs:
+        (solution, iterations used)
+    """
+    x = np.array(x0, dtype=float)
+    norm = np.linalg.norm(rhs)
+    if norm == 0:
+        return np.zeros_like(x), 0
+    r = rhs - matvec(x)
+    z = r / diag
+    p = z.copy()
+    rz = r @ z
+    for i in range(max_iter):
+        if np.linalg.norm(r) <= tol * norm:
+            return x, i
+        ap = matvec(p)
+        alpha = rz / (p @ ap)
+        x += alpha * p
+        r -= alpha * ap
+        z = r / diag
+        rz, rz_old = r @ z, rz
+        p = z + (rz / rz_old) * p
+    return x, max_iter
+
+
+class LeastSquaresRatings(object):
+    """
+    Inputs:
+        ridge: Prior weight toward zero, in games (RIDGE)
+        tol: Relative residual of the solves (TOL)
+    """
+    _arrays = ('home', 'away', 'home_court', 'home_score', 'away_score')
+
+    def __init__(self, ridge=RIDGE, tol=TOL):
+        self.ridge = ridge
+        self.tol = tol
+        self.teams = []
+        self.index = {}
+        self.home = np.empty(0, dtype=np.int64)
+        self.away = np.empty(0, dtype=np.int64)
+        self.home_court = np.empty(0)
+        self.home_score = np.empty(0)
+        self.away_score = np.empty(0)
+
+        # ratings with the home edge last, and defense, of the last solve
+        self.solution = np.zeros(1)
+        self.defense = np.zeros(0)
+        self.iterations = (0, 0)
+
+        # how much of the results csv has been absorbed
+        self.header = b''
+        self.offset = 0
+        self.digest = hashlib.sha256().hexdigest()
+
+    @property
+    def n_teams(self):
+        return len(self.teams)
+
+    @property
+    def n_games(self):
+        return len(self.home)
+
+    @property
+    def home_edge(self):
+        return self.solution[-1]
+
+    def _team_codes(self, names):
+        codes = np.empty(len(names), dtype=np.int64)
+        for i, name in enumerate(names):
+            code = self.index.get(name)
+            if code is None:
+                code = self.index[name] = len(self.teams)
+                self.teams.append(name)
+            codes[i] = code
+        return codes
+
+    def add_games(self, games):
+        """
+        Appends games (DataFrame with home, away, home_score, away_score
+        and optionally neutral). Rows without a score or with a tied one
+        are skipped. New teams start at a rating of zero. Call solve
+        afterwards.
+        """
+        missing = [c for c in ('home', 'away', 'home_score', 'away_score')
+            if c not in games.columns]
+        if missing:
+            raise ValueError('Game results are missing column(s) {}'.format(
+                ', '.join(missing)))
+        scores = games[['home_score', 'away_score']].apply(pd.to_numeric,
+            errors='coerce')
+        # games without a score, and ties, which a finished game can't be
+        # (e.g. 0-0 placeholders for games not played yet), are left out
+        played = (scores.notna().all(axis=1) &
+            (scores['home_score'] != scores['away_score'])).values
+        games = games[played]
+        scores = scores[played]
+        if 'neutral' in games.columns:
+            neutral = games['neutral'].fillna(0).astype(int).values != 0
+        else:
+            neutral = np.zeros(len(games), dtype=bool)
+
+        n_before = self.n_teams
+        home = self._team_codes(games['home'].astype(str).str.strip().values)
+        away = self._team_codes(games['away'].astype(str).str.strip().values)
+        if (home == away).any():
+            raise ValueError('A team can\'t play itself: {}'.format(
+                self.teams[home[home == away][0]]))
+
+        self.home = np.concatenate([self.home, home])
+        self.away = np.concatenate([self.away, away])
+        self.home_court = np.concatenate([self.home_court,
+            (~neutral).astype(float)])
+        self.home_score = np.concatenate([self.home_score,
+            scores['home_score'].values.astype(float)])
+        self.away_score = np.concatenate([self.away_score,
+            scores['away_score'].values.astype(float)])
+
+        new = self.n_teams - n_before
+        self.solution = np.concatenate([self.solution[:-1], np.zeros(new),
+            self.solution[-1:]])
+        self.defense = np.concatenate([self.defense, np.zeros(new)])
+        return len(home)
+
+    # ---- normal equations ----
+
+    def _games_played(self):
+        return np.bincount(self.home, minlength=self.n_teams) + \
+            np.bincount(self.away, minlength=self.n_teams)
+
+    def _rating_matvec(self, x):
+        # (X'X + ridge) x for the incidence matrix X with the home column
+        n = self.n_teams
+        e = x[self.home] - x[self.away] + x[-1] * self.home_court
+        out = np.empty_like(x)
+        out[:n] = np.bincount(self.home, e, n) - np.bincount(self.away, e, n)
+        out[-1] = e @ self.home_court
+        return out + self.ridge * x
+
+    def _defense_matvec(self, d):
+        # (T + P + ridge) d
+        n = self.n_teams
+        s = d[self.home] + d[self.away]
+        return np.bincount(self.home, s, n) + np.bincount(self.away, s, n) + \
+            self.ridge * d
+
+    def solve(self):
+        """
+        Solves for the ratings, home edge and offense/defense split,
+        starting from the previous solution
+        """
+        n = self.n_teams
+        played = self._games_played()
+
+        margin = self.home_score - self.away_score
+        rhs = np.empty(n + 1)
+        rhs[:n] = np.bincount(self.home, margin, n) - \
+            np.bincount(self.away, margin, n)
+        rhs[-1] = margin @ self.home_court
+        diag = np.append(played, self.home_court.sum()) + self.ridge
+        self.solution, rating_iters = conjugate_gradient(self._rating_matvec,
+            rhs, self.solution, diag, tol=self.tol)
+
+        # points with the home edge taken out
+        half = self.home_edge / 2 * self.home_court
+        scored = np.bincount(self.home, self.home_score - half, n) + \
+            np.bincount(self.away, self.away_score + half, n)
+        rating = self.solution[:n]
+        self.defense, defense_iters = conjugate_gradient(self._defense_matvec,
+            played * rating - scored, self.defense, played + self.ridge,
+            tol=self.tol)
+        self.iterations = (rating_iters, defense_iters)
+        return self
+
+    def ratings(self):
+        """
+        Outputs:
+            DataFrame with Team, W-L, Rat, Off, Def, SoS and Games, best
+            rating first
+        """
+        n = self.n_teams
+        rating = self.solution[:n]
+        played = self._games_played()
+        won = self.home_score > self.away_score
+        wins = np.bincount(self.home[won], minlength=n) + \
+            np.bincount(self.away[~won], minlength=n)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sos = (np.bincount(self.home, rating[self.away], n) +
+                np.bincount(self.away, rating[self.home], n)) / played
+        df = pd.DataFrame({
+            'Team': self.teams,
+            'W-L': ['{}-{}'.format(w, g - w) for w, g in zip(wins, played)],
+            'Rat': rating,
+            'Off': rating - self.defense,
+            'Def': self.defense,
+            'SoS': sos,
+            'Games': played,
+        })
+        return df.sort_values('Rat', ascending=False).reset_index(drop=True)
+
+    # ---- incremental updates from a results csv ----
+
+    def update(self, path=GAMES_PATH):
+        """
+        Absorbs the games appended to a results csv since the last update
+        and re-solves. Starts over if the part already read has changed.
+
+        Outputs:
+            Number of games added
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        header_end = data.find(b'\n') + 1
+        if not header_end:
+            return 0
+        header = data[:header_end]
+        if self.offset and (header != self.header or
+                len(data) < self.offset or
+                hashlib.sha256(data[:self.offset]).hexdigest() != self.digest):
+            self.__init__(ridge=self.ridge, tol=self.tol)
+        if not self.offset:
+            self.header = header
+            self.offset = header_end
+
+        # only whole lines, a game being written is picked up next time
+        end = data.rfind(b'\n') + 1
+        if end <= self.offset:
+            return 0
+        games = pd.read_csv(io.BytesIO(header + data[self.offset:end]),
+            dtype={'home': str, 'away': str})
+        added = self.add_games(games)
+        self.offset = end
+        self.digest = hashlib.sha256(data[:end]).hexdigest()
+        self.solve()
+        return added
+
+    def save(self, path=STATE_PATH):
+        """
+        Writes the games, solution and read position to an .npz state file
+        """
+        np.savez(path, teams=np.array(self.teams, dtype=str),
+            solution=self.solution, defense=self.defense,
+            header=np.frombuffer(self.header, dtype=np.uint8),
+            offset=self.offset, digest=self.digest, ridge=self.ridge,
+            tol=self.tol, **{a: getattr(self, a) for a in self._arrays})
+        return path
+
+    @classmethod
+    def load(cls, path=STATE_PATH):
+        """
+        Reads a state file written by save
+        """
+        with np.load(path) as state:
+            engine = cls(ridge=float(state['ridge']), tol=float(state['tol']))
+            engine.teams = [str(t) for t in state['teams']]
+            engine.index = {t: i for i, t in enumerate(engine.teams)}
+            for a in cls._arrays:
+                setattr(engine, a, state[a])
+            engine.solution = state['solution']
+            engine.defense = state['defense']
+            engine.header = state['header'].tobytes()
+            engine.offset = int(state['offset'])
+            engine.digest = str(state['digest'])
+        return engine
+
+
+def update_ratings(games_path=GAMES_PATH, output=RATINGS_PATH,
+        state_path=STATE_PATH):
+    """
+    Brings the ratings csv up to date with the results csv, incrementally
+    when a state file from an earlier update is there. Used as the 'lsq'
+    ratings source's download, so it does nothing without a results csv.
+
+    Outputs:
+        The LeastSquaresRatings engine, or None without a results csv
+    """
+    if not os.path.isfile(games_path):
+        return None
+    if state_path is not None and os.path.isfile(state_path):
+        engine = LeastSquaresRatings.load(state_path)
+    else:
+        engine = LeastSquaresRatings()
+    engine.update(games_path)
+    engine.ratings().to_csv(output, index=False)
+    if state_path is not None:
+        engine.save(state_path)
+    return engine
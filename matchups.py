@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""
+Head-to-head matchup queries against the loaded snapshot.
+
+MatchupIndex lines up, for every team under its Massey name,
+    * the composite final rank from get_tourney_teams
+    * the standardized ratings mean from get_comp_ratings, if any ratings
+      csvs are available locally
+    * KenPom adjusted offense, defense and tempo, where available
+
+and answers any number of pairs in one vectorized pass. The predicted
+neutral-court margin uses the best data both teams have:
+
+    kenpom:    points per possession from AdjO and AdjD against the Division
+               I average, times the expected tempo
+    ratings:   difference of standardized ratings means, in points
+    composite: difference of composite strengths, in points
+
+Win probabilities come from win_model.
+"""
+
+import contextlib
+import difflib
+import io
+
+import numpy as np
+import pandas as pd
+
+from ratings import RATINGS_SOURCES
+from win_model import RATING_SD, team_strength, win_probability
+
+
+class MatchupIndex(object):
+    """
+    Inputs:
+        bracket: Bracketeer after get_tourney_teams
+        download: Whether missing ratings csvs may be downloaded
+    """
+    def __init__(self, bracket, download=False):
+        teams = bracket.team_data_df['Team'].reset_index(drop=True)
+        self.teams = teams.values
+        self.index = {t: i for i, t in enumerate(self.teams)}
+        self._lower = {t.lower(): i for i, t in enumerate(self.teams)}
+
+        summary = bracket.summary_df.set_index('Team')['final_rank']
+        self.final_rank = summary.reindex(teams).values.astype(float)
+        self.strength = team_strength(self.final_rank,
+            use_metrics=bracket.use_metrics, n_teams=len(teams))
+
+        self.rating = np.full(len(teams), np.nan)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                ratings = bracket.get_comp_ratings(download=download)
+            if ratings.shape[1] > 2:
+                self.rating = ratings['mean'].values.astype(float)
+        except KeyError:
+            pass
+
+        self.adj_o, self.adj_d, self.adj_t = (np.full(len(teams), np.nan)
+            for _ in range(3))
+        kenpom = RATINGS_SOURCES.get('kenpom')
+        df = kenpom.load(download=download) if kenpom is not None else None
+        if df is not None and {'AdjO', 'AdjD', 'AdjT'} <= set(df.columns):
+            df = df.reindex(teams)
+            self.adj_o = pd.to_numeric(df['AdjO'], errors='coerce').values
+            self.adj_d = pd.to_numeric(df['AdjD'], errors='coerce').values
+            self.adj_t = pd.to_numeric(df['AdjT'], errors='coerce').values
+
+        # Division I averages the KenPom adjustments are relative to
+        self.avg_eff = np.nanmean(self.adj_o) if np.isfinite(
+            self.adj_o).any() else np.nan
+        self.avg_tempo = np.nanmean(self.adj_t) if np.isfinite(
+            self.adj_t).any() else np.nan
+
+    def resolve(self, names):
+        """
+        Array of team indices for the given names, matched exactly or
+        ignoring case. Unknown names are -1.
+        """
+        return np.array([self.index.get(n, self._lower.get(
+            str(n).strip().lower(), -1)) for n in names], dtype=int)
+
+    def suggest(self, name, n=3):
+        """
+        Closest team names, for error messages
+        """
+        return difflib.get_close_matches(name, self.teams, n=n)
+
+    def query(self, team_a, team_b):
+        """
+        Predicted margins and win probabilities for every pair
+        (team_a[i], team_b[i]).
+
+        Outputs:
+            DataFrame with team_a, team_b, margin (points, positive favors
+            team_a), win_prob (team_a wins) and method. Pairs with an
+            unknown team have NaN results and method 'unknown'.
+        """
+        team_a = np.asarray(team_a, dtype=object)
+        team_b = np.asarray(team_b, dtype=object)
+        a, b = self.resolve(team_a), self.resolve(team_b)
+        known = (a >= 0) & (b >= 0)
+        a, b = np.where(known, a, 0), np.where(known, b, 0)
+
+        tempo = self.adj_t[a] * self.adj_t[b] / self.avg_tempo
+        kenpom = (self.adj_o[a] * self.adj_d[b] -
+            self.adj_o[b] * self.adj_d[a]) / self.avg_eff * tempo / 100.
+        ratings = (self.rating[a] - self.rating[b]) * RATING_SD
+        composite = (self.strength[a] - self.strength[b]) * RATING_SD
+
+        margin = np.where(np.isfinite(kenpom), kenpom,
+            np.where(np.isfinite(ratings), ratings, composite))
+        method = np.where(np.isfinite(kenpom), 'kenpom',
+            np.where(np.isfinite(ratings), 'ratings', 'composite'))
+        margin = np.where(known, margin, np.nan)
+        method = np.where(known, method, 'unknown')
+
+        return pd.DataFrame({
+            'team_a': team_a,
+            'team_b': team_b,
+            'margin': margin,
+            'win_prob': np.where(known, win_probability(margin), np.nan),
+            'method': method,
+        })
+
+    def query_file(self, path):
+        """
+        Answers every pair in a csv with team_a and team_b columns (or, if
+        those are missing, its first two columns)
+        """
+        pairs = pd.read_csv(path, dtype=str)
+        if {'team_a', 'team_b'} <= set(pairs.columns):
+            cols = ['team_a', 'team_b']
+        else:
+            cols = list(pairs.columns[:2])
+        return self.query(pairs[cols[0]].str.strip().values,
+            pairs[cols[1]].str.strip().values)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per-stage memory accounting with tracemalloc.
+
+Code marks its stages with stage(), which does nothing unless a
+MemoryTracker is active:
+
+    with memory.stage('comp_rankings'):
+        ...
+
+    tracker = MemoryTracker(budgets={'select': 2e6}, strict=True)
+    with tracker:
+        bracket.get_tourney_teams()
+    print(tracker.report())
+
+For every stage the tracker records the bytes still allocated when it ends
+(net) and the peak above what was allocated when it began, including any
+nested stages. Nested stage names are joined with '/', so the comp_rankings
+step inside the pipeline's select stage is 'select/comp_rankings'.
+
+tracemalloc counts allocations of the whole process, so stages running at
+the same time in other threads are counted too; Pipeline runs its stages
+one at a time while a tracker is active.
+"""
+
+import contextlib
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+_active = None
+
+
+class MemoryBudgetError(AssertionError):
+    """
+    A stage's peak allocation exceeded its budget in strict mode
+    """
+
+
+class MemoryTracker(object):
+    """
+    Inputs:
+        budgets: Dictionary of stage name -> peak bytes allowed. Names match
+            the full nested name or its last part
+        strict: If true, a stage over budget raises MemoryBudgetError when it
+            ends. Otherwise it is only flagged in the report
+    """
+    def __init__(self, budgets=None, strict=False):
+        self.budgets = dict(budgets or {})
+        self.strict = strict
+        # stage -> [calls, net bytes, peak bytes, seconds]
+        self.totals = {}
+        self._stack = []
+        self._lock = threading.RLock()
+        self._started = False
+        self._previous = None
+
+    def __enter__(self):
+        global _active
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start()
+        self._previous = _active
+        _active = self
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = self._previous
+        if self._started:
+            tracemalloc.stop()
+        return False
+
+    def budget(self, name):
+        if name in self.budgets:
+            return self.budgets[name]
+        return self.budgets.get(name.rsplit('/', 1)[-1])
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        with self._lock:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                parent = self._stack[-1]
+                parent['peak'] = max(parent['peak'], peak)
+                name = parent['name'] + '/' + name
+            tracemalloc.reset_peak()
+            frame = {'name': name, 'start': current, 'peak': current,
+                'time': time.perf_counter()}
+            self._stack.append(frame)
+        try:
+            yield
+        finally:
+            with self._lock:
+                current, peak = tracemalloc.get_traced_memory()
+                self._stack.remove(frame)
+                frame['peak'] = max(frame['peak'], peak)
+                if self._stack:
+                    parent = self._stack[-1]
+                    parent['peak'] = max(parent['peak'], frame['peak'])
+                tracemalloc.reset_peak()
+
+                net = current - frame['start']
+                stage_peak = frame['peak'] - frame['start']
+                totals = self.totals.setdefault(name, [0, 0, 0, 0.])
+                totals[0] += 1
+                totals[1] += net
+                totals[2] = max(totals[2], stage_peak)
+                totals[3] += time.perf_counter() - frame['time']
+
+            budget = self.budget(name)
+            if self.strict and budget is not None and stage_peak > budget:
+                raise MemoryBudgetError('Stage {} peaked at {:,} bytes, over '
+                    'its budget of {:,}'.format(name, stage_peak, int(budget)))
+
+    def report(self):
+        """
+        DataFrame of stage, calls, net_bytes (summed over calls),
+        peak_bytes (largest call), seconds, budget and over_budget
+        """
+        rows = []
+        for name, (calls, net, peak, seconds) in self.totals.items():
+            budget = self.budget(name)
+            rows.append({'stage': name, 'calls': calls, 'net_bytes': net,
+                'peak_bytes': peak, 'seconds': seconds, 'budget': budget,
+                'over_budget': budget is not None and peak > budget})
+        return pd.DataFrame(rows, columns=['stage', 'calls', 'net_bytes',
+            'peak_bytes', 'seconds', 'budget', 'over_budget'])
+
+
+def active():
+    """
+    The active MemoryTracker, or None
+    """
+    return _active
+
+
+def stage(name):
+    """
+    Context manager accounting for a stage in the active tracker, if any
+    """
+    if _active is None:
+        return contextlib.nullcontext()
+    return _active.stage(name)
+
+
+def parse_budgets(pairs):
+    """
+    Parses 'stage=MB' strings into a budgets dictionary in bytes
+    """
+    budgets = {}
+    for pair in pairs or []:
+        name, sep, mb = pair.partition('=')
+        if not sep:
+            raise ValueError("Budget '{}' must be in STAGE=MB format".format(
+                pair))
+        try:
+            budgets[name] = float(mb) * 1e6
+        except ValueError:
+            raise ValueError("Budget '{}' must be in STAGE=MB format, with "
+                "MB a number".format(pair)) from None
+    return budgets
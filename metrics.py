@@ -28,17 +28,32 @@ I am essentially starting from the code in bracket_picker.py and editing here.
 
 from urllib.request import urlretrieve, Request, urlopen
 from openpyxl import Workbook, load_workbook
-from scrape import download_kenpom, download_dokent, download_bpi, \
-    download_massey
+from bracket_format import BracketFormat
+from ratings import get_sources, ratings_matrix, standardize, remove_seed
 
 import numpy as np
 import pandas as pd
 import csv
 import datetime
-import warnings
-import os
 
-warnings.filterwarnings('ignore')
+import memory
+import progress
+
+# Need to tell Excel which cells get which team. Because we're
+# using 'snake' method, there are specific cells corresponding
+# to each seed and rank. Easiest way to do this is to simply
+# hard code the table in, for now. excel_import reads the same cells back
+EXCEL_PLACEMENTS = [
+    'C7', 'R7', 'R39', 'C39', 'C67', 'R67', 'R35', 'C35',
+    'C27', 'R27', 'R59', 'C59', 'C51', 'R51', 'R19', 'C19',
+    'C15', 'R15', 'R47', 'C47', 'C55', 'R55', 'R23', 'C23',
+    'C31', 'R31', 'R63', 'C63', 'C43', 'R43', 'R11', 'C11',
+    'C13', 'R13', 'R45', 'C45', 'C65', 'R65', 'R33', 'C33',
+    'C25', 'R25', 'Q71', 'Q73', 'D71', 'D73', # 11 seeds
+    'C49', 'R49', 'R17', 'C17', 'C21', 'R21', 'R53', 'C53',
+    'C61', 'R61', 'R29', 'C29', 'C37', 'R37', 'R69', 'C69',
+    'C41', 'R41', 'O71', 'O73', 'F71', 'F73'
+]
 
 def rank_calc(x, y) :
     """
@@ -57,9 +72,60 @@ def rank_calc(x, y) :
     else:
         return ((3 * x + y) / 4.)
 
-def remove_seed(s):
-    # this is needed to clean up kenpom names after tourney begins
-    return (''.join([i for i in s if not i.isdigit()])).strip()
+def weighted_rank_calc(x, y, comp_weight = 3., human_weight = 1.) :
+    """
+    rank_calc with adjustable weights for the computer and human rankings.
+    Use functools.partial to fix the weights, e.g.
+    partial(weighted_rank_calc, comp_weight=2.), which unlike a lambda can
+    be sent to worker processes.
+    """
+    if np.isnan(y) :
+        return x
+    else:
+        return ((comp_weight * x + human_weight * y) / \
+            (comp_weight + human_weight))
+
+def _to_numeric(df, columns):
+    """
+    Float array (teams x columns) of the given string columns, unparseable
+    values as NaN. All columns are converted in one pass over a single
+    array instead of column by column.
+    """
+    values = np.column_stack([df[c].to_numpy(dtype=object) for c in columns]) \
+        if columns else np.empty((len(df), 0), dtype=object)
+    numeric = pd.to_numeric(pd.Series(values.ravel(), dtype=object),
+        errors='coerce').to_numpy(dtype=float)
+    return numeric.reshape(len(df), len(columns))
+
+def _row_mean(values, weights=None):
+    """
+    (Weighted) mean of each row over its non-NaN values, NaN for empty rows
+    """
+    if weights is None:
+        weights = np.ones(values.shape[1])
+    present = ~np.isnan(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(present, values, 0.) @ weights / (present @ weights)
+
+# compare.csv columns that aren't polls: records, rank changes and Massey's
+# own composite summaries (older and newer csv layouts)
+NON_POLL_COLUMNS = ['Team', 'Conf', 'WL', 'W-L', '&Delta;', 'Rank', 'CMP',
+    'Sort', 'Mean', 'Trimmed', 'Median', 'StDev']
+
+def is_column_row(row):
+    """
+    True for the compare.csv row holding the column names, which ends the
+    variable length header section. A byte order mark in front of it (e.g.
+    of a snapshot concatenated after another) is ignored
+    """
+    return bool(row) and row[0].lstrip('\ufeff') == 'Team'
+
+def is_blank_row(row):
+    """
+    True for an empty row, like the one Massey puts between the column
+    names and the data
+    """
+    return all(c.strip() == '' for c in row)
 
 class Bracketeer(object):
     """
@@ -67,35 +133,47 @@ class Bracketeer(object):
     Tournament following a simple average of computer and human
     rankings.
     """
-    def __init__(self, csv_save_path = 'masseyratings.csv', skip_download = False):
-        self.save_path = csv_save_path
-
-
-        # List for seeding teams
-        self.seeds = np.array([
-            1,1,1,1,
-            2,2,2,2,
-            3,3,3,3,
-            4,4,4,4,
-            5,5,5,5,
-            6,6,6,6,
-            7,7,7,7,
-            8,8,8,8,
-            9,9,9,9,
-            10,10,10,10,
-            11,11,11,11,11,11,
-            12,12,12,12,
-            13,13,13,13,
-            14,14,14,14,
-            15,15,15,15,
-            16,16,16,16,16,16
-        ])
+    def __init__(self, csv_save_path = 'masseyratings.csv', skip_download = False,
+            bracket_format = None):
+        self._setup(csv_save_path, bracket_format)
 
         if not skip_download:
             self.download_csv()
         self.parse_csv()
 
-        
+    @classmethod
+    def from_dataframe(cls, team_data_df, header_data = None,
+            bracket_format = None, csv_save_path = 'masseyratings.csv'):
+        """
+        Builds a Bracketeer from an already parsed team_data_df (e.g. a cached
+        parse_csv result) without reading or downloading the csv
+        """
+        bracket = cls.__new__(cls)
+        bracket._setup(csv_save_path, bracket_format)
+        bracket.team_data_df = team_data_df
+        bracket.header_data = header_data if header_data is not None else []
+        return bracket
+
+    def _setup(self, csv_save_path, bracket_format):
+        self.save_path = csv_save_path
+
+        # selection settings, filled in by get_tourney_teams
+        self.comp_polls = None
+        self.poll_weights = None
+
+        # ratings sources for metrics mode. None uses the ratings registry;
+        # set a list of ratings.RatingsSource to read e.g. archived csvs
+        self.ratings_sources = None
+
+        # Shape of the field. Default is the 68 team NCAA bracket; any
+        # bracket_format.BracketFormat works (e.g. 32 team NIT, 96 teams)
+        if bracket_format is None:
+            bracket_format = BracketFormat()
+        self.bracket_format = bracket_format
+
+        # List for seeding teams
+        self.seeds = bracket_format.seeds
+
     def download_csv(self) :
         """
         Get the composite csv from masseyratings.com
@@ -127,7 +205,7 @@ class Bracketeer(object):
 
         i = 0 # counter of lines until Team found
         for row in data:
-            if row and row[0] == 'Team':
+            if is_column_row(row):
                 break
             i = i + 1
 
@@ -144,7 +222,7 @@ class Bracketeer(object):
         # the header if present (Massey Ratings format has one), otherwise
         # data starts immediately after the header (exported CSV format).
         data_start = 1
-        if len(team_data) > 1 and all(c.strip() == '' for c in team_data[1]):
+        if len(team_data) > 1 and is_blank_row(team_data[1]):
             data_start = 2
 
         # drop the data set in a pandas Dataframe
@@ -167,7 +245,8 @@ class Bracketeer(object):
         return pd.unique(self.team_data_df['Conf'])
     
     def get_tourney_teams (self, comp_polls = None, rank_calc_func = None,
-            conf_winners = None, use_metrics = False, human_polls = True) :
+            conf_winners = None, use_metrics = False, human_polls = True,
+            poll_weights = None) :
         """
         Analysis on the full dataset to derive the teams actually in the
         tournament
@@ -185,6 +264,11 @@ class Bracketeer(object):
                 false, uses rank data to aggregate
             human_polls: Boolean. If true, uses human polls in final 
                 computation. If false, ignores human polls
+            poll_weights: Dictionary where keys are poll abbreviations (or
+                ratings source names when use_metrics is True) and values
+                are weights in the computer average. Polls left out get
+                weight 1 and other numeric columns (NON_POLL_COLUMNS, e.g.
+                CMP) weight 0. If none, all polls are weighted equally
         """
 
         # idea here: splitting off functionality to be more modular, but I want
@@ -194,16 +278,19 @@ class Bracketeer(object):
         self.conf_winners = conf_winners # default: None
         self.use_metrics = use_metrics # default: False
         self.human_polls = human_polls # default: True
+        self.poll_weights = poll_weights # default: None
         
-        # Use a place holder dataframe for calculated means and ranks 
-        # for all teams
-        summary_df = self.team_data_df[["Team","Conf"]]
+        # Collect the calculated means and ranks for all teams, then build
+        # the summary dataframe once at the end
+        columns = {'Team': self.team_data_df['Team'].values,
+            'Conf': self.team_data_df['Conf'].values}
 
         if use_metrics is False:
             try: 
                 # returns dataframes with mean in df['mean']
-                comp_rankings = self.get_comp_rankings()
-                summary_df["comp_mean"] = comp_rankings['mean']
+                with memory.stage('comp_rankings'):
+                    comp_rankings = self.get_comp_rankings()
+                columns['comp_mean'] = comp_rankings['mean'].values
 
             except Exception as e:
                 print('Exception occured:')
@@ -212,8 +299,9 @@ class Bracketeer(object):
 
         elif use_metrics is True:
             try:
-                comp_ratings = self.get_comp_ratings()
-                summary_df["comp_mean"] = comp_ratings['mean']
+                with memory.stage('comp_ratings'):
+                    comp_ratings = self.get_comp_ratings()
+                columns['comp_mean'] = comp_ratings['mean'].values
 
             except Exception as e:
                 print('Exception occured:')
@@ -229,8 +317,9 @@ class Bracketeer(object):
             # and then averaging with ranks from mean computer ratings. May
             # change in future
             try: 
-                human_rankings = self.get_human_rankings()
-                summary_df["human_mean"] = human_rankings['mean']
+                with memory.stage('human_rankings'):
+                    human_rankings = self.get_human_rankings()
+                columns['human_mean'] = human_rankings['mean'].values
 
             except Exception as e:
                 print('Exception occured:')
@@ -238,29 +327,21 @@ class Bracketeer(object):
                 raise e
         else:
             # this will essentially make the final rankings calculation
-            # ignore any human poll inputs. Initializing a human rankings
-            # 'mean' filled with nans
-            human_rankings = pd.DataFrame(
-                data = {
-                    'mean':np.full([self.team_data_df.shape[0],],np.nan)
-                },
-                columns = ['mean']
-            )
-            summary_df["human_mean"] = human_rankings['mean']
+            # ignore any human poll inputs. A human mean filled with nans
+            columns['human_mean'] = np.full(self.team_data_df.shape[0],
+                np.nan)
 
         # Calculate the final rank using either the user-defined algorithm
         # or the default
         if rank_calc_func is None :
             rank_calc_func = rank_calc
 
-        summary_df["final_rank"] = np.vectorize(rank_calc_func)(\
-                summary_df["comp_mean"], summary_df["human_mean"])
+        columns['final_rank'] = np.vectorize(rank_calc_func,
+            otypes=[float])(columns['comp_mean'], columns['human_mean'])
 
         # Sort by calculated rank
-        if use_metrics is True:
-            summary_df.sort_values(by=['final_rank'],inplace=True,ascending=False)
-        else:
-            summary_df.sort_values(by=['final_rank'],inplace=True)
+        summary_df = pd.DataFrame(columns, index=self.team_data_df.index)\
+            .sort_values(by=['final_rank'], ascending=not use_metrics)
 
         # ----
         # Tourney rules dictate the winners of the conferences all have auto
@@ -292,22 +373,32 @@ class Bracketeer(object):
 #             auto_bid_teams = summary_df.groupby(['Conf']).head(1)['Team'].values
 
         # and we can use ~isin now to get at larges
-        n_at_large = 68 - len(auto_bid_teams)
-        at_large_teams = summary_df[~summary_df['Team'].isin(auto_bid_teams)].head(n_at_large)['Team'].values
-
-        # all 68 teams in one array
+        n_at_large = self.bracket_format.n_teams - len(auto_bid_teams)
+        if n_at_large < 0:
+            raise ValueError('{} auto bids do not fit a {} team field'.format(
+                len(auto_bid_teams), self.bracket_format.n_teams))
+        # non-auto-bid teams in rank order, once for the at larges and the
+        # first four next four
+        others = summary_df['Team'].values[
+            ~summary_df['Team'].isin(auto_bid_teams).values]
+        at_large_teams = others[:n_at_large]
+
+        # all 68 (or n_teams) teams in one array
         all_68 = np.append(auto_bid_teams,at_large_teams)
         
         self.auto_bid_teams = auto_bid_teams
         self.at_large_teams = at_large_teams
         self.all_68 = all_68
 
-        # First four next four
-        self._ffnf = summary_df[~summary_df['Team'].isin(auto_bid_teams)].iloc[36:44]['Team'].values
+        # every team's means and final rank, sorted best first
+        self.summary_df = summary_df
 
-        self.final_68 = summary_df[summary_df['Team'].isin(all_68)]
+        # First four next four: the best teams after the last at-large
+        self._ffnf = others[n_at_large:
+            n_at_large + self.bracket_format.bubble_size]
 
-        self.final_68["seed"] = self.seeds
+        self.final_68 = summary_df[summary_df['Team'].isin(all_68)]\
+            .assign(seed=self.seeds)
 
         # return the dataframe to the user
         # return self.final_68
@@ -320,29 +411,40 @@ class Bracketeer(object):
         cols_to_drop = ["WL","Rank","Mean","Trimmed","Median","StDev","AP",
             "USA"]
 
-        # create computer ranking dataframe — only drop columns that exist
-        cols_to_drop = [c for c in cols_to_drop if c in self.team_data_df.columns]
-        comp_rankings = self.team_data_df.drop(cols_to_drop,axis=1)
+        # Team and Conf never hold rankings either
+        cols_to_drop = cols_to_drop + ['Team', 'Conf']
+        available = [c for c in self.team_data_df.columns
+            if c not in cols_to_drop]
 
         # If user provides list of specific computer polls to use, subset here
         # The abbreviations will need to be used. If one desired poll isn't
         # available, then it will return a KeyError. In this case, let user 
         # know, then break out after printing all available polls.
+        # Only the columns used are converted, not the whole frame
         if self.comp_polls is not None :
-            try:
-                comp_rankings = comp_rankings[self.comp_polls]
-            except KeyError as e:
+            missing = [p for p in self.comp_polls if p not in available]
+            if missing:
                 print('One or more of the polls you tried isn\'t available\n')
-                print(comp_rankings.columns)
-                raise e
-
-        # Convert computer rankings dataframe columns to numeric where
-        # appropriate
-        comp_rankings = comp_rankings.apply(\
-            lambda x: pd.to_numeric(x, errors='coerce'))
-
-        # compute arithmetic mean of computer rankings
-        comp_rankings['mean'] = comp_rankings.mean(axis=1,numeric_only=True)
+                print(available)
+                raise KeyError('{} not in index'.format(missing))
+            polls = list(self.comp_polls)
+        else:
+            polls = available
+
+        # Convert computer rankings to numeric where appropriate
+        values = _to_numeric(self.team_data_df, polls)
+        comp_rankings = pd.DataFrame(values, index=self.team_data_df.index,
+            columns=polls)
+
+        # compute arithmetic mean of computer rankings, or the weighted mean
+        # over the polls each team is ranked in if weights were given
+        # (NaN for teams no poll ranks)
+        if self.poll_weights is None:
+            weights = np.ones(len(polls))
+        else:
+            weights = np.array([self.poll_weights.get(c,
+                0. if c in NON_POLL_COLUMNS else 1.) for c in polls])
+        comp_rankings['mean'] = _row_mean(values, weights)
 
         return comp_rankings
 
@@ -352,162 +454,66 @@ class Bracketeer(object):
         """
 
         # create human ranking dataframe
-        try:
-            human_rankings = self.team_data_df[['Team','Conf','AP','USA']]
-        except KeyError as e:
+        if not {'AP', 'USA'} <= set(self.team_data_df.columns):
             print('Human rankings are unavailable. Change human_polls to False')
             print('if desired')
-            raise e
-        
-        # remove whitespace around strings in these polls
-        human_rankings['AP'] = human_rankings['AP'].str.strip()
-        human_rankings['USA'] = human_rankings['USA'].str.strip()
-
-        # convert rankings to numeric
-        human_rankings = human_rankings.apply(\
-            lambda x: pd.to_numeric(x, errors='coerce'))
-
-        human_rankings['mean'] = human_rankings.mean(
-            axis = 1, numeric_only = True, skipna = True)
+            raise KeyError('AP and USA not in index')
+
+        # convert rankings to numeric. to_numeric ignores the whitespace
+        # around them
+        values = _to_numeric(self.team_data_df, ['AP', 'USA'])
+        human_rankings = pd.DataFrame({
+            'Team': self.team_data_df['Team'].values,
+            'Conf': self.team_data_df['Conf'].values,
+            'AP': values[:, 0],
+            'USA': values[:, 1],
+            'mean': _row_mean(values),
+        }, index=self.team_data_df.index)
 
         return human_rankings
 
-    def get_comp_ratings(self):
+    def get_comp_ratings(self, sources = None, download = True,
+            min_sources = 1):
         """
-        return raw rating data instead of rankings for specified columns
+        return raw rating data instead of rankings
 
-        right now only three available, so will basically ignore list of inputs
-        for now
+        Inputs:
+            sources: List of ratings.RatingsSource to use. If none, every
+                source in ratings_sources (default: the ratings registry)
+                whose poll abbreviation is in comp_polls is used, or all of
+                them if comp_polls is None
+            download: Boolean. If true, missing csv files are downloaded
+                (slow, includes waiting to be respectful to servers)
+            min_sources: Teams rated by fewer sources get a NaN mean
+        Outputs:
+            DataFrame aligned with team_data_df holding the standardized
+            rating from each source and their (weighted) mean in 'mean'.
+            Teams missing from a source are averaged over the sources they
+            have instead of being dropped.
         """
+        if sources is None:
+            sources = get_sources(self.comp_polls, self.ratings_sources)
+        if not sources:
+            print('None of the polls you tried have ratings sources\n')
+            print([s.poll for s in get_sources()])
+            raise KeyError('No ratings sources for {}'.format(self.comp_polls))
+
+        # all files live in csv_files/. for now, to save time re-running the
+        # code, each source only downloads if its file is not there
+        progress.note('Downloading Ratings Data')
+        matrix = ratings_matrix(self.team_data_df['Team'], sources,
+            download=download)
+        progress.note('Downloading Finished!')
+
+        z, mean = standardize(matrix, weights=self.poll_weights,
+            min_sources=min_sources)
+
+        comp_ratings = z
+        comp_ratings.insert(0, 'Team', self.team_data_df['Team'])
+        comp_ratings['mean'] = mean
 
-        # Download latest data. This includes some waiting to be respectful to
-        # servers, so display message to let user know it will take a second
-        # all files downloaded to csv_files/
-
-        # for now, to save time re-running the code, including logic to only
-        # download if file is not there.
-        print('Downloading Ratings Data')
-
-        if not os.path.isfile('csv_files/bpi.csv'):
-            download_bpi()
-        
-        if not os.path.isfile('csv_files/dokent.csv'):
-            download_dokent()
-        
-        if not os.path.isfile('csv_files/kenpom.csv'):
-            download_kenpom()
-
-        if not os.path.isfile('csv_files/massey.csv'):
-            download_massey()
-        
-        print('Downloading Finished!')
-
-        kenpom_df = pd.read_csv('csv_files/kenpom.csv',index_col=False)
-        bpi_df = pd.read_csv('csv_files/bpi.csv',index_col=False)
-        dokent_df = pd.read_csv('csv_files/dokent.csv',index_col=False)
-        massey_df = pd.read_csv('csv_files/massey.csv',index_col=False)
-        
-        # remove seed from kenpom
-        kenpom_df['Team'] = kenpom_df['Team'].map(remove_seed)
-        
-        # one big issue is that the names don't match. Ken Massey uses a
-        # database of keys and values to massage the names into a consistent
-        # format. I've implemented this similarly, using distinct csv files
-        # for every translation. I'm using massey names as my standard, and 
-        # converting the rest accordingly. The keys will be stored in 
-        # csv_files for now, and conversion will happen here. This all may be
-        # moved to makefiles or something down the road
-
-        massey_to_bpi = pd.read_csv('csv_files/names_massey-bpi.csv')
-        massey_to_dokter = pd.read_csv('csv_files/names_massey-dokter.csv')
-        massey_to_kenpom = pd.read_csv('csv_files/names_massey-kenpom.csv')
-
-        for row in zip(massey_to_kenpom['Massey'].values,
-            massey_to_kenpom['Kenpom'].values):
-            
-            massey_team = row[0]
-            kenpom_team = row[1]
-            kenpom_df.loc[kenpom_df['Team'].str.match("^%s$"%kenpom_team), \
-                'Team'] = massey_team
-        
-        for row in zip(massey_to_bpi['Massey'].values,
-            massey_to_bpi['BPI'].values):
-            
-            massey_team = row[0]
-            bpi_team = row[1]
-            bpi_df.loc[bpi_df['Team'].str.match("^%s$"%bpi_team), \
-                'Team'] = massey_team
-
-        for row in zip(massey_to_dokter['Massey'].values,
-            massey_to_dokter['Dokter'].values):
-            
-            massey_team = row[0]
-            dokent_team = row[1]
-            dokent_df.loc[dokent_df['Team'].str.match("^%s$"%dokent_team), \
-                'Team'] = massey_team
-
-        # drop unnecessary columns
-        dokent_df.drop(columns=['Unnamed: 0','Rk'],inplace=True)
-        bpi_df.drop(columns=['Unnamed: 0','Rk','Conf','W-L'],inplace=True)
-        kenpom_df.drop(columns=['Unnamed: 0','Rk','W-L'],inplace=True)
-        massey_df.drop(columns=['Unnamed: 0','W-L'],inplace=True)
-
-        # print(self.team_data_df.columns)
-        # print(dokent_df.columns)
-        # print(kenpom_df.columns)
-        # print(bpi_df.columns)
-
-        comp_ratings = self.team_data_df.merge(
-            right=dokent_df,
-            on='Team',
-            how='inner',
-            suffixes=('','_dokter'),
-            validate='one_to_one'
-        )
-
-        comp_ratings = comp_ratings.merge(
-            right=kenpom_df,
-            on='Team',
-            how='inner',
-            suffixes=('','_kenpom'),
-            validate='one_to_one'
-        )
-
-        comp_ratings = comp_ratings.merge(
-            right=bpi_df,
-            on='Team',
-            how='inner',
-            suffixes=('','_bpi'),
-            validate='one_to_one'
-        )
-
-        comp_ratings = comp_ratings.merge(
-            right=massey_df,
-            on='Team',
-            how='inner',
-            suffixes=('','_massey'),
-            validate='one_to_one'
-        )
-
-        # now standardize the summary rankings for each of the above. This is
-        # acceptable I think, because the generating functions in each case
-        # are designed to generate normal data, though the mean and variance
-        # are all different. I standardize to mean 0 and variance 1, then take
-        # the mean.
-        comp_ratings['BPI'] = (comp_ratings['BPI'] - \
-            comp_ratings['BPI'].mean()) / comp_ratings['BPI'].std()
-        comp_ratings['AdjEM'] = (comp_ratings['AdjEM'] - \
-            comp_ratings['AdjEM'].mean()) / comp_ratings['AdjEM'].std()
-        comp_ratings['power'] = (comp_ratings['power'] - \
-            comp_ratings['power'].mean()) / comp_ratings['power'].std()
-        comp_ratings['Rat'] = (comp_ratings['Rat'] - \
-            comp_ratings['Rat'].mean()) / comp_ratings['Rat'].std()
-
-        comp_ratings['mean'] = \
-            comp_ratings[['BPI','AdjEM','power','Rat']].mean(axis=1)
-        
         return comp_ratings
-        
+
     def _replace_auto_bid(self,conf_winners,auto_bid_teams):
         """
         Replaces auto bid assumptions with actual winners. Winners expected
@@ -516,47 +522,44 @@ class Bracketeer(object):
         the top ranked team in each conference is present. Returns a list
         of updated auto bid teams.
         """
+        # work on the team array, not the slice of summary_df it came from
+        teams = auto_bid_teams['Team'].to_numpy(copy=True)
+        confs = auto_bid_teams['Conf'].values
         try:
             for conf, team in conf_winners.items():
                 if team is not None:
-                    auto_bid_teams.loc[auto_bid_teams['Conf']==conf, 'Team'] = team
+                    teams[confs == conf] = team
             
         except Exception as e:
             print('it failed')
             raise(e)
             
-        return auto_bid_teams['Team'].values
-
-    def fill_bracket(self) :
-        # Need to tell Excel which cells get which team. Because we're 
-        # using 'snake' method, there are specific cells corresponding
-        # to each seed and rank. Easiest way to do this is to simply
-        # hard code the table in, for now
-        excel_placements = [
-            'C7', 'R7', 'R39', 'C39', 'C67', 'R67', 'R35', 'C35', 
-            'C27', 'R27', 'R59', 'C59', 'C51', 'R51', 'R19', 'C19',
-            'C15', 'R15', 'R47', 'C47', 'C55', 'R55', 'R23', 'C23',
-            'C31', 'R31', 'R63', 'C63', 'C43', 'R43', 'R11', 'C11',
-            'C13', 'R13', 'R45', 'C45', 'C65', 'R65', 'R33', 'C33',
-            'C25', 'R25', 'Q71', 'Q73', 'D71', 'D73', # 11 seeds
-            'C49', 'R49', 'R17', 'C17', 'C21', 'R21', 'R53', 'C53',
-            'C61', 'R61', 'R29', 'C29', 'C37', 'R37', 'R69', 'C69',
-            'C41', 'R41', 'O71', 'O73', 'F71', 'F73'
-        ]
-
-        # append that to our final_68 dataframe
-        self.final_68['excel'] = excel_placements
-
-        # input to the workbook. There is one set up called 'bracket.xlsx'
+        return teams
+
+    def fill_bracket(self, save_file = None) :
+        """
+        Writes the field into an Excel bracket.
+
+        Inputs:
+            save_file: Path of the workbook. Default: bracket<date>.xlsx
+        """
+        if not self.bracket_format.is_default:
+            raise ValueError('The Excel template only fits the 68 team '
+                'bracket. Use save_bracket_pdf for other formats')
+
+        # input to the workbook. There is one set up called 'bracket.xlsx'.
+        # final_68 is left as it is
         wb = Workbook()
         ws = wb.active
-        for index, row in self.final_68.iterrows():
-            ws[row['excel']] = row['Team']
+        for cell, team in zip(EXCEL_PLACEMENTS, self.final_68['Team']):
+            ws[cell] = team
 
         # get today's date, save bracket
-        today = str(datetime.date.today())
-        save_file = 'bracket' + today + '.xlsx'
+        if save_file is None:
+            today = str(datetime.date.today())
+            save_file = 'bracket' + today + '.xlsx'
         wb.save(save_file)
+        return save_file
 
     def save_bracket_pdf(self, output_path=None, title=None):
         """
@@ -567,4 +570,5 @@ class Bracketeer(object):
             title: Title text at the top of the bracket
         """
         from bracket_pdf import generate_bracket_pdf
-        return generate_bracket_pdf(self.final_68, output_path, title)
\ No newline at end of file
+        return generate_bracket_pdf(self.final_68, output_path, title,
+            self.bracket_format)
\ No newline at end of file
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fit per-poll weights and the computer/human mix to historical committee
+seeding.
+
+Seasons use the backtest layout (root/<season>/compare.csv + field.csv).
+The composite get_tourney_teams computes with poll_weights and
+weighted_rank_calc is
+
+    comp = sum_p w_p r_p / sum_p w_p       over the polls ranking the team
+    rank = a comp + (1 - a) human          (comp alone without human ranks)
+
+Seed lines come from sorting that composite, which has no useful gradient,
+so the fit minimizes a smooth surrogate instead: a logistic loss on every
+pair of teams the committee ordered, penalizing the composite for ranking
+the worse-seeded team ahead,
+
+    sum over (i better than j) of log(1 + exp((rank_i - rank_j) / tau))
+
+over pairs of field teams on different seed lines and pairs of (at-large
+team in, bubble team out). The loss and its gradient are matrix products
+over each season's team x poll matrix. Weights are fitted by projected
+gradient descent with backtracking (w >= 0, scaled to mean 1, 0 <= a <= 1)
+with an L2 penalty pulling weights toward uniform.
+
+Cross-validation leaves one season out per fold; folds are fitted in
+parallel worker processes and scored on the held-out season with the real
+selection code via backtest.run_season. The output is a config usable by
+backtest, --weights-config and get_tourney_teams (via
+backtest.config_kwargs).
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import contextlib
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import progress
+from backtest import find_seasons, load_field, run_season
+from metrics import Bracketeer
+from poll_analysis import NON_POLL_COLUMNS
+
+# rank units over which a pair's ordering goes from penalized to not
+TEMPERATURE = 2.
+
+# non-selected teams, best first by uniform composite, paired with the
+# at-large teams
+BUBBLE_OUT = 12
+
+# relative weight of the bubble pairs against the seeding pairs
+BUBBLE_WEIGHT = 2.
+
+
+class SeasonData(object):
+    """
+    Arrays for one season.
+
+    Inputs:
+        season_dir: Directory with compare.csv and field.csv
+    """
+    def __init__(self, season_dir):
+        self.season = os.path.basename(os.path.normpath(season_dir))
+        with contextlib.redirect_stdout(io.StringIO()):
+            bracket = Bracketeer(os.path.join(season_dir, 'compare.csv'),
+                skip_download=True)
+        df = bracket.team_data_df
+        comp = bracket.get_comp_rankings().drop(columns='mean')
+        comp = comp.dropna(axis=1, how='all')
+        # polls only, as in poll_analysis; get_comp_rankings leaves the
+        # other numeric columns out once poll_weights are given
+        comp = comp[[c for c in comp.columns if c not in NON_POLL_COLUMNS]]
+        self.polls = list(comp.columns)
+
+        values = comp.values.astype(float)
+        self.mask = ~np.isnan(values)
+        self.ranks = np.where(self.mask, values, 0.)
+
+        if {'AP', 'USA'} <= set(df.columns):
+            with contextlib.redirect_stdout(io.StringIO()):
+                human = bracket.get_human_rankings()['mean'].values
+        else:
+            human = np.full(len(df), np.nan)
+        self.has_human = ~np.isnan(human)
+        self.human = np.where(self.has_human, human, 0.)
+
+        ranked = self.mask.any(axis=1)
+        self.teams = df['Team'].values
+        self.pairs, self.pair_weights = self._pairs(load_field(season_dir),
+            df['Conf'].values, ranked)
+
+    def _pairs(self, field, confs, ranked):
+        seeds = dict(zip(field['Team'], field['seed']))
+        index = {t: i for i, t in enumerate(self.teams)}
+        in_field = np.array([t in seeds and ranked[index[t]]
+            for t in self.teams])
+        idx = np.flatnonzero(in_field)
+        seed = np.array([seeds[self.teams[i]] for i in idx], dtype=float)
+
+        # field teams on different seed lines
+        better = seed[:, None] < seed[None, :]
+        i, j = np.nonzero(better)
+        pairs = [np.column_stack([idx[i], idx[j]])]
+        weights = [np.ones(len(i))]
+
+        # at-large teams against the best teams left out. Without a bid
+        # column, teams alone in the field from their conference are taken
+        # as auto bids
+        if field['bid'].notna().any():
+            bids = dict(zip(field['Team'], field['bid']))
+            at_large = np.array([bids.get(self.teams[k]) == 'at-large'
+                for k in idx])
+        else:
+            field_confs = pd.Series(confs[idx])
+            at_large = field_confs.map(field_confs.value_counts()).values > 1
+        uniform = np.where(self.mask, self.ranks, np.nan)
+        with np.errstate(invalid='ignore'):
+            uniform = np.nanmean(uniform, axis=1)
+        out = np.flatnonzero(~in_field & ranked)
+        out = out[np.argsort(uniform[out])[:BUBBLE_OUT]]
+        ins = idx[at_large]
+        if len(ins) and len(out):
+            a, b = np.meshgrid(ins, out, indexing='ij')
+            pairs.append(np.column_stack([a.ravel(), b.ravel()]))
+            weights.append(np.full(a.size, BUBBLE_WEIGHT))
+
+        return np.concatenate(pairs).astype(int), np.concatenate(weights)
+
+    def composite(self, w, alpha):
+        """
+        Composite rank of every team and its derivatives with respect to the
+        poll weights (team x poll) and alpha
+        """
+        denom = self.mask @ w
+        denom = np.where(denom > 0, denom, np.nan)
+        comp = (self.ranks @ w) / denom
+        d_comp = (self.ranks - comp[:, None] * self.mask) / denom[:, None]
+
+        scale = np.where(self.has_human, alpha, 1.)
+        rank = np.where(self.has_human,
+            alpha * comp + (1. - alpha) * self.human, comp)
+        d_w = scale[:, None] * d_comp
+        d_alpha = np.where(self.has_human, comp - self.human, 0.)
+        return rank, d_w, d_alpha
+
+    def loss(self, w, alpha, tau=TEMPERATURE):
+        """
+        Mean pairwise logistic loss and its gradients
+        """
+        rank, d_w, d_alpha = self.composite(w, alpha)
+        i, j = self.pairs[:, 0], self.pairs[:, 1]
+        z = (rank[i] - rank[j]) / tau
+        valid = np.isfinite(z)
+        z = np.where(valid, z, 0.)
+        pw = self.pair_weights * valid
+        total = pw.sum()
+
+        loss = (pw * np.logaddexp(0., z)).sum() / total
+        g_pair = pw / (1. + np.exp(-z)) / tau / total
+        g_rank = np.bincount(i, g_pair, len(rank)) - \
+            np.bincount(j, g_pair, len(rank))
+        g_rank = np.nan_to_num(g_rank)
+        d_w = np.nan_to_num(d_w)
+        d_alpha = np.nan_to_num(d_alpha)
+        return loss, g_rank @ d_w, g_rank @ d_alpha
+
+
+def _objective(seasons, polls, theta, reg):
+    """
+    Total loss over seasons of theta = (poll weights..., alpha), plus the L2
+    penalty toward uniform weights
+    """
+    w_all, alpha = theta[:-1], theta[-1]
+    loss = reg * ((w_all - 1.) ** 2).sum()
+    grad = np.zeros_like(theta)
+    grad[:-1] = 2. * reg * (w_all - 1.)
+    for season in seasons:
+        cols = [polls.index(p) for p in season.polls]
+        l, g_w, g_a = season.loss(w_all[cols], alpha)
+        loss += l / len(seasons)
+        np.add.at(grad, cols, g_w / len(seasons))
+        grad[-1] += g_a / len(seasons)
+    return loss, grad
+
+
+def _project(theta):
+    theta = theta.copy()
+    theta[:-1] = np.maximum(theta[:-1], 0.)
+    mean = theta[:-1].mean()
+    if mean > 0:
+        theta[:-1] /= mean
+    theta[-1] = np.clip(theta[-1], 0., 1.)
+    return theta
+
+
+def fit(seasons, reg=0.001, alpha=0.75, max_iter=300, tol=1e-7):
+    """
+    Fits poll weights and the computer share alpha by projected gradient
+    descent with backtracking.
+
+    Inputs:
+        seasons: List of SeasonData
+        reg: L2 penalty on the distance of the weights from uniform
+        alpha: Starting computer share (rank_calc uses 3:1, i.e. 0.75)
+    Outputs:
+        Dictionary with poll_weights, alpha and the final loss
+    """
+    polls = sorted({p for s in seasons for p in s.polls})
+    theta = np.concatenate([np.ones(len(polls)), [alpha]])
+    loss, grad = _objective(seasons, polls, theta, reg)
+    step = 1.
+    for _ in range(max_iter):
+        while True:
+            candidate = _project(theta - step * grad)
+            new_loss, new_grad = _objective(seasons, polls, candidate, reg)
+            if new_loss <= loss - 1e-4 * grad @ (theta - candidate) or \
+                    step < 1e-10:
+                break
+            step /= 2.
+        done = loss - new_loss < tol
+        theta, loss, grad = candidate, new_loss, new_grad
+        step *= 2.
+        if done:
+            break
+
+    return {'poll_weights': dict(zip(polls, theta[:-1].round(6))),
+        'alpha': float(theta[-1]), 'loss': float(loss)}
+
+
+def to_config(fitted, seasons, name='fitted'):
+    """
+    Turns a fit into a backtest / get_tourney_teams config. Only polls are
+    weighted; with poll_weights set, get_comp_rankings leaves the other
+    numeric columns (NON_POLL_COLUMNS) out of the average.
+    """
+    weights = {p: float(w) for p, w in fitted['poll_weights'].items()
+        if p not in NON_POLL_COLUMNS}
+    config = {'name': name, 'poll_weights': weights,
+        'comp_weight': round(fitted['alpha'], 6),
+        'human_weight': round(1. - fitted['alpha'], 6)}
+    if not any(s.has_human.any() for s in seasons):
+        config['human_polls'] = False
+    return config
+
+
+def _fit_fold(args):
+    season_dirs, held_out, reg = args
+    train = [SeasonData(d) for d in season_dirs if d != held_out]
+    fitted = fit(train, reg=reg)
+    config = to_config(fitted, train, name='fold')
+    default = {'name': 'default'}
+    if 'human_polls' in config:
+        default['human_polls'] = config['human_polls']
+    row = run_season(held_out, [config, default])
+    return {
+        'season': os.path.basename(os.path.normpath(held_out)),
+        'train_loss': fitted['loss'],
+        'seed_error': row[0].get('seed_error'),
+        'default_seed_error': row[1].get('seed_error'),
+        'field_overlap': row[0].get('field_overlap'),
+        'default_field_overlap': row[1].get('field_overlap'),
+    }
+
+
+def optimize(root, reg=0.001, cross_validate=True, max_workers=None):
+    """
+    Fits weights on every season under root, with leave-one-season-out
+    cross-validation fitted in parallel.
+
+    Outputs:
+        (config dictionary, DataFrame of cross-validation results or None)
+    """
+    season_dirs = find_seasons(root)
+    if not season_dirs:
+        raise ValueError('No seasons with compare.csv and field.csv found in'
+            ' {}'.format(root))
+
+    cv = None
+    if cross_validate and len(season_dirs) > 1:
+        jobs = [(season_dirs, d, reg) for d in season_dirs]
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            cv = pd.DataFrame(list(progress.track(pool.map(_fit_fold, jobs),
+                'Cross-validation folds', total=len(jobs))))
+
+    seasons = [SeasonData(d) for d in season_dirs]
+    fitted = fit(seasons, reg=reg)
+    config = to_config(fitted, seasons)
+    config['train_loss'] = fitted['loss']
+    if cv is not None:
+        config['cv_seed_error'] = float(cv['seed_error'].mean())
+        config['cv_default_seed_error'] = float(
+            cv['default_seed_error'].mean())
+    return config, cv
+
+
+def load_weights_config(path):
+    """
+    Reads a config written by optimize (or any single backtest config)
+    """
+    with open(path) as f:
+        config = json.load(f)
+    if isinstance(config, list):
+        config = config[0]
+    return config
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cached stage graph for the download -> parse -> select -> render pipeline.
+
+Each stage declares the stages it depends on, the settings it uses and the
+files it reads. Its fingerprint is a sha256 over its name, settings, the
+source code it runs, the contents of the files it reads and the fingerprints
+of its dependencies. Outputs are pickled under the cache directory by
+fingerprint, so a rerun only executes stages whose fingerprint changed:
+a new --title re-renders the PDF from the cached field without parsing or
+seeding again, and an unchanged download leaves every later stage cached.
+
+Stages whose dependencies are done run concurrently in a thread pool, so the
+PDF and Excel exports render side by side. While a memory.MemoryTracker is
+active, stages run one at a time so each one's allocations can be told
+apart.
+
+    pipe = bracket_pipeline(csv_path='masseyratings.csv', skip_download=True,
+        selection={'human_polls': False}, pdf={'title': 'My Bracket'})
+    outputs = pipe.run()
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import time
+
+from bracket_format import BracketFormat
+
+import memory
+
+# bump to invalidate every cached output, e.g. after changing pickled types
+CACHE_VERSION = 1
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def file_hash(path, _memo={}):
+    """
+    sha256 of a file's contents, or 'missing'. Memoized on (path, mtime,
+    size) so files are only read again when they change.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 'missing'
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    if key not in _memo:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        _memo[key] = h.hexdigest()
+    return _memo[key]
+
+
+def _source(module):
+    return os.path.join(_HERE, module + '.py')
+
+
+class Stage(object):
+    """
+    One step of the pipeline.
+
+    Inputs:
+        name: Unique stage name
+        func: Callable func(params, inputs) returning the stage output, where
+            inputs maps each dependency name to its output
+        deps: Names of the stages whose outputs func needs
+        params: JSON serializable settings, part of the fingerprint
+        files: Callable params -> paths the stage reads. Their contents are
+            part of the fingerprint, read once the dependencies have run
+        code: Modules whose source is part of the fingerprint
+        outputs: Callable output -> paths the stage writes. A cached result
+            is only reused while those files are unchanged
+        cache: False for stages that must run every time, such as downloads
+    """
+    def __init__(self, name, func, deps=(), params=None, files=None,
+            code=(), outputs=None, cache=True):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.params = params or {}
+        self.files = files
+        self.code = list(code)
+        self.outputs = outputs
+        self.cache = cache
+
+    def fingerprint(self, dep_keys):
+        record = {
+            'version': CACHE_VERSION,
+            'stage': self.name,
+            'params': self.params,
+            'deps': [dep_keys[d] for d in self.deps],
+            'code': [file_hash(_source(m)) for m in self.code],
+            'files': {p: file_hash(p) for p in
+                (self.files(self.params) if self.files else [])},
+        }
+        blob = json.dumps(record, sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class Pipeline(object):
+    """
+    Executes a graph of stages, reusing cached outputs of stages that are
+    up to date.
+
+    Inputs:
+        stages: List of Stage, dependencies anywhere in the list
+        cache_dir: Directory for cached outputs. None disables the cache
+        max_workers: Threads for stages that can run concurrently
+    """
+    def __init__(self, stages, cache_dir='.cache', max_workers=4):
+        self.stages = {s.name: s for s in stages}
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+
+        # (stage, 'ran' / 'cached', seconds) for the last run
+        self.report = []
+
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise KeyError('{} depends on unknown stage {}'.format(
+                        stage.name, dep))
+
+    def _needed(self, targets):
+        needed = set()
+        todo = list(targets)
+        while todo:
+            name = todo.pop()
+            if name not in needed:
+                needed.add(name)
+                todo.extend(self.stages[name].deps)
+        return needed
+
+    def _cache_path(self, name, key):
+        return os.path.join(self.cache_dir, '{}-{}.pkl'.format(name, key))
+
+    def _load(self, name, key):
+        """
+        Returns the cache path of a stage's output, or None if it is missing
+        or its output files changed. Only the small header of output file
+        hashes is read here; the output itself is unpickled when needed.
+        """
+        if self.cache_dir is None:
+            return None
+        path = self._cache_path(name, key)
+        try:
+            with open(path, 'rb') as f:
+                files = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        for p, h in files.items():
+            if file_hash(p) != h:
+                return None
+        return path
+
+    @staticmethod
+    def _call(stage, inputs):
+        with memory.stage(stage.name):
+            return stage.func(stage.params, inputs)
+
+    @staticmethod
+    def _read_output(path):
+        with open(path, 'rb') as f:
+            pickle.load(f)
+            return pickle.load(f)
+
+    def _save(self, name, key, output):
+        if self.cache_dir is None:
+            return
+        stage = self.stages[name]
+        files = stage.outputs(output) if stage.outputs else []
+        files = {p: file_hash(p) for p in files}
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cache_path(name, key)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(files, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+        # drop outputs of older fingerprints of the stage
+        prefix = name + '-'
+        for old in os.listdir(self.cache_dir):
+            if old.startswith(prefix) and old.endswith('.pkl') and \
+                    old != os.path.basename(path):
+                os.remove(os.path.join(self.cache_dir, old))
+
+    def run(self, targets=None):
+        """
+        Brings the target stages (default: all) up to date.
+
+        Outputs:
+            Dictionary of stage name -> output for the targets. Outputs of
+            cached dependencies that no stale stage needs are never loaded
+        """
+        if targets is None:
+            targets = list(self.stages)
+        needed = self._needed(targets)
+        self.report = []
+
+        keys = {}
+        cached = {}
+        outputs = {}
+        pending = set(needed)
+        running = {}
+
+        def output_of(name):
+            if name not in outputs:
+                outputs[name] = self._read_output(cached[name])
+            return outputs[name]
+
+        workers = 1 if memory.active() is not None else self.max_workers
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while pending or running:
+                ready = [n for n in pending
+                    if all(d in keys for d in self.stages[n].deps)]
+                if not ready and not running:
+                    raise ValueError('Dependency cycle between {}'.format(
+                        sorted(pending)))
+                for name in sorted(ready):
+                    pending.discard(name)
+                    stage = self.stages[name]
+                    key = stage.fingerprint(keys)
+                    path = self._load(name, key) if stage.cache else None
+                    if path is not None:
+                        keys[name] = key
+                        cached[name] = path
+                        self.report.append((name, 'cached', 0.))
+                        continue
+                    running[name] = (key, time.perf_counter(),
+                        pool.submit(self._call, stage,
+                            {d: output_of(d) for d in stage.deps}))
+
+                if not running:
+                    continue
+                done, _ = wait([r[2] for r in running.values()],
+                    return_when=FIRST_COMPLETED)
+                for name in [n for n, r in running.items() if r[2] in done]:
+                    key, start, future = running.pop(name)
+                    output = future.result()
+                    if self.stages[name].cache:
+                        self._save(name, key, output)
+                    keys[name] = key
+                    outputs[name] = output
+                    self.report.append((name, 'ran',
+                        time.perf_counter() - start))
+
+        return {name: output_of(name) for name in targets}
+
+
+# ---- bracket stages ----
+
+def _download(params, inputs):
+    if not params['skip_download']:
+        from metrics import Bracketeer
+        bracket = Bracketeer.__new__(Bracketeer)
+        bracket.save_path = params['csv_path']
+        bracket.download_csv()
+    return params['csv_path']
+
+
+def _parse(params, inputs):
+    from metrics import Bracketeer
+    bracket = Bracketeer.__new__(Bracketeer)
+    bracket.save_path = inputs['download']
+    bracket.parse_csv()
+    return {'team_data_df': bracket.team_data_df,
+        'header_data': bracket.header_data}
+
+
+def bracket_from_selection(parsed, selection, csv_path='masseyratings.csv'):
+    """
+    Rebuilds a Bracketeer holding a cached selection, as after
+    get_tourney_teams
+    """
+    from metrics import Bracketeer
+    bracket = Bracketeer.from_dataframe(parsed['team_data_df'],
+        parsed['header_data'], BracketFormat(**selection['format']),
+        csv_save_path=csv_path)
+    for attr, value in selection['attrs'].items():
+        setattr(bracket, attr, value.copy() if hasattr(value, 'copy')
+            else value)
+    return bracket
+
+
+# Bracketeer attributes set by get_tourney_teams that later stages use
+_SELECTION_ATTRS = ['comp_polls', 'conf_winners', 'use_metrics',
+    'human_polls', 'poll_weights', 'auto_bid_teams', 'at_large_teams',
+    'all_68', '_ffnf', 'final_68', 'summary_df']
+
+
+def _select(params, inputs):
+    from backtest import config_kwargs
+    from metrics import Bracketeer
+    parsed = inputs['parse']
+    # get_tourney_teams doesn't modify team_data_df, so the parsed frame is
+    # used as it is
+    bracket = Bracketeer.from_dataframe(parsed['team_data_df'],
+        parsed['header_data'], BracketFormat(**params['format']))
+    selection = dict(params['selection'])
+    kwargs = config_kwargs(selection)
+    kwargs.update({k: v for k, v in selection.items()
+        if k not in ('comp_weight', 'human_weight')})
+    bracket.get_tourney_teams(**kwargs)
+    return {'format': params['format'],
+        'attrs': {a: getattr(bracket, a) for a in _SELECTION_ATTRS}}
+
+
+def _selection_files(params):
+    """
+    Ratings csvs read in metrics mode, and the files computed ones come from
+    """
+    if not params['selection'].get('use_metrics'):
+        return []
+    from ratings import get_sources
+    sources = get_sources(params['selection'].get('comp_polls'))
+    return [s.path for s in sources] + [s.derived_from for s in sources
+        if s.derived_from is not None]
+
+
+def _render_pdf(params, inputs):
+    bracket = bracket_from_selection(inputs['parse'], inputs['select'])
+    return bracket.save_bracket_pdf(output_path=params['output_path'],
+        title=params['title'])
+
+
+def _render_excel(params, inputs):
+    bracket = bracket_from_selection(inputs['parse'], inputs['select'])
+    return bracket.fill_bracket(save_file=params['save_file'])
+
+
+def bracket_pipeline(csv_path='masseyratings.csv', skip_download=False,
+        bracket_format=None, selection=None, pdf=None, excel=None,
+        cache_dir='.cache', max_workers=4):
+    """
+    Builds the standard bracket pipeline.
+
+    Inputs:
+        csv_path: Massey compare.csv location
+        skip_download: Use the existing csv instead of downloading it
+        bracket_format: Dictionary of BracketFormat arguments
+        selection: Dictionary of get_tourney_teams arguments (JSON
+            serializable, so no custom rank_calc_func). comp_weight and
+            human_weight select weighted_rank_calc, as in backtest configs
+        pdf: Dictionary with output_path and title for the PDF, or None to
+            skip it
+        excel: Dictionary with save_file for the Excel bracket, or None to
+            skip it
+        cache_dir: Directory for cached outputs. None disables caching
+    """
+    fmt = bracket_format or {}
+    selection = selection or {}
+    today = datetime.date.today().isoformat()
+
+    stages = [
+        Stage('download', _download, cache=False,
+            params={'csv_path': csv_path, 'skip_download': skip_download}),
+        Stage('parse', _parse, deps=['download'], code=['metrics'],
+            files=lambda p: [csv_path]),
+        Stage('select', _select, deps=['parse'],
+            params={'format': fmt, 'selection': selection},
+            files=_selection_files,
+            code=['metrics', 'ratings', 'bracket_format', 'backtest',
+                'massey_ratings']),
+    ]
+    if pdf is not None:
+        pdf = dict(pdf)
+        if pdf.get('output_path') is None:
+            pdf['output_path'] = 'brackets/bracket_{}.pdf'.format(today)
+        pdf.setdefault('title', None)
+        if pdf['title'] is None:
+            # the default title holds the year
+            pdf['year'] = today[:4]
+        stages.append(Stage('pdf', _render_pdf, deps=['parse', 'select'],
+            params=pdf, code=['bracket_pdf', 'bracket_format'],
+            outputs=lambda path: [path]))
+    if excel is not None:
+        excel = dict(excel)
+        if excel.get('save_file') is None:
+            excel['save_file'] = 'bracket{}.xlsx'.format(today)
+        stages.append(Stage('excel', _render_excel, deps=['parse', 'select'],
+            params=excel, code=['metrics'], outputs=lambda path: [path]))
+
+    return Pipeline(stages, cache_dir=cache_dir, max_workers=max_workers)
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+"""
+Agreement analytics across every poll in a Massey compare.csv snapshot and
+the raw ratings sources, replacing the notebook workflow behind
+plots/*_qq_plots_*.png.
+
+For a snapshot this computes
+    * Spearman and Kendall tau-b correlation matrices over all polls and
+      ratings sources. Missing ranks are handled pairwise: each pair of polls
+      is compared over the teams both of them rank
+    * per poll outlier scores against the consensus ranking
+    * normal QQ quantiles of every ratings source and the composite
+
+Kendall tau-b uses Knight's O(n log n) algorithm: sort by one ranking, then
+count discordant pairs as the inversions left in the other ranking with a
+bottom-up merge sort. Each merge level is vectorized across all of its
+blocks.
+
+Results are cached per snapshot, keyed by the contents of the compare.csv
+and the ratings files, so rerunning over a season of daily snapshots only
+analyzes the new ones.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import contextlib
+import hashlib
+import io
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+import progress
+from metrics import NON_POLL_COLUMNS, Bracketeer
+from pipeline import file_hash
+from ratings import get_sources, ratings_matrix, standardize
+
+# bump to invalidate cached analyses after changing what is computed
+CACHE_VERSION = 1
+
+# consensus ranks scored separately by outlier_scores, about the field size
+TOP_N = 68
+
+
+def poll_ranks(team_data_df):
+    """
+    Returns a team x poll DataFrame of numeric ranks for every poll column,
+    indexed by team name. Unranked teams are NaN.
+    """
+    cols = [c for c in team_data_df.columns if c not in NON_POLL_COLUMNS]
+    ranks = team_data_df[cols].apply(
+        lambda x: pd.to_numeric(x, errors='coerce'))
+    ranks.index = team_data_df['Team'].values
+    return ranks.dropna(axis=1, how='all')
+
+
+def count_inversions(y):
+    """
+    Number of pairs i < j with y[i] > y[j], by bottom-up merge sort.
+
+    At each level the array is made of sorted blocks of the current width.
+    Tagging every value with its block pair keeps all left halves in one
+    sorted array (and all right halves in another), so a single searchsorted
+    finds, for every element, how many elements of the other half of its
+    pair come before it. That gives both the inversions across the halves
+    and each element's position in the merged block.
+    """
+    n = len(y)
+    if n < 2:
+        return 0
+    # dense ranks keep the block tags small and exact
+    y = np.unique(np.asarray(y), return_inverse=True)[1].astype(np.int64)
+    span = n + 1
+    idx = np.arange(n)
+
+    swaps = 0
+    width = 1
+    while width < n:
+        block = idx // (2 * width)
+        right = (idx // width) % 2 == 1
+        base = block * 2 * width
+
+        left_keys = block[~right] * span + y[~right]
+        right_keys = block[right] * span + y[right]
+        left_block, right_block = block[~right], block[right]
+
+        # left elements <= each right element, within its own block
+        left_start = np.searchsorted(left_keys, right_block * span, 'left')
+        left_le = np.searchsorted(left_keys, right_keys, 'right') - left_start
+        left_size = np.searchsorted(left_keys, (right_block + 1) * span,
+            'left') - left_start
+        swaps += int((left_size - left_le).sum())
+
+        # right elements < each left element, within its own block
+        right_start = np.searchsorted(right_keys, left_block * span, 'left')
+        right_lt = np.searchsorted(right_keys, left_keys, 'left') - right_start
+
+        merged = np.empty_like(y)
+        merged[base[~right] + (idx[~right] - base[~right]) + right_lt] = \
+            y[~right]
+        merged[base[right] + (idx[right] - base[right] - width) + left_le] = \
+            y[right]
+        y = merged
+        width *= 2
+
+    return swaps
+
+
+def _tie_pairs(sorted_values):
+    """
+    Pairs of equal values in a sorted array (or sorted rows of a 2D array)
+    """
+    if sorted_values.ndim == 1:
+        change = np.diff(sorted_values) != 0
+    else:
+        change = np.any(np.diff(sorted_values, axis=0) != 0, axis=1)
+    bounds = np.concatenate([[0], np.flatnonzero(change) + 1,
+        [len(sorted_values)]])
+    counts = np.diff(bounds)
+    return int((counts * (counts - 1) // 2).sum())
+
+
+def kendall_tau(x, y):
+    """
+    Kendall tau-b over the entries where both x and y are present, in
+    O(n log n). Returns NaN with fewer than 2 common entries or if either
+    ranking is constant.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    present = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[present], y[present]
+    n = len(x)
+    if n < 2:
+        return np.nan
+
+    order = np.lexsort((y, x))
+    x, y = x[order], y[order]
+
+    n0 = n * (n - 1) // 2
+    x_ties = _tie_pairs(x)
+    joint_ties = _tie_pairs(np.column_stack([x, y]))
+    # pairs tied in x are sorted by y, so they add no inversions
+    discordant = count_inversions(y)
+    y_ties = _tie_pairs(np.sort(y))
+
+    denom = np.sqrt(float(n0 - x_ties) * float(n0 - y_ties))
+    if denom == 0:
+        return np.nan
+    return (n0 - x_ties - y_ties + joint_ties - 2 * discordant) / denom
+
+
+def kendall_matrix(ranks, min_periods=10):
+    """
+    Pairwise Kendall tau-b matrix of the columns of ranks
+    """
+    values = ranks.values.astype(float)
+    k = values.shape[1]
+    present = ~np.isnan(values)
+    common = present.T.astype(int) @ present.astype(int)
+
+    tau = np.eye(k)
+    for i in range(k):
+        for j in range(i + 1, k):
+            t = kendall_tau(values[:, i], values[:, j]) \
+                if common[i, j] >= min_periods else np.nan
+            tau[i, j] = tau[j, i] = t
+    return pd.DataFrame(tau, index=ranks.columns, columns=ranks.columns)
+
+
+def outlier_scores(ranks, kendall=None, top_n=TOP_N):
+    """
+    How far each poll strays from the consensus (the median rank of each
+    team across polls).
+
+    Outputs:
+        DataFrame indexed by poll with
+        teams: teams the poll ranks
+        mean_abs_dev: mean absolute difference from the consensus rank
+        top_abs_dev: the same over the consensus top_n teams, where
+            disagreement matters for selection
+        mean_tau: mean Kendall tau-b against every other poll, if given
+        robust_z: robust z-score of top_abs_dev across polls (median and
+            scaled MAD), large values flag outlier polls
+    """
+    consensus = ranks.median(axis=1).rank(method='first')
+    dev = ranks.sub(consensus, axis=0).abs()
+    top = consensus <= top_n
+
+    scores = pd.DataFrame({
+        'teams': ranks.notna().sum(),
+        'mean_abs_dev': dev.mean(),
+        'top_abs_dev': dev[top].mean(),
+    })
+    if kendall is not None:
+        tau = kendall.values.copy()
+        np.fill_diagonal(tau, np.nan)
+        scores['mean_tau'] = np.nanmean(tau, axis=1)
+
+    top_dev = scores['top_abs_dev']
+    mad = 1.4826 * (top_dev - top_dev.median()).abs().median()
+    scores['robust_z'] = (top_dev - top_dev.median()) / mad if mad else 0.
+    return scores.sort_values('robust_z', ascending=False)
+
+
+def qq_quantiles(ratings):
+    """
+    Normal QQ points for every column of ratings.
+
+    Outputs:
+        (long DataFrame with source, theoretical and sample quantiles of the
+        standardized ratings, Series of the QQ correlation per source; 1 is
+        perfectly normal)
+    """
+    inv_cdf = NormalDist().inv_cdf
+    frames = []
+    ppcc = {}
+    for col in ratings.columns:
+        sample = np.sort(ratings[col].dropna().values.astype(float))
+        n = len(sample)
+        if n < 3:
+            continue
+        sample = (sample - sample.mean()) / sample.std(ddof=1)
+        # Blom plotting positions
+        theoretical = np.array([inv_cdf((i - 0.375) / (n + 0.25))
+            for i in range(1, n + 1)])
+        frames.append(pd.DataFrame({'source': col,
+            'theoretical': theoretical, 'sample': sample}))
+        ppcc[col] = np.corrcoef(theoretical, sample)[0, 1]
+    qq = pd.concat(frames, ignore_index=True) if frames else \
+        pd.DataFrame(columns=['source', 'theoretical', 'sample'])
+    return qq, pd.Series(ppcc, name='qq_corr')
+
+
+def _snapshot_key(csv_path, sources, min_periods):
+    h = hashlib.sha256()
+    h.update('{}:{}:{}:{}'.format(CACHE_VERSION, file_hash(__file__),
+        file_hash(csv_path), min_periods).encode('utf-8'))
+    for source in sources:
+        h.update('{}:{}'.format(source.name, file_hash(source.path))
+            .encode('utf-8'))
+    return h.hexdigest()
+
+
+def analyze_snapshot(csv_path, sources=None, cache_dir='.cache',
+        min_periods=10):
+    """
+    Runs every analysis on one compare.csv snapshot.
+
+    Inputs:
+        csv_path: Massey compare.csv
+        sources: ratings.RatingsSource list to include. Only local files are
+            read, nothing is downloaded. None leaves ratings out
+        cache_dir: Directory of cached results. None disables the cache
+        min_periods: Minimum teams two polls must share to be correlated
+    Outputs:
+        Dictionary with spearman, kendall, outliers, qq and qq_corr
+    """
+    sources = sources or []
+    path = None
+    if cache_dir is not None:
+        key = _snapshot_key(csv_path, sources, min_periods)
+        path = os.path.join(cache_dir, 'poll_analysis-{}.pkl'.format(key))
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        bracket = Bracketeer(csv_path, skip_download=True)
+    ranks = poll_ranks(bracket.team_data_df)
+
+    teams = bracket.team_data_df['Team']
+    ratings = ratings_matrix(teams, sources, download=False)
+    ratings.index = teams.values
+    ratings = ratings.dropna(axis=1, how='all')
+
+    # ratings join the rank matrix with lower = better, which leaves rank
+    # correlations unchanged
+    combined = ranks.join(-ratings, rsuffix='_rating')
+
+    spearman = combined.corr(method='spearman', min_periods=min_periods)
+    kendall = kendall_matrix(combined, min_periods=min_periods)
+
+    qq_input = ratings.copy()
+    if len(ratings.columns):
+        qq_input['composite'] = standardize(ratings)[1]
+    qq, qq_corr = qq_quantiles(qq_input)
+
+    result = {
+        'spearman': spearman,
+        'kendall': kendall,
+        'outliers': outlier_scores(combined.rank(), kendall),
+        'qq': qq,
+        'qq_corr': qq_corr,
+    }
+
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    return result
+
+
+def analyze_snapshots(csv_paths, include_ratings=False, cache_dir='.cache',
+        min_periods=10, max_workers=None):
+    """
+    Analyzes many snapshots, spread over a process pool. Returns a list of
+    results in the order of csv_paths.
+    """
+    sources = get_sources() if include_ratings else []
+    if len(csv_paths) == 1:
+        return [analyze_snapshot(csv_paths[0], sources, cache_dir,
+            min_periods)]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(analyze_snapshot, p, sources, cache_dir,
+            min_periods) for p in csv_paths]
+        return [f.result() for f in progress.track(futures, 'Snapshots')]
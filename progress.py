@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+"""
+Live terminal dashboard for long operations, built on rich.
+
+Code reports progress through module functions that do nothing special
+unless a Dashboard is active, the same way memory.stage works:
+
+    for page in progress.track(range(2, 9), 'BPI pages'):
+        ...
+
+    task = progress.stage('Simulating', total=n)
+    for i in range(n):
+        ...
+        task.advance()
+    task.done()
+
+    with Dashboard():
+        run_batch(...)
+
+The dashboard shows every stage with a bar, items per second, ETA and the
+process's current memory. In hot loops advance() only adds to a counter;
+the shared display is touched at most every interval seconds, and the
+clock is only read every stride calls, with the stride adapting to the
+loop's speed. Without a terminal (e.g. output redirected to a log) it
+prints one line per finished stage instead, and in quiet mode (for cron)
+it prints nothing.
+
+note() prints a status message above the dashboard, or plainly when no
+dashboard is active, so library messages like 'Downloading Ratings Data'
+keep working outside the CLI.
+"""
+
+import os
+import sys
+import threading
+import time
+
+from rich.console import Console
+from rich.progress import BarColumn, MofNCompleteColumn, Progress, \
+    ProgressColumn, SpinnerColumn, TextColumn, TimeRemainingColumn
+from rich.text import Text
+
+_active = None
+
+
+def current_memory():
+    """
+    Resident memory of this process in bytes, or the peak if the current
+    value isn't available on this platform
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _SpeedColumn(ProgressColumn):
+    def render(self, task):
+        # recent speed while running, the average once the stage is done
+        speed = None if task.finished or task.stop_time else task.speed
+        if speed is None and task.elapsed:
+            speed = task.completed / task.elapsed
+        if speed is None:
+            return Text('-- it/s', style='progress.data.speed')
+        return Text('{:,.1f} it/s'.format(speed), style='progress.data.speed')
+
+
+class _MemoryColumn(ProgressColumn):
+    # one reading per refresh, not per task row
+    max_refresh = 1.
+
+    def render(self, task):
+        return Text('{:,.0f} MB'.format(current_memory() / 1e6),
+            style='progress.filesize')
+
+
+class Task(object):
+    """
+    One stage of a Dashboard. Use Dashboard.stage or progress.stage.
+    """
+    def __init__(self, dashboard, name, total):
+        self.dashboard = dashboard
+        self.name = name
+        self.total = total
+        self.count = 0
+        self.start = time.perf_counter()
+        self._reported = 0
+        self._next_check = 1
+        self._stride = 1
+        self._last = self.start
+        self._id = dashboard._add(self)
+
+    def advance(self, n=1):
+        """
+        Adds n finished items. Cheap enough for tight loops
+        """
+        self.count += n
+        if self.count >= self._next_check:
+            self._check()
+
+    def _check(self):
+        now = time.perf_counter()
+        elapsed = now - self._last
+        interval = self.dashboard.interval
+        if elapsed >= interval:
+            self.dashboard._update(self)
+            self._reported = self.count
+            self._last = now
+        # aim for a few clock reads per interval at the current speed
+        done = self.count - self._reported
+        if elapsed > 0 and done > 0:
+            per_interval = done / elapsed * interval
+            self._stride = max(1, min(int(per_interval / 4), 1 << 20))
+        self._next_check = self.count + self._stride
+
+    def update(self, count=None, total=None):
+        """
+        Sets the item count and/or the total directly
+        """
+        if total is not None:
+            self.total = total
+        if count is not None:
+            self.count = count
+        self.dashboard._update(self)
+
+    def done(self):
+        """
+        Marks the stage finished
+        """
+        self.dashboard._finish(self)
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.done()
+        return False
+
+
+class _NullTask(object):
+    """
+    Stand-in for a Task when no dashboard is active
+    """
+    count = 0
+
+    def advance(self, n=1):
+        pass
+
+    def update(self, count=None, total=None):
+        pass
+
+    def done(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TASK = _NullTask()
+
+
+class Dashboard(object):
+    """
+    Inputs:
+        quiet: Print nothing, for cron jobs
+        interval: Seconds between display updates of a stage
+        live: True for the live display, False for one line per finished
+            stage. Default: live if stderr is a terminal
+    """
+    def __init__(self, quiet=False, interval=0.25, live=None):
+        self.quiet = quiet
+        self.interval = interval
+        self.console = Console(stderr=True, quiet=quiet)
+        if live is None:
+            live = self.console.is_terminal
+        self.live = live and not quiet
+        self._lock = threading.Lock()
+        self._progress = None
+        self._previous = None
+
+    def __enter__(self):
+        global _active
+        if self.live:
+            self._progress = Progress(
+                SpinnerColumn(),
+                TextColumn('[progress.description]{task.description}'),
+                BarColumn(),
+                MofNCompleteColumn(),
+                _SpeedColumn(),
+                TimeRemainingColumn(),
+                _MemoryColumn(),
+                console=self.console,
+                refresh_per_second=max(1. / self.interval, 1.))
+            self._progress.start()
+        self._previous = _active
+        _active = self
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = self._previous
+        if self._progress is not None:
+            self._progress.stop()
+            self._progress = None
+        return False
+
+    def _add(self, task):
+        if self._progress is None:
+            return None
+        with self._lock:
+            return self._progress.add_task(task.name, total=task.total)
+
+    def _update(self, task):
+        if self._progress is not None:
+            with self._lock:
+                self._progress.update(task._id, completed=task.count,
+                    total=task.total)
+
+    def _finish(self, task):
+        if self._progress is not None:
+            with self._lock:
+                total = task.total if task.total is not None else task.count
+                self._progress.update(task._id, completed=task.count,
+                    total=total)
+                self._progress.stop_task(task._id)
+        elif not self.quiet:
+            elapsed = task.elapsed
+            rate = task.count / elapsed if elapsed > 0 else 0.
+            self.console.print('{}: {:,} in {:.1f} s ({:,.1f} it/s, {:,.0f} '
+                'MB)'.format(task.name, task.count, elapsed, rate,
+                current_memory() / 1e6), highlight=False)
+
+    def stage(self, name, total=None):
+        return Task(self, name, total)
+
+    def note(self, message):
+        self.console.print(message, highlight=False, markup=False)
+
+
+def active():
+    """
+    The active Dashboard, or None
+    """
+    return _active
+
+
+def stage(name, total=None):
+    """
+    A Task on the active dashboard, or a no-op stand-in
+    """
+    if _active is None:
+        return _NULL_TASK
+    return _active.stage(name, total)
+
+
+def track(iterable, name, total=None):
+    """
+    Yields from iterable, advancing a stage per item
+    """
+    if total is None and hasattr(iterable, '__len__'):
+        total = len(iterable)
+    with stage(name, total) as task:
+        for item in iterable:
+            yield item
+            task.advance()
+
+
+def note(message):
+    """
+    Prints a status message on the active dashboard, or to stdout when none
+    is active
+    """
+    if _active is None:
+        print(message)
+    else:
+        _active.note(message)
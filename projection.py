@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+"""
+Projected Selection Sunday field from simulating the rest of the season.
+
+The remaining regular-season and conference-tournament games come from a
+local schedule csv, one game per row:
+
+    id      Unique game id
+    date    Games are played in date order (any sortable text, e.g.
+            2026-03-07)
+    home    Team, or W:<id> for the winner of an earlier game (conference
+            tournament brackets)
+    away    Team or W:<id>
+    neutral Optional, 1 for neutral-site games
+    final   Optional conference name on the game that decides its auto bid
+
+Games are drawn from the win_model probabilities of the current composite
+standings, which stay fixed as the teams' true strengths. Each team's
+standing then moves with its simulated results by an Elo-like update on
+the same scale,
+
+    standing += k * (result - expected)
+
+where expected is the win probability the standings themselves give. That
+stands in for re-running every poll: the composite rank of a simulation is
+the order of the updated standings. Selection then follows
+get_tourney_teams: each conference's auto bid is its tournament final's
+winner (or its top team if the schedule has no final, or the team in
+conf_winners), the at-large bids go to the best remaining teams and the
+field is seeded in standing order.
+
+Every game of a date is played at once for a block of simulations, so the
+work is a few array operations per date. Blocks are spread over worker
+processes with independent random streams, and only per-team counts come
+back, so memory is bounded by the block size.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import progress
+from win_model import RATING_SD, team_strength, win_probability
+
+# home court edge in points
+HOME_EDGE = 3.5
+
+# standing change in rating standard deviations for a fully unexpected
+# result
+RERANK_K = 0.08
+
+# simulations per block handed to a worker
+BLOCK_SIMS = 2000
+
+# standing of teams without a composite rank, below any ranked team
+UNRANKED = -10.
+
+
+def read_schedule(path):
+    """
+    Reads and checks a schedule csv.
+
+    Outputs:
+        DataFrame with id, date, home, away, neutral and final, in the order
+        the games are played
+    """
+    schedule = pd.read_csv(path, dtype={'id': str, 'date': str, 'home': str,
+        'away': str, 'final': str})
+    missing = [c for c in ('id', 'date', 'home', 'away')
+        if c not in schedule.columns]
+    if missing:
+        raise ValueError('{} is missing column(s) {}'.format(path,
+            ', '.join(missing)))
+    if 'neutral' not in schedule.columns:
+        schedule['neutral'] = 0
+    if 'final' not in schedule.columns:
+        schedule['final'] = None
+    schedule['neutral'] = schedule['neutral'].fillna(0).astype(int)
+    schedule['home'] = schedule['home'].str.strip()
+    schedule['away'] = schedule['away'].str.strip()
+    if schedule['id'].duplicated().any():
+        raise ValueError('Duplicate game ids in {}'.format(path))
+    return schedule.sort_values('date', kind='stable').reset_index(drop=True)
+
+
+class SeasonProjection(object):
+    """
+    Inputs:
+        bracket: Bracketeer after get_tourney_teams. Its summary_df gives
+            the standings and conferences, conf_winners the decided
+            conferences
+        schedule: DataFrame from read_schedule
+        k: Standing change of a fully unexpected result (RERANK_K)
+        home_edge: Home court edge in points
+    """
+    def __init__(self, bracket, schedule, k=RERANK_K, home_edge=HOME_EDGE):
+        summary = bracket.summary_df.reset_index(drop=True)
+        self.teams = summary['Team'].values
+        self.confs = summary['Conf'].values
+        index = {t: i for i, t in enumerate(self.teams)}
+        self.k = k
+        self.home_edge = home_edge
+
+        strength = team_strength(summary['final_rank'].values,
+            use_metrics=bracket.use_metrics,
+            n_teams=len(bracket.team_data_df))
+        self.strength = np.nan_to_num(strength, nan=UNRANKED)
+
+        fmt = bracket.bracket_format
+        self.seeds = np.asarray(bracket.seeds)
+        self.n_field = fmt.n_teams
+
+        # games of each date as (home, away) codes: a team index, or
+        # -1 - g for the winner of game g
+        game_index = {}
+        dates = []
+        unknown = set()
+        for date, games in schedule.groupby('date', sort=True):
+            sides = []
+            for side in ('home', 'away'):
+                codes = []
+                for name in games[side]:
+                    if name.startswith('W:'):
+                        ref = game_index.get(name[2:])
+                        if ref is None:
+                            raise ValueError('{} refers to a game not played '
+                                'before {}'.format(name, date))
+                        codes.append(-1 - ref)
+                    elif name in index:
+                        codes.append(index[name])
+                    else:
+                        unknown.add(name)
+                        codes.append(0)
+                sides.append(np.array(codes))
+            first = len(game_index)
+            game_index.update((g, first + j)
+                for j, g in enumerate(games['id']))
+            dates.append((first, sides[0], sides[1],
+                games['neutral'].values == 0))
+        if unknown:
+            raise ValueError('Teams not in the standings: {}'.format(
+                ', '.join(sorted(unknown))))
+        self.dates = dates
+        self.n_games = len(game_index)
+
+        # auto bids: conference -> final game, decided team or the top team
+        decided = {c: index[t] for c, t in (bracket.conf_winners or {}).items()
+            if t in index}
+        finals = {}
+        for game, conf in zip(schedule['id'], schedule['final']):
+            if isinstance(conf, str) and conf.strip():
+                conf = conf.strip()
+                if conf in decided:
+                    raise ValueError('{} is decided by conf_winners but game '
+                        '{} is its final'.format(conf, game))
+                finals[conf] = game_index[game]
+        auto_confs = [self.confs[index[t]] for t in bracket.auto_bid_teams
+            if t in index]
+        self.auto = []
+        for conf in auto_confs:
+            if conf in decided:
+                self.auto.append(('team', decided[conf]))
+            elif conf in finals:
+                self.auto.append(('final', finals[conf]))
+            else:
+                self.auto.append(('top', np.flatnonzero(self.confs == conf)))
+        self.n_at_large = self.n_field - len(self.auto)
+        if self.n_at_large < 0:
+            raise ValueError('{} auto bids do not fit a {} team field'.format(
+                len(self.auto), self.n_field))
+
+    def _side(self, codes, winners):
+        # (sims, games) team indices of one side of a date's games
+        out = np.empty((len(winners), len(codes)), dtype=np.int64)
+        direct = codes >= 0
+        out[:, direct] = codes[direct]
+        for j in np.flatnonzero(~direct):
+            out[:, j] = winners[:, -1 - codes[j]]
+        return out
+
+    def simulate_block(self, n_sims, seed):
+        """
+        Simulates n_sims seasons.
+
+        Outputs:
+            Dictionary of per-team counts: auto, at_large and seed (teams x
+            seed lines)
+        """
+        rng = np.random.default_rng(seed)
+        rows = np.arange(n_sims)[:, None]
+        standing = np.tile(self.strength, (n_sims, 1))
+        winners = np.empty((n_sims, self.n_games), dtype=np.int64)
+
+        for first, home_codes, away_codes, home_court in self.dates:
+            home = self._side(home_codes, winners)
+            away = self._side(away_codes, winners)
+            edge = np.where(home_court, self.home_edge, 0.)
+            p = win_probability((self.strength[home] -
+                self.strength[away]) * RATING_SD + edge)
+            home_won = rng.random(p.shape) < p
+
+            expected = win_probability((standing[rows, home] -
+                standing[rows, away]) * RATING_SD + edge)
+            change = self.k * (home_won - expected)
+            standing[rows, home] += change
+            standing[rows, away] -= change
+            winners[:, first:first + p.shape[1]] = np.where(home_won, home,
+                away)
+
+        # auto bids
+        auto = np.zeros(standing.shape, dtype=bool)
+        flat_rows = rows[:, 0]
+        for kind, value in self.auto:
+            if kind == 'team':
+                auto[:, value] = True
+            elif kind == 'final':
+                auto[flat_rows, winners[:, value]] = True
+            else:
+                top = value[np.argmax(standing[:, value], axis=1)]
+                auto[flat_rows, top] = True
+
+        # at-large bids to the best of the rest, then the field in standing
+        # order
+        field = auto.copy()
+        if self.n_at_large:
+            rest = np.where(auto, -np.inf, standing)
+            at_large = np.argpartition(-rest, self.n_at_large - 1,
+                axis=1)[:, :self.n_at_large]
+            field[rows, at_large] = True
+        order = np.argsort(-np.where(field, standing, -np.inf), axis=1,
+            kind='stable')[:, :self.n_field]
+
+        n_teams, n_lines = len(self.teams), int(self.seeds.max())
+        lines = np.broadcast_to(self.seeds[:self.n_field] - 1, order.shape)
+        seed = np.bincount((order * n_lines + lines).ravel(),
+            minlength=n_teams * n_lines).reshape(n_teams, n_lines)
+        return {'auto': auto.sum(axis=0), 'at_large': (field & ~auto).sum(
+            axis=0), 'seed': seed}
+
+    def run(self, n_sims=10000, seed=0, max_workers=None,
+            block_sims=BLOCK_SIMS):
+        """
+        Field and seed probabilities over n_sims simulated seasons.
+
+        Inputs:
+            n_sims: Simulated seasons
+            seed: Random seed. Blocks get independent streams spawned from
+                it, so results don't depend on the number of workers
+            max_workers: Worker processes (default: all cores); 1 runs in
+                this process
+            block_sims: Simulations per block
+        Outputs:
+            DataFrame as from ScenarioEngine.compute: Team, Conf, p_auto,
+            p_at_large, p_field, expected_seed (given in the field) and
+            seed_<line> probabilities of every team that makes some field,
+            sorted by p_field
+        """
+        sizes = [min(block_sims, n_sims - start)
+            for start in range(0, n_sims, block_sims)]
+        streams = np.random.SeedSequence(seed).spawn(len(sizes))
+        totals = None
+        with progress.stage('Projecting seasons', total=n_sims) as task:
+            if max_workers == 1:
+                blocks = map(self.simulate_block, sizes, streams)
+                pool = None
+            else:
+                pool = ProcessPoolExecutor(max_workers=max_workers,
+                    initializer=_init_worker, initargs=(self,))
+                blocks = pool.map(_simulate_block, sizes, streams)
+            try:
+                for size, counts in zip(sizes, blocks):
+                    totals = counts if totals is None else {
+                        key: totals[key] + counts[key] for key in totals}
+                    task.advance(size)
+            finally:
+                if pool is not None:
+                    pool.shutdown()
+        return self._result(totals, n_sims)
+
+    def _result(self, totals, n_sims):
+        p_auto = totals['auto'] / n_sims
+        p_at_large = totals['at_large'] / n_sims
+        seed_probs = totals['seed'] / n_sims
+        p_field = p_auto + p_at_large
+        n_lines = seed_probs.shape[1]
+        result = pd.DataFrame({
+            'Team': self.teams,
+            'Conf': self.confs,
+            'p_auto': p_auto,
+            'p_at_large': p_at_large,
+            'p_field': p_field,
+        })
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result['expected_seed'] = seed_probs @ np.arange(1, n_lines + 1) \
+                / p_field
+        for line in range(n_lines):
+            result['seed_{}'.format(line + 1)] = seed_probs[:, line]
+
+        result = result[result['p_field'] > 0]
+        return result.sort_values(['p_field', 'expected_seed'],
+            ascending=[False, True]).reset_index(drop=True)
+
+    @staticmethod
+    def bubble(result):
+        """
+        Teams in play for an at-large bid: they make some but not every
+        simulated field, and some of them as an at-large
+        """
+        return result[(result['p_at_large'] > 0) &
+            (result['p_field'] < 1)].reset_index(drop=True)
+
+
+# ---- worker side ----
+
+_worker = {}
+
+
+def _init_worker(projection):
+    _worker['projection'] = projection
+
+
+def _simulate_block(n_sims, seed):
+    return _worker['projection'].simulate_block(n_sims, seed)
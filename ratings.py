@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+"""
+Registry of raw ratings sources used when ranking on metrics instead of
+Massey composite rankings.
+
+Each source declares where its csv lives, how to fetch it, which column
+holds the rating and how its team names translate to Massey names. All
+registered sources are aligned once on the Massey team index into a single
+team x source matrix, so standardizing, weighting and handling of missing
+teams happen in one vectorized pass no matter how many sources there are.
+
+Adding a source is a single call:
+
+    register_source(RatingsSource(
+        name='sagarin', poll='SAG', path='csv_files/sagarin.csv',
+        rating_col='Rating'))
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import progress
+from massey_ratings import GAMES_PATH, RATINGS_PATH, update_ratings
+from scrape import download_kenpom, download_dokent, download_bpi, \
+    download_massey
+
+
+def remove_seed(s):
+    # this is needed to clean up kenpom names after tourney begins
+    return (''.join([i for i in s if not i.isdigit()])).strip()
+
+
+class RatingsSource(object):
+    """
+    One raw ratings source.
+
+    Inputs:
+        name: Short unique name, used as the column name in the ratings
+            matrix
+        poll: Massey compare.csv abbreviation of the same system, so that
+            comp_polls selects sources in use_metrics mode (e.g. 'POM')
+        path: Location of the csv holding the ratings
+        rating_col: Column in the csv holding the rating
+        names_path: Optional csv translating Massey names to source names
+        names_col: Column of names_path holding the source names
+        download: Optional callable that (re)creates the csv at path. If
+            None the source is a local file only
+        clean_names: Optional callable applied to each team name before the
+            name translation
+        higher_is_better: False for sources where lower ratings are better
+        derived_from: Optional local file the csv is computed from by
+            download, e.g. game results. The csv is recomputed whenever
+            that file is newer
+    """
+    def __init__(self, name, poll, path, rating_col, names_path=None,
+            names_col=None, download=None, clean_names=None,
+            higher_is_better=True, derived_from=None):
+        self.name = name
+        self.poll = poll
+        self.path = path
+        self.rating_col = rating_col
+        self.names_path = names_path
+        self.names_col = names_col
+        self.download = download
+        self.clean_names = clean_names
+        self.higher_is_better = higher_is_better
+        self.derived_from = derived_from
+
+        # (mtime, DataFrame) of the last load, so repeated selections don't
+        # re-read and re-translate an unchanged csv
+        self._cache = None
+
+    def __repr__(self):
+        return 'RatingsSource({!r}, poll={!r}, path={!r})'.format(
+            self.name, self.poll, self.path)
+
+    def with_path(self, path):
+        """
+        Returns a copy of the source reading from a different csv, e.g. an
+        archived snapshot. The copy never downloads.
+        """
+        return RatingsSource(self.name, self.poll, path, self.rating_col,
+            names_path=self.names_path, names_col=self.names_col,
+            download=None, clean_names=self.clean_names,
+            higher_is_better=self.higher_is_better)
+
+    def load(self, download=True):
+        """
+        Returns the source's csv as a DataFrame indexed by Massey team name.
+        Downloads it first if missing and a downloader is available. Returns
+        None if the file is missing and download is False or impossible. A
+        csv computed from a local file (derived_from) is always rebuilt when
+        missing or older than that file, as that needs no network.
+        """
+        missing = not os.path.isfile(self.path)
+        stale = not missing and self.derived_from is not None and \
+            os.path.isfile(self.derived_from) and \
+            os.path.getmtime(self.derived_from) > os.path.getmtime(self.path)
+        if (missing or stale) and self.download is not None and (
+                download or self.derived_from is not None):
+            self.download()
+            missing = not os.path.isfile(self.path)
+        if missing:
+            return None
+
+        mtime = os.path.getmtime(self.path)
+        if self._cache is not None and self._cache[0] == mtime:
+            return self._cache[1]
+
+        df = pd.read_csv(self.path, index_col=False)
+        df = df.drop(columns=[c for c in df.columns
+            if c.startswith('Unnamed:')])
+
+        teams = df['Team'].astype(str)
+        if self.clean_names is not None:
+            teams = teams.map(self.clean_names)
+
+        # I'm using massey names as my standard, and converting the rest
+        # accordingly. The translation csvs hold one row per mismatched
+        # name, so a dict lookup replaces the old per-row regex matching
+        if self.names_path is not None:
+            names = pd.read_csv(self.names_path)
+            to_massey = dict(zip(names[self.names_col], names['Massey']))
+            teams = teams.map(lambda t: to_massey.get(t, t))
+
+        df['Team'] = teams
+        duplicated = df['Team'][df['Team'].duplicated()].unique()
+        if len(duplicated):
+            raise ValueError('{} has duplicate teams after name translation:'
+                ' {}'.format(self.name, list(duplicated)))
+
+        df = df.set_index('Team')
+        self._cache = (mtime, df)
+        return df
+
+
+# Registry, in the order columns appear in the ratings matrix
+RATINGS_SOURCES = {}
+
+
+def register_source(source):
+    """
+    Adds a source to the registry, replacing any source with the same name
+    """
+    RATINGS_SOURCES[source.name] = source
+    return source
+
+
+def get_sources(polls=None, sources=None):
+    """
+    Returns registered sources (or the given list of sources), optionally
+    only those whose poll abbreviation or name is in polls
+    """
+    if sources is None:
+        sources = list(RATINGS_SOURCES.values())
+    if polls is None:
+        return sources
+    polls = [p.upper() for p in polls]
+    return [s for s in sources
+        if s.poll.upper() in polls or s.name.upper() in polls]
+
+
+register_source(RatingsSource(
+    'kenpom', 'POM', 'csv_files/kenpom.csv', 'AdjEM',
+    names_path='csv_files/names_massey-kenpom.csv', names_col='Kenpom',
+    download=download_kenpom, clean_names=remove_seed))
+
+register_source(RatingsSource(
+    'bpi', 'EBP', 'csv_files/bpi.csv', 'BPI',
+    names_path='csv_files/names_massey-bpi.csv', names_col='BPI',
+    download=download_bpi))
+
+register_source(RatingsSource(
+    'dokent', 'DOK', 'csv_files/dokent.csv', 'power',
+    names_path='csv_files/names_massey-dokter.csv', names_col='Dokter',
+    download=download_dokent))
+
+register_source(RatingsSource(
+    'massey', 'MAS', 'csv_files/massey.csv', 'Rat',
+    download=download_massey))
+
+
+# computed locally from the game results, see massey_ratings
+register_source(RatingsSource(
+    'lsq', 'LSQ', RATINGS_PATH, 'Rat',
+    download=update_ratings, derived_from=GAMES_PATH))
+
+
+def ratings_matrix(teams, sources, download=True):
+    """
+    Aligns every source on the given team names.
+
+    Inputs:
+        teams: Series of Massey team names. Its index is kept, so the result
+            lines up with the frame the names came from
+        sources: List of RatingsSource
+        download: Whether missing csvs may be downloaded. Sources that stay
+            unavailable are left out of the matrix
+    Outputs:
+        DataFrame with one row per team and one column of raw ratings per
+        source. Teams a source doesn't cover are NaN rather than dropped.
+        Ratings are negated for sources where lower is better.
+    """
+    keys = pd.Index(teams.values)
+    columns = {}
+    for source in progress.track(sources, 'Ratings sources'):
+        df = source.load(download=download)
+        if df is None:
+            continue
+        rows = df.index.get_indexer(keys)
+        values = pd.to_numeric(df[source.rating_col], errors='coerce') \
+            .to_numpy(dtype=float)[rows]
+        values[rows == -1] = np.nan
+        columns[source.name] = values if source.higher_is_better \
+            else -values
+
+    return pd.DataFrame(columns, index=teams.index)
+
+
+def standardize(matrix, weights=None, min_sources=1):
+    """
+    Standardizes every source column to mean 0 and variance 1, then takes
+    the weighted mean across the sources each team has.
+
+    The generating functions behind each rating are designed to produce
+    normal data, though the means and variances all differ, so z-scores put
+    them on one scale.
+
+    Inputs:
+        matrix: team x source DataFrame from ratings_matrix
+        weights: Optional dict of source name -> weight. Missing sources get
+            weight 1
+        min_sources: Teams rated by fewer sources get a NaN mean
+    Outputs:
+        (z-score DataFrame, Series of weighted means)
+    """
+    values = matrix.values
+    z = (values - np.nanmean(values, axis=0)) / \
+        np.nanstd(values, axis=0, ddof=1)
+
+    w = np.ones(values.shape[1])
+    if weights is not None:
+        w = np.array([weights.get(c, 1.) for c in matrix.columns], dtype=float)
+
+    present = ~np.isnan(z)
+    w_present = present * w
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(present, z, 0.) @ w / w_present.sum(axis=1)
+    mean[present.sum(axis=1) < min_sources] = np.nan
+
+    return (pd.DataFrame(z, index=matrix.index, columns=matrix.columns),
+        pd.Series(mean, index=matrix.index))
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+Championship-week scenarios: every combination of remaining conference
+tournament winners, evaluated exactly without enumerating them.
+
+Selection in get_tourney_teams only depends on the conference winners
+through one number per team. With teams in final rank order, a team that
+doesn't win its conference gets an at-large bid when fewer than n_at_large
+non-auto-bid teams rank above it, and every field team's seed is its
+position in the field. Both follow from A, the number of auto bids won by
+teams ranked above it:
+
+    at-large bid:     position - A < n_at_large
+    field position:   A + min(position - A, n_at_large)
+
+Conference tournaments are independent, so A is a sum of independent
+Bernoullis (one per live conference: does its winner rank above the team?)
+plus a constant from the decided conferences. Its exact distribution comes
+from a Poisson-binomial dynamic program vectorized over teams, O(teams x
+conferences^2) in total instead of the product of the candidate counts.
+
+Teams that can't reach the field in any scenario (ranked too low and not a
+possible conference winner) are pruned before the dynamic program, and each
+conference's column is only rebuilt when its candidates change, so updating
+one conference after a semifinal is cheap.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class ScenarioEngine(object):
+    """
+    Inputs:
+        bracket: Bracketeer after get_tourney_teams. Its auto bids (including
+            any conf_winners) fix the conferences that aren't live
+        remaining: Dictionary of conference -> possible winners, either a list
+            of teams (equally likely) or a dict of team -> probability
+    """
+    def __init__(self, bracket, remaining=None):
+        summary = bracket.summary_df.reset_index(drop=True)
+        self.teams = summary['Team'].values
+        self.confs = summary['Conf'].values
+        self.position = {t: i for i, t in enumerate(self.teams)}
+        self.seeds = np.asarray(bracket.seeds)
+
+        self.n_at_large = bracket.bracket_format.n_teams - \
+            len(bracket.auto_bid_teams)
+
+        # current winner of every conference, from get_tourney_teams
+        self.default_winners = {self.confs[self.position[t]]: t
+            for t in bracket.auto_bid_teams if t in self.position}
+
+        # conference -> (P(winner ranks above team), P(team wins)) columns
+        self._columns = {}
+        self.live = {}
+        for conf, winners in (remaining or {}).items():
+            self.set_conference(conf, winners)
+
+    def set_conference(self, conf, winners):
+        """
+        Sets the possible winners of a live conference. A single winner
+        decides it. Only this conference's column is rebuilt.
+        """
+        if conf not in self.default_winners:
+            raise KeyError('{} has no auto bid'.format(conf))
+        if not isinstance(winners, dict):
+            winners = {t: 1. for t in winners}
+
+        probs = {}
+        for team, p in winners.items():
+            if team not in self.position:
+                raise KeyError('{} is not a team'.format(team))
+            if self.confs[self.position[team]] != conf:
+                raise ValueError('{} is not in {}'.format(team, conf))
+            if p > 0:
+                probs[team] = float(p)
+        total = sum(probs.values())
+        if total <= 0:
+            raise ValueError('{} needs a possible winner'.format(conf))
+
+        self.live[conf] = {t: p / total for t, p in probs.items()}
+        self._columns.pop(conf, None)
+
+    def decide(self, conf, team):
+        """
+        Records the winner of a conference tournament
+        """
+        self.set_conference(conf, [team])
+
+    def _column(self, conf):
+        if conf not in self._columns:
+            n = len(self.teams)
+            pos = np.array([self.position[t] for t in self.live[conf]])
+            p = np.array(list(self.live[conf].values()))
+            order = np.argsort(pos)
+            pos, p = pos[order], p[order]
+
+            # P(winner ranks above each team) via the cumulative sum over
+            # candidates sorted by position
+            cum = np.concatenate([[0.], np.cumsum(p)])
+            above = cum[np.searchsorted(pos, np.arange(n), 'left')]
+            wins = np.zeros(n)
+            wins[pos] = p
+            self._columns[conf] = (above, wins)
+        return self._columns[conf]
+
+    def compute(self):
+        """
+        Exact probabilities over every combination of live conference
+        winners.
+
+        Outputs:
+            DataFrame of teams that reach the field in some scenario, with
+            p_auto, p_at_large, p_field, expected_seed (given in the field)
+            and seed_<line> probabilities, sorted by p_field
+        """
+        n = len(self.teams)
+        position = np.arange(n)
+        live = sorted(self.live)
+        n_live = len(live)
+
+        # decided conferences are constants
+        fixed_pos = np.sort([self.position[t] for c, t in
+            self.default_winners.items() if c not in self.live])
+        fixed_above = np.searchsorted(fixed_pos, position, 'left')
+        fixed_auto = np.zeros(n, dtype=bool)
+        fixed_auto[fixed_pos] = True
+
+        above = np.zeros((n, n_live))
+        wins = np.zeros((n, n_live))
+        for j, conf in enumerate(live):
+            above[:, j], wins[:, j] = self._column(conf)
+        p_win = wins.sum(axis=1)
+
+        # Prune teams that miss the field in every scenario
+        max_above = fixed_above + (above > 0).sum(axis=1)
+        active = fixed_auto | (p_win > 0) | \
+            (position - max_above < self.n_at_large)
+        idx = np.flatnonzero(active)
+        above, wins, p_win = above[idx], wins[idx], p_win[idx]
+        pos, fixed_above, fixed_auto = position[idx], fixed_above[idx], \
+            fixed_auto[idx]
+
+        # A team's own conference enters differently: if it wins, its
+        # conference adds nothing above it. If it doesn't, the winner ranks
+        # above it with probability P(above) / P(not winning)
+        own = wins > 0
+        cond = np.zeros(len(idx))
+        has_own = own.any(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cond[has_own] = np.nan_to_num((above[own] /
+                (1. - p_win[has_own])).clip(0., 1.))
+        above = np.where(own, 0., above)
+
+        # Poisson-binomial over the other live conferences, for all teams
+        dist = np.zeros((len(idx), n_live + 1))
+        dist[:, 0] = 1.
+        for j in range(n_live):
+            p = above[:, j:j + 1]
+            dist[:, 1:] = dist[:, 1:] * (1. - p) + dist[:, :-1] * p
+            dist[:, 0] *= 1. - p[:, 0]
+        dist_lost = dist.copy()
+        dist_lost[:, 1:] = dist[:, 1:] * (1. - cond[:, None]) + \
+            dist[:, :-1] * cond[:, None]
+        dist_lost[:, 0] = dist[:, 0] * (1. - cond)
+
+        p_auto = np.where(fixed_auto, 1., p_win)
+        n_lines = int(self.seeds.max())
+        seed_probs = np.zeros((len(idx), n_lines))
+        p_at_large = np.zeros(len(idx))
+        rows = np.arange(len(idx))
+        for k in range(n_live + 1):
+            a = fixed_above + k
+            at_large = pos - a < self.n_at_large
+            field_pos = a + np.minimum(pos - a, self.n_at_large)
+            line = self.seeds[np.minimum(field_pos,
+                len(self.seeds) - 1)] - 1
+
+            w_auto = p_auto * dist[:, k]
+            w_large = (1. - p_auto) * dist_lost[:, k] * at_large
+            p_at_large += w_large
+            np.add.at(seed_probs, (rows, line), w_auto + w_large)
+
+        p_field = p_auto + p_at_large
+        result = pd.DataFrame({
+            'Team': self.teams[idx],
+            'Conf': self.confs[idx],
+            'p_auto': p_auto,
+            'p_at_large': p_at_large,
+            'p_field': p_field,
+        })
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result['expected_seed'] = seed_probs @ np.arange(1, n_lines + 1) \
+                / p_field
+        for line in range(n_lines):
+            result['seed_{}'.format(line + 1)] = seed_probs[:, line]
+
+        result = result[result['p_field'] > 0]
+        return result.sort_values(['p_field', 'expected_seed'],
+            ascending=[False, True]).reset_index(drop=True)
+
+    def bubble(self, result=None):
+        """
+        Teams whose place in the field depends on the live conferences
+        """
+        if result is None:
+            result = self.compute()
+        eps = 1e-12
+        return result[(result['p_field'] > eps) &
+            (result['p_field'] < 1 - eps)].reset_index(drop=True)
@@ -4,6 +4,8 @@
 Scripts to download the various metrics
 """
 
+from array import array
+
 import requests
 import time
 import re
@@ -11,7 +13,9 @@ import re
 import numpy as np
 import pandas as pd
 
+import progress
 from bs4 import BeautifulSoup
+from lxml import etree
 from selenium import webdriver
 
 def principal_period(s):
@@ -21,100 +25,276 @@ def principal_period(s):
     i = (s+s).find(s, 1, -1)
     return None if i == -1 else s[:i]
 
+# KenPom ratings table: non-empty cell -> column. Ranks of the adjusted
+# stats sit between them; -2 is the non-conference SOS
+KENPOM_COLUMNS = [('Rk', 0), ('Team', 1), ('Conf', 2), ('W-L', 3),
+    ('AdjEM', 4), ('AdjO', 5), ('AdjD', 7), ('AdjT', 9), ('Luck', 11),
+    ('SOS', -2)]
+KENPOM_NUMERIC = ['AdjEM', 'AdjO', 'AdjD', 'AdjT', 'Luck', 'SOS']
+
+# BPI table, dropping the trailing rank change column
+BPI_COLUMNS = [('Rk', 0), ('Team', 1), ('Conf', 2), ('W-L', 3),
+    ('BPI_OFF', 4), ('BPI_DEF', 5), ('BPI', 6)]
+BPI_NUMERIC = ['Rk', 'BPI_OFF', 'BPI_DEF', 'BPI']
+BPI_PAGES = 8
+
+# Dokter Entropy rows: rank, team name of any number of words, then these
+DOKENT_NUMERIC = ['w', 'l', 'power', 'sched', 'offen', 'defen']
+
+# the parser's memory grows with the chunk it is fed, and larger chunks
+# don't parse faster
+CHUNK_SIZE = 1 << 14
+
+def _cell_text(td):
+    # most cells are plain text; only ones with markup need itertext
+    if len(td):
+        return ''.join(td.itertext()).strip()
+    return (td.text or '').strip()
+
+def _drop_previous(el):
+    # frees the elements before el that were read already
+    parent = el.getparent()
+    while el.getprevious() is not None:
+        del parent[0]
+
+def iter_table_rows(chunks, table_index=0):
+    """
+    Streams the rows of one <table> out of HTML arriving in chunks.
+
+    Inputs:
+        chunks: Iterable of str (or utf-8 bytes) pieces of the page, e.g.
+            _stream(url)
+        table_index: Which table, counting every <table> in document order
+            (as BeautifulSoup's find_all('table') does)
+    Outputs:
+        Yields each row as the list of its non-empty, stripped <td> texts.
+        Rows without cells, like header rows of <th>, are skipped.
+
+    Rows are dropped from the tree as soon as they are read, and parsing
+    stops at the end of the table, so the rest of the page is never read.
+    Only table starts and ends and row ends come back from the parser; a
+    row's cells are read off the row element.
+    """
+    # lxml parses utf-8 bytes much faster than str
+    parser = etree.HTMLPullParser(events=('start', 'end'),
+        tag=('table', 'tr'), encoding='utf-8')
+    open_tables = []
+    n_tables = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        parser.feed(chunk)
+        for event, el in parser.read_events():
+            if el.tag == 'table':
+                if event == 'start':
+                    open_tables.append(n_tables)
+                    n_tables += 1
+                    _drop_previous(el)
+                elif open_tables.pop() == table_index:
+                    return
+            elif event == 'end' and open_tables and \
+                    open_tables[-1] == table_index:
+                row = [text for text in map(_cell_text,
+                    el.iterchildren('td')) if text]
+                if row:
+                    yield row
+                el.clear()
+                _drop_previous(el)
+
+def table_columns(rows, columns, numeric=()):
+    """
+    Collects the wanted cells of each row into typed column buffers.
+
+    Inputs:
+        rows: Iterable of lists of cell texts
+        columns: List of (name, index into the row)
+        numeric: Names of columns converted to float as they arrive
+    Outputs:
+        Dictionary of name -> list of str, or array of float for numeric
+        columns. Rows too short for every index are skipped
+    """
+    buffers = {name: array('d') if name in numeric else []
+        for name, _ in columns}
+    picks = [(buffers[name].append, float if name in numeric else str, idx)
+        for name, idx in columns]
+    need = max(i if i >= 0 else -i - 1 for _, i in columns) + 1
+    for row in rows:
+        if len(row) < need:
+            continue
+        for append, cast, idx in picks:
+            append(cast(row[idx]))
+    return buffers
+
+def _is_numeric(fields):
+    try:
+        [float(f) for f in fields]
+    except ValueError:
+        return False
+    return True
+
+def parse_whitespace_table(text, columns, n_numeric, widths=None):
+    """
+    General parser for preformatted ratings tables like Dokter Entropy's:
+    a rank, a team name of any number of words and n_numeric numbers per
+    line. Lines that don't fit (headers, notes, blank lines) are skipped.
+
+    Inputs:
+        text: The table's text
+        columns: Names of the rank, team and numeric columns, in order
+        n_numeric: Number of numeric fields after the team name
+        widths: Optional list of fixed field widths (rank, team, numbers...)
+            for layouts where team names may contain numbers. Default:
+            fields split on whitespace, numbers taken from the right
+    Outputs:
+        DataFrame with float rank and numeric columns
+    """
+    ranks, teams, values = [], [], []
+    if widths is None:
+        for line in text.split('\n'):
+            fields = line.split()
+            if len(fields) < n_numeric + 2 or not fields[0].isdigit():
+                continue
+            ranks.append(fields[0])
+            teams.append(' '.join(fields[1:-n_numeric]))
+            values.append(fields[-n_numeric:])
+        try:
+            # all the numbers in one conversion
+            numbers = np.array(values, dtype=float)
+        except ValueError:
+            # some line isn't a team's; drop those one by one
+            keep = [i for i, row in enumerate(values) if _is_numeric(row)]
+            ranks = [ranks[i] for i in keep]
+            teams = [teams[i] for i in keep]
+            numbers = np.array([values[i] for i in keep], dtype=float)
+        numbers = numbers.reshape(len(ranks), n_numeric)
+    else:
+        edges = np.cumsum([0] + list(widths))
+        bounds = list(zip(edges[:-1], edges[1:]))
+        for line in text.split('\n'):
+            fields = [line[a:b].strip() for a, b in bounds]
+            if len(fields) != n_numeric + 2 or not fields[1] or \
+                    not _is_numeric([fields[0]] + fields[2:]):
+                continue
+            ranks.append(fields[0])
+            teams.append(fields[1])
+            values.append(fields[2:])
+        numbers = np.array(values, dtype=float).reshape(len(values),
+            n_numeric)
+
+    data = {columns[0]: np.array(ranks, dtype=float), columns[1]: teams}
+    data.update(zip(columns[2:], numbers.T))
+    return pd.DataFrame(data, columns=columns)
+
+def _stream(url):
+    """
+    Yields the body of a GET request in decoded text chunks as it downloads
+    """
+    with requests.get(url, stream=True) as r:
+        r.raise_for_status()
+        # pages without a declared charset are utf-8 in practice
+        r.encoding = r.encoding or 'utf-8'
+        for chunk in r.iter_content(CHUNK_SIZE, decode_unicode=True):
+            yield chunk
+
+def parse_kenpom(chunks):
+    """
+    KenPom ratings DataFrame from the chunks of the ratings page
+    """
+    buffers = table_columns(iter_table_rows(chunks, 0), KENPOM_COLUMNS,
+        KENPOM_NUMERIC)
+    return pd.DataFrame(buffers, columns=[c for c, _ in KENPOM_COLUMNS])
+
 def download_kenpom():
     """
     utility to download kenpom metric data
 
     """
     URL = "https://kenpom.com/"
-    r = requests.get(URL)
-    soup = BeautifulSoup(r.text, 'lxml')
-
-    table = soup.find('table')
-    rows = table.find_all('tr')
-
-    ot_data = []
-    for row in rows:
-        cols = row.find_all('td')
-        cols = [ele.text.strip() for ele in cols]
-        ot_data.append([ele for ele in cols if ele])
-
-    ot_data = [x for x in ot_data if x]
-
-    df_cols = ['Rk','Team','Conf','W-L','AdjEM','AdjO','AdjD','AdjT','Luck',
-        'SOS']
-    ot_data_cols_to_keep = [0,1,2,3,4,5,7,9,11,-2]
-
-    ot_data = np.array(ot_data)
-
-    kenpom_df = pd.DataFrame(
-        ot_data[:,ot_data_cols_to_keep],
-        columns = df_cols
-    )
-
-    cols_to_numeric = ['AdjEM','AdjEM','AdjO','AdjD','AdjT','Luck','SOS']
-    
-    for col in cols_to_numeric:
-        kenpom_df[col] = kenpom_df[col].astype('float')
-    
+    kenpom_df = parse_kenpom(_stream(URL))
     kenpom_df.to_csv("csv_files/kenpom.csv")
 
+def parse_dokent(chunks):
+    """
+    Dokter Entropy ratings DataFrame from the chunks of the ratings page,
+    whose ratings are the preformatted text of its first <p>
+    """
+    parser = etree.HTMLPullParser(events=('end',), tag='p')
+    text = None
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, el in parser.read_events():
+            text = el.text or ''
+            break
+        if text is not None:
+            break
+    if text is None:
+        text = ''
+    return parse_whitespace_table(text,
+        ['Rk', 'Team'] + DOKENT_NUMERIC, len(DOKENT_NUMERIC))
+
 def download_dokent():
     """
     utility to download dokter entropy metric data
 
     """
     URL = "http://www.timetravelsports.com/r2019.CBB"
-    r = requests.get(URL)
-    soup = BeautifulSoup(r.text, 'lxml')
-
-    data = []
-    
-    for row in soup.p.contents[0].split('\n'):
-        current_line = row.split()
-        if len(current_line) == 8:
-            data.append(current_line)
-        elif len(current_line) == 9:
-            team_name = "%s %s" % (current_line[1],current_line[2])
-            current_line.pop(1)
-            current_line.pop(1)
-            current_line.insert(1,team_name)
-            data.append(current_line)
-        elif len(current_line) == 10:
-            team_name = "%s %s %s" % (\
-                current_line[1],current_line[2],current_line[3])
-            current_line.pop(1)
-            current_line.pop(1)
-            current_line.pop(1)
-            current_line.insert(1,team_name)
-            data.append(current_line)
-        else:
-            continue
+    dokent_df = parse_dokent(_stream(URL))
 
-    data_np = np.array(data[1:])
-
-    # Get column names    
-    columns = data[0]
-
-    columns.pop(3)
-    columns.insert(0, 'Rk')
-
-    # Rename team to Team to match my convention throughout
-    columns.pop(1)
-    columns.insert(1, 'Team')
-
-    dokent_df = pd.DataFrame(
-        data_np,
-        columns = columns
-    )
+    # this could end up being a problem
+    dokent_df.to_csv("csv_files/dokent.csv")
 
-    cols_to_numeric = ['Rk','w','l','power','sched','offen','defen']
+# these correspond to Massey naming convention
+BPI_EDGE_CASES = {
+    'DePaulDEP':'DePaul',
+    'Florida A&MFAMU':'Florida A&M',
+    'Alabama A&MAAMU':'Alabama A&M',
+    'IUPUIIUPU':'IUPUI',
+    'Texas A&MTA&M':'Texas A&M',
+    'Prairie View A&MPV':'Prairie View A&M',
+    'Texas A&M-CCAMCC':'TAM C. Christi',
+    'North Carolina A&TNCAT':'NC A&T',
+    'Miami (OH)M-OH':'Miami OH',
+    'St. Francis (PA)SFPA':'St Francis PA',
+    'St. Francis (BKN)SFBK':'St Francis NY',
+    'Loyola (MD)L-MD':'Loyola MD'
+}
+
+_LOWER_UPPER = re.compile('[a-z]{1}[A-Z]')
+
+def bpi_team_name(team):
+    """
+    Massey-style name from ESPN's team cell, which runs the full name and
+    the abbreviation together (or repeats the name)
+    """
+    # go through list, if you find a match, drop text after match
+    period = principal_period(team)
+    if period is not None:
+        team = period
+
+    # gonna have to do edge cases separately
+    if team in BPI_EDGE_CASES:
+        return BPI_EDGE_CASES[team]
+    match = _LOWER_UPPER.search(team)
+    if match is not None:
+        return team[:match.span()[0] + 1]
+    return team
+
+def parse_bpi(pages):
+    """
+    BPI ratings DataFrame from the pages of the ratings table
 
-    for col in cols_to_numeric:
-        dokent_df[col] = dokent_df[col].astype('float')
+    Inputs:
+        pages: Iterable of chunk iterables, one per page. Each page's rows
+            go straight into the same column buffers
+    """
+    def rows():
+        for chunks in pages:
+            for row in iter_table_rows(chunks, 1):
+                yield row
 
-    # this could end up being a problem
-    dokent_df.to_csv("csv_files/dokent.csv")
+    buffers = table_columns(rows(), BPI_COLUMNS, BPI_NUMERIC)
+    buffers['Team'] = [bpi_team_name(t) for t in buffers['Team']]
+    return pd.DataFrame(buffers, columns=[c for c, _ in BPI_COLUMNS])
 
 def download_bpi():
     """
@@ -122,95 +302,15 @@ def download_bpi():
 
     """
     URL = "http://www.espn.com/mens-college-basketball/bpi/_/view/bpi"
-    r = requests.get(URL)
-    soup = BeautifulSoup(r.text, 'lxml')
-
-    table = soup.find_all('table')[1]
-    rows = table.find_all('tr')
 
-    data = []
-    for row in rows:
-        cols = row.find_all('td')
-        cols = [ele.text.strip() for ele in cols]
-        data.append([ele for ele in cols if ele])
-
-    data = [x for x in data if x]
-
-    data_np = np.array(data)
-
-    for page in range(2,9):
-        URL = 'http://www.espn.com/mens-college-basketball/bpi/_/view/bpi/page/%d' % page
-        r = requests.get(URL)
-        soup = BeautifulSoup(r.text, 'lxml')
-
-        table = soup.find_all('table')[1]
-        rows = table.find_all('tr')
-
-        data = []
-        for row in rows:
-            cols = row.find_all('td')
-            cols = [ele.text.strip() for ele in cols]
-            data.append([ele for ele in cols if ele])
-
-        data = [x for x in data if x]
-
-        data_np_temp = np.array(data)
-        
-        data_np = np.append(data_np,data_np_temp,axis=0)
-        
-        # don't blitz the API
-        time.sleep(3)
-
-    # go through list, if you find a match, drop text after match
-    data_non_repeats = [ principal_period(s) if principal_period(s) is not None else s for s in data_np[:,1] ]
-    team_str = []
-
-    lowerUPPER_str_pattern = re.compile('[a-z]{1}[A-Z]')
-
-    # these correspond to Massey naming convention
-    edge_cases = {
-        'DePaulDEP':'DePaul',
-        'Florida A&MFAMU':'Florida A&M',
-        'Alabama A&MAAMU':'Alabama A&M',
-        'IUPUIIUPU':'IUPUI',
-        'Texas A&MTA&M':'Texas A&M',
-        'Prairie View A&MPV':'Prairie View A&M',
-        'Texas A&M-CCAMCC':'TAM C. Christi',
-        'North Carolina A&TNCAT':'NC A&T',
-        'Miami (OH)M-OH':'Miami OH',
-        'St. Francis (PA)SFPA':'St Francis PA',
-        'St. Francis (BKN)SFBK':'St Francis NY',
-        'Loyola (MD)L-MD':'Loyola MD'
-    }
-
-    for team in data_non_repeats:
-        # gonna have to do edge cases separately
-        if team in edge_cases.keys():
-            team_str.append(edge_cases[team])
-            
-        elif lowerUPPER_str_pattern.search(team) is not None:
-            first_to_cut = lowerUPPER_str_pattern.search(team).span()[0] + 1
-            team_str.append(team[:first_to_cut])
-        
-        else:
-            team_str.append(team)
-        
-    data_np[:,1] = np.array(team_str)
-
-    # add the columns and put in df. Drop rank change column
-    df_cols = ['Rk','Team','Conf','W-L','BPI_OFF','BPI_DEF','BPI']
-    data_cols_to_keep = list(range(7))
-
-    bpi_df = pd.DataFrame(
-        data_np[:,data_cols_to_keep],
-        columns = df_cols
-    )
-
-    cols_to_numeric = ['Rk','BPI_OFF','BPI_DEF','BPI']
-
-    for col in cols_to_numeric:
-        bpi_df[col] = bpi_df[col].astype('float')
+    def pages():
+        yield _stream(URL)
+        for page in progress.track(range(2, BPI_PAGES + 1), 'BPI pages'):
+            # don't blitz the API
+            time.sleep(3)
+            yield _stream(URL + '/page/%d' % page)
 
+    bpi_df = parse_bpi(pages())
     bpi_df.to_csv("csv_files/bpi.csv") 
     
 def download_massey():
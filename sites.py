@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+"""
+First-weekend site assignment for the protected seeds.
+
+The committee sends the top seeds to first/second-round sites close to
+campus. Each pod of a region (the four teams that can meet by the second
+round, e.g. the 1/16/8/9 pod) plays at one site, and its protected seed is
+its best seed. Given local tables of
+
+    campuses    Team, lat, lon (Massey team names)
+    sites       site, lat, lon, and optionally capacity (pods the site
+                hosts, default 2), host (school hosting it) and host_conf
+                (conference hosting it)
+
+SiteTable computes the team x site distance matrix once with a vectorized
+haversine, then each assignment is a linear assignment of pods to site
+slots solved with the Hungarian algorithm. The cost of a pod at a site is
+the protected seed's distance, weighted so better seed lines count more
+(by default 8, 4, 2, 1 for the 1 to 4 lines). A pod can't go to a site
+hosted by one of its teams or by one of its teams' conference.
+
+The distance matrix and slots are reused, so an assignment costs a few
+dictionary lookups and a 16 x 16 assignment problem and can be rerun for
+every variant of a sweep:
+
+    table = SiteTable.from_csv('csv_files/campuses.csv',
+        'csv_files/sites.csv')
+    table.assign(bracket.final_68, bracket.bracket_format)
+"""
+
+import numpy as np
+import pandas as pd
+
+from bracket_format import DEFAULT_FORMAT
+from bracket_pdf import bracket_slots
+
+EARTH_RADIUS_MILES = 3958.8
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in miles between every pair of points, by
+    broadcasting: pass column and row vectors for a full matrix
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float))
+        for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2.) ** 2 + np.cos(lat1) * np.cos(lat2) * \
+        np.sin((lon2 - lon1) / 2.) ** 2
+    return 2. * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1.)))
+
+
+def linear_assignment(cost):
+    """
+    Minimum cost assignment of rows to distinct columns (Hungarian
+    algorithm with potentials, O(n^2 m), the scan over columns vectorized).
+
+    Inputs:
+        cost: (n, m) array with n <= m. np.inf marks forbidden pairs
+    Outputs:
+        Array of the column assigned to each row
+    Raises:
+        ValueError if every assignment uses a forbidden pair
+    """
+    cost = np.asarray(cost, dtype=float)
+    n, m = cost.shape
+    if n > m:
+        raise ValueError('More rows ({}) than columns ({}) to assign them '
+            'to'.format(n, m))
+    forbidden = ~np.isfinite(cost)
+    if forbidden.any():
+        # large enough that one forbidden pair costs more than any
+        # assignment without
+        finite = cost[~forbidden]
+        big = (np.abs(finite).max() + 1.) * (n + 1) if finite.size else 1.
+        cost = np.where(forbidden, big, cost)
+
+    # 1-based columns with 0 as the virtual start column, as usual
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=int)
+    way = np.zeros(m + 1, dtype=int)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+            masked = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(masked)) + 1
+            delta = masked[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    assignment = np.empty(n, dtype=int)
+    cols = np.nonzero(p[1:])[0]
+    assignment[p[cols + 1] - 1] = cols
+    if forbidden[np.arange(n), assignment].any():
+        raise ValueError('No assignment satisfies every constraint')
+    return assignment
+
+
+def pods(final_68, bracket_format=None):
+    """
+    The pods of the bracket.
+
+    Outputs:
+        List of dictionaries with region, protected team, its seed and the
+        members (every team that can play in the pod, both teams of a
+        play-in game included), in region then pod order
+    """
+    fmt = bracket_format or DEFAULT_FORMAT
+    slots = bracket_slots(final_68, fmt)
+    seeds = dict(zip(final_68['Team'], final_68['seed'].astype(int)))
+    size = fmt.region_size
+    pod_size = len(fmt.pods[0])
+    result = []
+    for r in range(fmt.n_regions):
+        region = slots[r * size:(r + 1) * size]
+        for k in range(0, size, pod_size):
+            members = []
+            for slot in region[k:k + pod_size]:
+                if isinstance(slot, tuple):
+                    members.extend(slot)
+                elif slot is not None:
+                    members.append(slot)
+            protected = min(members, key=lambda t: seeds[t])
+            result.append({'region': fmt.region_names[r],
+                'team': protected, 'seed': seeds[protected],
+                'members': members})
+    return result
+
+
+class SiteTable(object):
+    """
+    Inputs:
+        campuses: DataFrame with Team, lat and lon
+        sites: DataFrame with site, lat, lon and optionally capacity, host
+            and host_conf
+    """
+    def __init__(self, campuses, sites):
+        for df, cols, name in ((campuses, ['Team', 'lat', 'lon'],
+                'campuses'), (sites, ['site', 'lat', 'lon'], 'sites')):
+            missing = [c for c in cols if c not in df.columns]
+            if missing:
+                raise ValueError('{} table is missing column(s) {}'.format(
+                    name, ', '.join(missing)))
+
+        self.teams = campuses['Team'].astype(str).values
+        self.team_index = {t: i for i, t in enumerate(self.teams)}
+        self.sites = sites['site'].astype(str).values
+        # team x site, computed once
+        self.distance = haversine(
+            campuses['lat'].values[:, None], campuses['lon'].values[:, None],
+            sites['lat'].values[None, :], sites['lon'].values[None, :])
+
+        capacity = sites['capacity'].fillna(2).astype(int).values \
+            if 'capacity' in sites.columns else np.full(len(sites), 2)
+        # one column per pod a site can take
+        self.slot_site = np.repeat(np.arange(len(sites)), capacity)
+
+        def column(name):
+            if name not in sites.columns:
+                return [None] * len(sites)
+            return [None if pd.isna(x) else str(x) for x in sites[name]]
+
+        self.hosts = column('host')
+        self.host_confs = column('host_conf')
+
+    @classmethod
+    def from_csv(cls, campuses_path, sites_path):
+        return cls(pd.read_csv(campuses_path), pd.read_csv(sites_path))
+
+    def seed_weights(self, seeds):
+        """
+        Default weights of the protected seed lines: each line counts
+        twice as much as the next
+        """
+        lines = sorted(set(seeds))
+        return {s: 2. ** (len(lines) - 1 - k) for k, s in enumerate(lines)}
+
+    def cost_matrix(self, pod_list, conf=None, seed_weights=None):
+        """
+        (pods, site slots) cost of each pod at each slot: the weighted
+        distance of its protected seed, np.inf where a member's school or
+        conference hosts the site
+        """
+        missing = [p['team'] for p in pod_list
+            if p['team'] not in self.team_index]
+        if missing:
+            raise ValueError('No campus location for {}'.format(
+                ', '.join(missing)))
+        if seed_weights is None:
+            seed_weights = self.seed_weights([p['seed'] for p in pod_list])
+
+        rows = [self.team_index[p['team']] for p in pod_list]
+        weights = np.array([seed_weights.get(p['seed'], 1.)
+            for p in pod_list])
+        cost = self.distance[rows] * weights[:, None]
+
+        conf = conf or {}
+        for k, pod in enumerate(pod_list):
+            members = set(pod['members'])
+            confs = {conf.get(t) for t in pod['members']} - {None}
+            for s, (host, host_conf) in enumerate(zip(self.hosts,
+                    self.host_confs)):
+                if host in members or host_conf in confs:
+                    cost[k, s] = np.inf
+        return cost[:, self.slot_site]
+
+    def assign(self, final_68, bracket_format=None, seed_weights=None):
+        """
+        Sites of every pod of the field.
+
+        Inputs:
+            final_68: Field DataFrame with Team, seed and optionally Conf
+            bracket_format: BracketFormat of the field
+            seed_weights: Optional dict of protected seed line -> weight of
+                its distance
+        Outputs:
+            DataFrame with region, team (protected seed), seed, site, miles
+            and members, one row per pod
+        """
+        pod_list = pods(final_68, bracket_format)
+        if len(pod_list) > len(self.slot_site):
+            raise ValueError('{} pods but only {} site slots'.format(
+                len(pod_list), len(self.slot_site)))
+        conf = dict(zip(final_68['Team'], final_68['Conf'])) \
+            if 'Conf' in final_68.columns else None
+
+        cost = self.cost_matrix(pod_list, conf, seed_weights)
+        site = self.slot_site[linear_assignment(cost)]
+        rows = [self.team_index[p['team']] for p in pod_list]
+        return pd.DataFrame({
+            'region': [p['region'] for p in pod_list],
+            'team': [p['team'] for p in pod_list],
+            'seed': [p['seed'] for p in pod_list],
+            'site': self.sites[site],
+            'miles': self.distance[rows, site],
+            'members': [', '.join(p['members']) for p in pod_list],
+        })
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+"""
+What changed between two compare.csv snapshots.
+
+Both snapshots go through the same selection settings (get_tourney_teams
+via the pipeline's select stage), and teams are joined on a canonical id so
+small formatting differences in names between downloads ("St. Mary's" and
+"St Mary's") don't show up as a team leaving and another entering. The
+diff holds
+
+    * teams entering and leaving the field, and bid changes (auto <->
+      at-large)
+    * seed line moves of teams in both fields
+    * composite rank moves (final_rank position)
+    * rank deltas of every poll for every team, computed as one array
+      difference over the teams x polls matrices aligned on team id and
+      poll, with the biggest risers and fallers of each poll
+
+A loaded Snapshot is reused, so in watch mode a refresh only parses and
+selects the new download.
+"""
+
+import contextlib
+import io
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+from pipeline import _parse, _select, bracket_from_selection, file_hash
+from poll_analysis import poll_ranks
+
+_NOT_ALNUM = re.compile(r'[^0-9a-z]+')
+
+
+def team_id(name):
+    """
+    Canonical id of a team name: lowercase letters and digits, everything
+    else dropped
+    """
+    return _NOT_ALNUM.sub('', str(name).lower())
+
+
+class Snapshot(object):
+    """
+    One parsed snapshot and its selection.
+
+    Inputs:
+        path: compare.csv snapshot
+        selection: Dictionary of get_tourney_teams settings, as for the
+            pipeline's select stage
+        bracket_format: Dictionary of BracketFormat arguments
+    """
+    def __init__(self, path, selection=None, bracket_format=None):
+        self.path = path
+        self.hash = file_hash(path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            parsed = _parse({}, {'download': path})
+            selected = _select({'format': bracket_format or {},
+                'selection': selection or {}}, {'parse': parsed})
+        bracket = bracket_from_selection(parsed, selected, csv_path=path)
+
+        df = parsed['team_data_df']
+        self.names = pd.Series(df['Team'].values,
+            index=[team_id(t) for t in df['Team']])
+        self.names = self.names[~self.names.index.duplicated()]
+
+        summary = bracket.summary_df
+        ids = [team_id(t) for t in summary['Team']]
+        self.position = pd.Series(np.arange(1, len(ids) + 1), index=ids)
+        self.position = self.position[~self.position.index.duplicated()]
+
+        field = bracket.final_68
+        auto = set(bracket.auto_bid_teams)
+        self.field = pd.DataFrame({
+            'seed': field['seed'].values,
+            'bid': ['auto' if t in auto else 'at-large'
+                for t in field['Team']],
+        }, index=[team_id(t) for t in field['Team']])
+
+        ranks = poll_ranks(df)
+        ranks.index = [team_id(t) for t in ranks.index]
+        self.ranks = ranks[~ranks.index.duplicated()]
+
+
+def load_snapshot(path, selection=None, bracket_format=None, _memo={}):
+    """
+    Snapshot of path, reused while the file and settings are unchanged
+    """
+    key = (path, file_hash(path), json.dumps(selection, sort_keys=True),
+        json.dumps(bracket_format, sort_keys=True))
+    if key not in _memo:
+        # a watch only ever needs the baseline and the latest refresh
+        if len(_memo) >= 4:
+            _memo.clear()
+        _memo[key] = Snapshot(path, selection, bracket_format)
+    return _memo[key]
+
+
+def _name(old, new, tid):
+    return new.names.get(tid, old.names.get(tid, tid))
+
+
+def rank_deltas(old, new):
+    """
+    Rank change of every team in every poll ranked in both snapshots, as a
+    teams x polls DataFrame indexed by team name. Positive is a rise (old
+    rank - new rank); NaN where either snapshot doesn't rank the team.
+    """
+    polls = [p for p in new.ranks.columns if p in old.ranks.columns]
+    teams = new.ranks.index.intersection(old.ranks.index)
+    delta = old.ranks.reindex(index=teams, columns=polls).to_numpy() - \
+        new.ranks.reindex(index=teams, columns=polls).to_numpy()
+    return pd.DataFrame(delta, columns=polls,
+        index=[_name(old, new, t) for t in teams])
+
+
+def _movers(deltas, top):
+    """
+    Top risers and fallers of every poll from the deltas matrix
+    """
+    values = deltas.to_numpy()
+    teams = deltas.index.values
+    # NaN sorts last both ways
+    rise_order = np.argsort(np.where(np.isnan(values), np.inf, -values),
+        axis=0, kind='stable')[:top]
+    fall_order = np.argsort(np.where(np.isnan(values), np.inf, values),
+        axis=0, kind='stable')[:top]
+
+    movers = {}
+    for j, poll in enumerate(deltas.columns):
+        column = values[:, j]
+        rise = [(teams[i], int(column[i])) for i in rise_order[:, j]
+            if column[i] > 0]
+        fall = [(teams[i], int(column[i])) for i in fall_order[:, j]
+            if column[i] < 0]
+        if rise or fall:
+            movers[poll] = {'risers': rise, 'fallers': fall}
+    return movers
+
+
+def diff_snapshots(old, new, top=5):
+    """
+    Inputs:
+        old, new: Snapshot
+        top: Risers and fallers kept per poll, and composite movers kept
+    Outputs:
+        Dictionary with entered, left, bid_changes, seed_changes (lists of
+        dicts), composite movers and per poll movers, plus the full
+        rank_deltas DataFrame under 'rank_deltas'
+    """
+    entered_ids = new.field.index.difference(old.field.index)
+    left_ids = old.field.index.difference(new.field.index)
+    both = new.field.index.intersection(old.field.index)
+
+    entered = [{'team': _name(old, new, t), 'seed': int(new.field.at[t,
+        'seed']), 'bid': new.field.at[t, 'bid']} for t in entered_ids]
+    left = [{'team': _name(old, new, t), 'seed': int(old.field.at[t,
+        'seed']), 'bid': old.field.at[t, 'bid']} for t in left_ids]
+
+    o, n = old.field.loc[both], new.field.loc[both]
+    moved = both[(o['seed'].values != n['seed'].values)]
+    seed_changes = sorted(({'team': _name(old, new, t),
+        'old_seed': int(old.field.at[t, 'seed']),
+        'new_seed': int(new.field.at[t, 'seed'])} for t in moved),
+        key=lambda c: (c['new_seed'] - c['old_seed'], c['new_seed']))
+    changed = both[(o['bid'].values != n['bid'].values)]
+    bid_changes = [{'team': _name(old, new, t), 'old_bid': old.field.at[t,
+        'bid'], 'new_bid': new.field.at[t, 'bid']} for t in changed]
+
+    common = new.position.index.intersection(old.position.index)
+    change = old.position[common] - new.position[common]
+    change = change[change != 0].sort_values(kind='stable')
+    composite = {
+        'risers': [(_name(old, new, t), int(c)) for t, c in
+            change[::-1][:top].items() if c > 0],
+        'fallers': [(_name(old, new, t), int(c)) for t, c in
+            change[:top].items() if c < 0],
+    }
+
+    deltas = rank_deltas(old, new)
+    return {
+        'old': old.path,
+        'new': new.path,
+        'entered': sorted(entered, key=lambda e: e['seed']),
+        'left': sorted(left, key=lambda e: e['seed']),
+        'bid_changes': bid_changes,
+        'seed_changes': seed_changes,
+        'composite': composite,
+        'polls': _movers(deltas, top),
+        'rank_deltas': deltas,
+    }
+
+
+def to_json(diff, path=None):
+    """
+    Compact JSON of a diff, without the full rank_deltas matrix. Written to
+    path if given, returned otherwise
+    """
+    record = {k: v for k, v in diff.items() if k != 'rank_deltas'}
+    text = json.dumps(record, separators=(',', ':'))
+    if path is None:
+        return text
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def format_diff(diff):
+    """
+    Short text report of a diff
+    """
+    lines = []
+    if not diff['entered'] and not diff['left'] and \
+            not diff['seed_changes'] and not diff['bid_changes']:
+        lines.append('Field and seeds unchanged')
+    for e in diff['entered']:
+        lines.append('IN   {:<22} {:>2} seed ({})'.format(e['team'],
+            e['seed'], e['bid']))
+    for e in diff['left']:
+        lines.append('OUT  {:<22} was {:>2} seed ({})'.format(e['team'],
+            e['seed'], e['bid']))
+    for c in diff['bid_changes']:
+        lines.append('BID  {:<22} {} -> {}'.format(c['team'], c['old_bid'],
+            c['new_bid']))
+    for c in diff['seed_changes']:
+        lines.append('SEED {:<22} {:>2} -> {:>2}'.format(c['team'],
+            c['old_seed'], c['new_seed']))
+
+    def moves(pairs):
+        return ', '.join('{} {:+d}'.format(t, d) for t, d in pairs) or '-'
+
+    lines.append('Composite  up: {}'.format(moves(
+        diff['composite']['risers'])))
+    lines.append('         down: {}'.format(moves(
+        diff['composite']['fallers'])))
+    for poll, m in diff['polls'].items():
+        lines.append('{:<5} up: {} | down: {}'.format(poll,
+            moves(m['risers']), moves(m['fallers'])))
+    return '\n'.join(lines)
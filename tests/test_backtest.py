@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backtest import score_selection
+from pipeline import _parse, _select, bracket_from_selection
+
+
+class ScoreSelectionTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with contextlib.redirect_stdout(io.StringIO()):
+            parsed = _parse({}, {'download': os.path.join(ROOT,
+                'masseyratings.csv')})
+            selected = _select({'format': {}, 'selection': {
+                'human_polls': False}}, {'parse': parsed})
+        cls.bracket = bracket_from_selection(parsed, selected)
+
+    def test_bubble_swap(self):
+        # the last at-large team swapped for the first team out: two of the
+        # eight bubble calls are wrong
+        bracket = self.bracket
+        field = bracket.final_68[['Team', 'seed']].copy()
+        summary = bracket.summary_df
+        others = summary['Team'][~summary['Team'].isin(
+            bracket.auto_bid_teams)].tolist()
+        n_at_large = len(bracket.at_large_teams)
+        last_in, first_out = others[n_at_large - 1], others[n_at_large]
+        field.loc[field['Team'] == last_in, 'Team'] = first_out
+
+        scores = score_selection(bracket, field)
+        self.assertAlmostEqual(scores['bubble_accuracy'], 0.75)
+        self.assertAlmostEqual(scores['field_overlap'], 67 / 68.)
+
+
+if __name__ == '__main__':
+    unittest.main()
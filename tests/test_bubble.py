@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bracket_format import BracketFormat
+from bubble import bubble_margins
+from metrics import Bracketeer, rank_calc
+from pipeline import _parse
+
+
+class BubbleMarginsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with contextlib.redirect_stdout(io.StringIO()):
+            cls.parsed = _parse({}, {'download': os.path.join(ROOT,
+                'masseyratings.csv')})
+        cls.bracket = cls.select()
+        cls.margins = bubble_margins(cls.bracket).set_index('Team')
+
+    @classmethod
+    def select(cls, team=None, change=0.):
+        # runs the selection again with one team's final rank moved
+        bracket = Bracketeer.from_dataframe(cls.parsed['team_data_df'],
+            cls.parsed['header_data'], BracketFormat())
+        moved = None if team is None else cls.margins.loc[team,
+            'final_rank']
+
+        def rank(x, y):
+            return x + change if x == moved else rank_calc(x, y)
+        with contextlib.redirect_stdout(io.StringIO()):
+            bracket.get_tourney_teams(rank_calc_func=rank,
+                human_polls=False)
+        return bracket
+
+    def in_field(self, team, change):
+        return team in set(self.select(team, change).final_68['Team'])
+
+    def check_field_margin(self, team):
+        # the margin is the move that changes the team's field status
+        margin = self.margins.loc[team, 'field_margin']
+        step = 0.01 if margin > 0 else -0.01
+        inside = self.in_field(team, 0.)
+        self.assertEqual(self.in_field(team, margin - step), inside)
+        self.assertNotEqual(self.in_field(team, margin + step), inside)
+
+    def test_auto_bid_lost_to_second_team(self):
+        self.assertEqual(self.margins.loc['Akron', 'bid'], 'auto')
+        self.check_field_margin('Akron')
+        self.assertTrue(self.in_field('Miami OH', -2.2))
+
+    def test_team_out_takes_auto_bid(self):
+        self.assertEqual(self.margins.loc['Miami OH', 'bid'], 'out')
+        self.assertAlmostEqual(self.margins.loc['Miami OH', 'field_margin'],
+            -self.margins.loc['Akron', 'field_margin'])
+        self.check_field_margin('Miami OH')
+
+    def test_auto_bid_holder_kept_as_at_large(self):
+        self.check_field_margin('Michigan')
+
+    def test_at_large(self):
+        self.check_field_margin('Cincinnati')
+
+    def test_seed_down_limited_by_auto_bid(self):
+        self.assertTrue(self.margins['seed_down_margin'][
+            ['Akron', 'Hofstra', 'Troy']].isna().all())
+
+    def test_decided_auto_bid(self):
+        bracket = Bracketeer.from_dataframe(self.parsed['team_data_df'],
+            self.parsed['header_data'], BracketFormat())
+        with contextlib.redirect_stdout(io.StringIO()):
+            bracket.get_tourney_teams(conf_winners={'MAC': 'Akron'},
+                human_polls=False)
+        margins = bubble_margins(bracket).set_index('Team')
+        self.assertTrue(np.isnan(margins.loc['Akron', 'field_margin']))
+        self.assertLess(margins.loc['Miami OH', 'field_margin'], -2.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from export import bracket_tables
+from pipeline import _parse, _select, bracket_from_selection
+
+
+def _bracket(selection):
+    with contextlib.redirect_stdout(io.StringIO()):
+        parsed = _parse({}, {'download': os.path.join(ROOT,
+            'masseyratings.csv')})
+        selected = _select({'format': {}, 'selection': selection},
+            {'parse': parsed})
+    return bracket_from_selection(parsed, selected)
+
+
+class BidListsTest(unittest.TestCase):
+    def check_lists(self, bracket):
+        lists = bracket_tables(bracket, polls=False)['lists']
+        self.assertFalse(lists['team'].duplicated().any())
+        field = set(bracket.final_68['Team'])
+        out = lists[lists['list'].isin(['first_four_out', 'next_four_out'])]
+        self.assertEqual(len(out), 8)
+        self.assertFalse(field & set(out['team']))
+        return lists
+
+    def test_shipped_snapshot(self):
+        self.check_lists(_bracket({'human_polls': False}))
+
+    def test_conference_upsets(self):
+        # two more auto bids than conference leaders
+        self.check_lists(_bracket({'human_polls': False,
+            'conf_winners': {'B10': 'Iowa', 'SEC': 'Auburn'}}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import tarfile
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ingest import ingest
+
+BOM = b'\xef\xbb\xbf'
+
+
+def _snapshot():
+    with open(os.path.join(ROOT, 'masseyratings.csv'), 'rb') as f:
+        data = f.read()
+    return data[len(BOM):] if data.startswith(BOM) else data
+
+
+class IngestTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.data = _snapshot()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_snapshots_with_their_own_bom_split(self):
+        path = os.path.join(self.tmp.name, 'compare_20260301.csv')
+        with open(path, 'wb') as f:
+            f.write(b''.join(BOM + self.data for _ in range(5)))
+        stats, n_new = ingest([path])
+        self.assertEqual(n_new, 5)
+        self.assertEqual(stats.n_snapshots, 5)
+
+    def test_tar_members_in_name_order(self):
+        path = os.path.join(self.tmp.name, 'archive.tar')
+        with tarfile.open(path, 'w') as tar:
+            for day in ('20260302', '20260301'):
+                info = tarfile.TarInfo('compare_{}.csv'.format(day))
+                info.size = len(self.data)
+                tar.addfile(info, io.BytesIO(self.data))
+        summary = ingest([path])[0].summary()
+        self.assertTrue((summary['first_seen'] <= summary['last_seen']).all())
+        self.assertEqual(summary['first_seen'].min(), '2026-03-01')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+Simple game model turning composite standings into win probabilities.
+
+Teams get a strength on the scale of standardized ratings. In metrics mode
+the composite already is a mean of z-scores. In rankings mode the composite
+rank is mapped to the normal quantile it would have among all Division I
+teams. A game's margin is then normal around the strength difference scaled
+to points.
+"""
+
+from statistics import NormalDist
+
+import numpy as np
+
+# spread of team ratings in points (about the standard deviation of KenPom
+# AdjEM across Division I) and of a game's margin around its prediction
+RATING_SD = 11.
+GAME_SD = 11.
+
+
+def normal_cdf(x):
+    """
+    Vectorized standard normal cdf (Abramowitz & Stegun 7.1.26, absolute
+    error below 1e-7). numpy has no erf and scipy isn't a dependency.
+    """
+    x = np.asarray(x, dtype=float)
+    z = np.abs(x) / np.sqrt(2.)
+    t = 1. / (1. + 0.3275911 * z)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 +
+        t * (-1.453152027 + t * 1.061405429))))
+    erf = 1. - poly * np.exp(-z * z)
+    return 0.5 * (1. + np.sign(x) * erf)
+
+
+def team_strength(final_rank, use_metrics=False, n_teams=None):
+    """
+    Strength of each team in standard deviations of team ratings.
+
+    Inputs:
+        final_rank: Array of Bracketeer final_rank values
+        use_metrics: Boolean. True if final_rank is a mean of standardized
+            ratings (higher is better), false if it is a rank (lower is
+            better)
+        n_teams: Number of teams ranked, used to turn ranks into quantiles.
+            Defaults to the largest rank
+    Outputs:
+        Array of strengths, higher is better
+    """
+    final_rank = np.asarray(final_rank, dtype=float)
+    if use_metrics:
+        return final_rank
+
+    if n_teams is None:
+        n_teams = np.nanmax(final_rank)
+    quantile = np.clip((final_rank - 0.5) / n_teams, 1e-6, 1 - 1e-6)
+    inv_cdf = NormalDist().inv_cdf
+    return -np.array([inv_cdf(q) for q in quantile])
+
+
+def win_probability(margin):
+    """
+    Probability of winning a game given its predicted margin in points
+    """
+    return normal_cdf(np.asarray(margin, dtype=float) / GAME_SD)
+
+
+def win_prob_matrix(strength):
+    """
+    Matrix P where P[i, j] is the probability team i beats team j on a
+    neutral court
+    """
+    strength = np.asarray(strength, dtype=float)
+    return win_probability(
+        (strength[:, None] - strength[None, :]) * RATING_SD)